@@ -1,6 +1,7 @@
 import devices.clock
 import devices.expander
 import devices.gps
+import devices.gps_assist
 import devices.rockblock
 import devices.battery_monitor
 import devices.sx127x
@@ -14,9 +15,15 @@ exp.connect(pin_defs.exp)
 
 gps = devices.gps.GPS(clock=clock)
 gps.connect(pin_defs.gps)
+gps.output_profile = 'buoy-report'
+gps.assist = devices.gps_assist.GPSAssist(clock=clock)
+gps.assist.load()
 gps.stop()
 
 rb = devices.rockblock.RockBlock(clock=clock)
+rb.link.key = "LINK"
+if rb.link.load():
+    rb.scheduler.csq_thresh = rb.link.threshold - 1
 rb.connect(pin_defs.rb)
 rb.stop()
 
@@ -6,9 +6,11 @@ machine.freq(20000000)
 
 from apps.buoy import hal
 from apps.buoy.paikea import Paikea
+from core.outbox import Outbox
 
 
 def app_init():
+    hal.rb.outbox = Outbox(clock=hal.clock)
     hal.lora.start()
     # hal.gps.passthrough = True
     buoy.connect({'rb': hal.rb,
@@ -4,29 +4,46 @@ from core import (
 )
 from core.utils import ActivityTimer
 from core.compat import machine
+from devices import sbd_codec
+from devices.fix_quality import FixPolicy
+from devices.gps import Fix
 import os
 
 
 class PaikeaActivitiesMixin:
 
+    #: Send position reports as 16 byte binary SBD messages instead of
+    #: ascii PK001 messages
+    binary_reports = True
+
+    #: Seconds after the GPS starts before giving up on a poor sky, and the
+    #: fewest satellites at `sky_min_snr` dB-Hz or more for a good one
+    sky_check = 180
+    sky_min_sats = 3
+    sky_min_snr = 20
+
+    #: Seconds the ISU runs after starting, reporting signal and status,
+    #: before queued messages are written
+    rb_settle = 30
+
+    #: Stored settings which shore can change with CONFIG commands
+    config_keys = ('LOC_SEND', 'SAT_VIEW', 'SLEEPMODE')
+
     @staticmethod
-    def _loc_msg(data):
-        lat = data['latitude']
-        long = data['longitude']
-        NS = data['NS']
-        EW = data['EW']
-        utc = data['utc']
-        cog = data['t_course']
-        sog = data['ground_speed']
+    def _loc_msg(fix):
+        lat, NS = sbd_codec.nmea_coordinate(fix.lat, "NS")
+        long, EW = sbd_codec.nmea_coordinate(fix.lon, "EW")
+        utc = sbd_codec.nmea_utc(fix.utc)
         msg = "lat:{},NS:{},lon:{},EW:{},utc:{}".format(lat, NS, long, EW, utc)
-        if not sog:
-            sog = 0
-        if not cog:
-            cog = 0
-        msg += ",sog:{},cog:{}".format(sog, cog)
+        msg += ",sog:{:.2f},cog:{:.2f}".format(fix.sog, fix.cog)
         msg = "PK001;" + msg
         return msg
 
+    @staticmethod
+    def _loc_report(fix, status=0, batt=0):
+        return sbd_codec.encode_position(
+            fix.lat, fix.lon, fix.utc, fix.cog, fix.sog, status, batt)
+
     def idle(self):
         if self.timers['loc_send'].expired:
             self.activity = self.gps_init
@@ -46,6 +63,7 @@ class PaikeaActivitiesMixin:
             gps.signal_data.clear()
             gps.course_data.clear()
             gps.start()
+        self.fix_policy.start()
         self.timers['sat_view'].reset()
         self.activity = self.run_gps
 
@@ -57,11 +75,14 @@ class PaikeaActivitiesMixin:
             return
 
         gps.run()
+        self.fix_policy.offer(gps.fix)
 
-        if gps.signal_data and gps.location_data and gps.course_data:
-            self.signal_data.update(**gps.signal_data)
-            self.location_data.update(**gps.location_data)
-            self.course_data.update(**gps.course_data)
+        # stop as soon as the fix is good enough, or with the best fix seen
+        # once the time budget is spent
+        if self.fix_policy.done():
+            self.fix.copy(self.fix_policy.best())
+            if gps.assist:
+                print("ttff: {}s ({})".format(gps.ttff, gps.assist.strategy))
 
             if not self.beacon:
                 gps.stop()
@@ -71,53 +92,96 @@ class PaikeaActivitiesMixin:
 
         # if no fix after 15 mins, give up, gps issue
         if not self.beacon:
-            if self.clock.time() - gps.start_time > 15*60:
+            elapsed = self.clock.time() - gps.start_time
+            if elapsed > 15*60 or self.poor_sky(gps, elapsed):
                 gps.stop()
                 self.timers['loc_send'].reset()
                 self.activity = self.idle
 
+    def poor_sky(self, gps, elapsed):
+        ''' Check if the satellites in view make a fix unlikely soon, so
+            the GPS should give up early.
+
+            :param GPS gps: GPS waiting for a fix
+            :param int elapsed: seconds since the GPS was started
+            :rtype: bool
+        '''
+        if not gps.wait_for_firstfix or elapsed < self.sky_check:
+            return False
+        if not gps.sky.epochs:
+            # no satellite table, can't judge the sky
+            return False
+        if gps.sky.tracked(self.sky_min_snr) >= self.sky_min_sats:
+            return False
+        print("poor sky: {}".format(gps.sky.stats()))
+        return True
+
     def send_update(self):
         gps = self.devices.get('gps')
 
-        msg = ""
-        if gps:
-            msg_data = {}
-            msg_data.update(**self.location_data)
-            msg_data.update(**self.course_data)
-            msg += self._loc_msg(msg_data)
-            self.timers['loc_send'].reset()
-
         # FIXME: use a function to get the actual status
-        if msg:
-            status = 0
-            status |= int(self.beacon)  # bit 0, should formalize this a bit
-            msg +=",sta:{:02X}".format(status)
+        status = 0
+        status |= int(self.beacon)  # bit 0, should formalize this a bit
 
+        batt = None
         batt_mon = self.devices.get('batt_mon')
         if batt_mon:
             try:
                 batt_mon.check()
-                msg += ",batt:{}".format(batt_mon.main_v)
+                batt = batt_mon.main_v
             except Exception:
                 pass
 
+        msg = ""
+        if gps:
+            self.timers['loc_send'].reset()
+
+            if self.binary_reports:
+                try:
+                    msg = self._loc_report(self.fix, status, batt or 0)
+                except Exception as e:
+                    print("send_update: {}".format(e))
+            else:
+                msg += self._loc_msg(self.fix)
+                msg += ",sta:{:02X}".format(status)
+
+        if batt is not None and not self.binary_reports:
+            msg += ",batt:{}".format(batt)
+
         if msg:
-            self.messages.append(msg)
+            self.queue_message(msg)
             self.activity = self.send_message
         else:
             self.activity = self.idle
 
+    def queue_message(self, msg):
+        rb = self.devices.get('rb')
+        if rb and rb.outbox is not None:
+            rb.queue_message(msg)
+        else:
+            self.messages.append(msg)
+
     def send_message(self):
         rb = self.devices.get('rb')
         rb.start()
         rb.run()
         self.check_iridium()
-        self.clock.sleep(30)
+        timer = self.timers['rb_settle']
+        timer.reset()
+        timer.start()
+        self.activity = self.settle_rb
+
+    def settle_rb(self):
+        # the driver and the beacon keep running while the ISU settles
+        rb = self.devices.get('rb')
         rb.run()
         self.check_iridium()
+        if not self.timers['rb_settle'].expired:
+            return
+        self.timers['rb_settle'].stop()
         rb.atcmd("+CIER?", False)
         if len(self.messages) > 0:
-            msg = self.messages.pop(0)
+            msg = rb.pack_messages(self.messages)
             rb.send_message(msg)
         self.activity = self.run_rb
 
@@ -204,9 +268,8 @@ class Paikea(PaikeaActivitiesMixin):
         self._activity = self.idle
         self.messages = []
         self.beacon = False
-        self.location_data = {}
-        self.signal_data = {}
-        self.course_data = {}
+        self.fix = Fix()
+        self.fix_policy = FixPolicy(clock=self.clock)
         self.sleep_mode = storage.get("SLEEPMODE")
 
     def connect(self, devices):
@@ -238,6 +301,7 @@ class Paikea(PaikeaActivitiesMixin):
                           activity=self.lost_satellite),
             ActivityTimer("loc_send", self.clock, loc_send,
                           activity=self.send_update),
+            ActivityTimer("rb_settle", self.clock, self.rb_settle),
         ]
 
         for timer in timers:
@@ -249,6 +313,7 @@ class Paikea(PaikeaActivitiesMixin):
     def sleep(self, sleep_time):
         rb = self.devices.get('rb')
         if rb:
+            rb.link.flush()
             rb.stop()
 
         lora = self.devices.get('lora')
@@ -307,12 +372,41 @@ class Paikea(PaikeaActivitiesMixin):
     def check_iridium(self):
         rb = self.devices.get('rb')
         new_data = None
+        waypoints = None
         if rb:
             if rb.new_data:
                 new_data = rb.data.pop('pkea', None)
                 rb.new_data = False
+            waypoints = rb.data.pop('wpl', None)
         if new_data:
             self.process_iridium_data(new_data)
+        if waypoints:
+            self.import_waypoints(waypoints)
+
+    def import_waypoints(self, waypoints):
+        gps = self.devices.get('gps')
+        if not gps:
+            return
+        for wp in waypoints:
+            try:
+                gps.import_waypoint(wp)
+            except KeyError:
+                print("bad waypoint: {}".format(wp))
+
+    def apply_config(self, config):
+        for key, value in config.items():
+            if key not in self.config_keys:
+                print("config: unknown key {}".format(key))
+                continue
+            if key == 'SLEEPMODE':
+                self.sleep_mode = value
+            else:
+                try:
+                    self.update_delay(key.lower(), int(value))
+                except ValueError:
+                    print("config: bad value {}={}".format(key, value))
+                    continue
+            storage.put(key, value)
 
     def process_iridium_data(self, new_data):
         for item, value in new_data.items():
@@ -341,6 +435,9 @@ class Paikea(PaikeaActivitiesMixin):
 
                 self.sleep(sleep_time)
 
+            elif item == "CONFIG":
+                self.apply_config(value)
+
             elif item == "SUPPORT":
                 print("*** SUPPORT REQUESTED ***")
                 if not support.switch_to_support():
@@ -352,18 +449,27 @@ class Paikea(PaikeaActivitiesMixin):
         self.clock.sleep(.3)
 
     def assert_rb_state(self):
+        ''' Recover from lost ISU responses.  Lost responses are retried
+            through the command queue; the ISU is only power cycled, which
+            costs its charging time, once the queue reports it stalled, and
+            the update is only sent again after a power cycle.
+        '''
         rb = self.devices.get('rb')
 
         if not rb:
             return
 
         if rb.bad_session:
-            self.reset_rb(rb)
-            self.activity = self.send_update
+            rb.bad_session = False
+            if rb.commands.stalled:
+                self.reset_rb(rb)
+                self.activity = self.send_update
+            # otherwise the timed out session is already being retried
 
         if not rb.wait_for_status and (not rb.mo_flag and rb.wait_for_send):
-            self.reset_rb(rb)
-            rb.start()
+            if rb.commands.stalled:
+                self.reset_rb(rb)
+                rb.start()
             rb.wait_for_send = False
             self.activity = self.send_update
 
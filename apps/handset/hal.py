@@ -15,6 +15,7 @@ exp.connect(pin_defs.exp)
 
 gps = devices.gps.GPS(clock=clock)
 gps.connect(pin_defs.gps)
+gps.output_profile = 'handset-nav'
 gps.stop()
 
 rb = devices.rockblock.RockBlock(clock=clock)
@@ -0,0 +1,152 @@
+"""
+Position Smoothing
+------------------
+
+Constant velocity alpha-beta filter over the handset's GPS fixes.
+
+Raw fixes jitter by a few meters from one second to the next, and the
+course computed by the receiver swings widely at walking or drifting
+speeds.  Sent to the display as they are, each jump trips the intercept's
+change thresholds, redraws the e-paper display and turns the arrow back
+and forth.
+
+The filter tracks position and velocity in meters east and north of a
+local origin, the first fix, so the small steps between fixes keep their
+precision with single precision floats.  Each fix:
+
+- predicts the position from the last position and velocity
+- moves the position towards the fix by `alpha` of the residual
+- corrects the velocity by `beta` of the residual per second
+- moves the velocity towards the receiver's own course and speed, which
+  are measured from Doppler rather than from positions, by `gamma`
+
+Larger gains follow fixes more closely, smaller gains smooth more and lag
+more.  A fix after a long gap, or too far from the prediction, resets the
+filter to the fix, so a restart or a bad first fix isn't smoothed over.
+Below `min_speed` the course of the velocity is noise, and the last
+course is held.
+"""
+from array import array
+from math import (
+    atan2,
+    cos,
+    degrees,
+    radians,
+    sin,
+    sqrt,
+)
+
+
+#: Meters per degree of latitude
+M_PER_DEG = 111112.
+
+#: Seconds in a day, fix times wrap at midnight
+DAY = 86400
+
+
+class PositionFilter:
+    ''' Alpha-beta filter of position and velocity.
+
+        :param float alpha: position gain, 0-1
+        :param float beta: velocity gain from position residuals, 0-1
+        :param float gamma: velocity gain from the measured course and
+            speed, 0-1, 0 to ignore them
+        :param float max_gap: seconds between fixes before resetting
+        :param float max_jump: meters from the prediction before resetting
+        :param float min_speed: m/s below which the course is held
+    '''
+
+    def __init__(self, alpha=0.5, beta=0.1, gamma=0.3, max_gap=10.,
+                 max_jump=200., min_speed=0.5):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.max_gap = max_gap
+        self.max_jump = max_jump
+        self.min_speed = min_speed
+        # east, north, east velocity, north velocity
+        self.state = array('f', [0.] * 4)
+        self.origin = array('f', [0.] * 2)
+        self.scale = 1.
+        self.time = None
+        self._cog = 0.
+
+    def reset(self, lat, lon, cog=0., sog=0., utc=None):
+        ''' Start again from a fix, which becomes the local origin. '''
+        state = self.state
+        self.origin[0] = lat
+        self.origin[1] = lon
+        self.scale = M_PER_DEG * cos(radians(lat))
+        state[0] = 0.
+        state[1] = 0.
+        speed = sog / 3.6
+        state[2] = speed * sin(radians(cog))
+        state[3] = speed * cos(radians(cog))
+        self._cog = cog
+        self.time = utc
+
+    def update(self, lat, lon, utc, cog=None, sog=None):
+        ''' Filter a fix.
+
+            :param float lat: latitude, decimal degrees
+            :param float lon: longitude, decimal degrees
+            :param int utc: fix time, seconds of the day
+            :param float cog: course over ground from the receiver, degrees
+            :param float sog: speed over ground from the receiver, km/h
+        '''
+        if self.time is None:
+            self.reset(lat, lon, cog or 0., sog or 0., utc)
+            return
+        dt = utc - self.time
+        if dt < 0:
+            dt += DAY
+        if dt == 0:
+            return
+        if dt > self.max_gap:
+            self.reset(lat, lon, cog or 0., sog or 0., utc)
+            return
+
+        state = self.state
+        east = state[0] + state[2] * dt
+        north = state[1] + state[3] * dt
+        r_east = (lon - self.origin[1]) * self.scale - east
+        r_north = (lat - self.origin[0]) * M_PER_DEG - north
+        if sqrt(r_east * r_east + r_north * r_north) > self.max_jump:
+            self.reset(lat, lon, cog or 0., sog or 0., utc)
+            return
+
+        state[0] = east + self.alpha * r_east
+        state[1] = north + self.alpha * r_north
+        state[2] += self.beta * r_east / dt
+        state[3] += self.beta * r_north / dt
+        if self.gamma and cog is not None and sog is not None:
+            speed = sog / 3.6
+            state[2] += self.gamma * (speed * sin(radians(cog)) - state[2])
+            state[3] += self.gamma * (speed * cos(radians(cog)) - state[3])
+        self.time = utc
+
+    @property
+    def lat(self):
+        return self.origin[0] + self.state[1] / M_PER_DEG
+
+    @property
+    def lon(self):
+        return self.origin[1] + self.state[0] / self.scale
+
+    @property
+    def speed(self):
+        ''' Speed, m/s '''
+        return sqrt(self.state[2] ** 2 + self.state[3] ** 2)
+
+    @property
+    def sog(self):
+        ''' Speed over ground, km/h '''
+        return self.speed * 3.6
+
+    @property
+    def cog(self):
+        ''' Course over ground, degrees, held at low speed '''
+        if self.speed >= self.min_speed:
+            cog = degrees(atan2(self.state[2], self.state[3])) % 360
+            self._cog = cog if cog < 360 else 0.
+        return self._cog
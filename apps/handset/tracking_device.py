@@ -3,6 +3,7 @@ from devices.serialprotocols import (
     ProtocolSpec,
     SimpleSerialProtocol,
 )
+from apps.handset.smoothing import PositionFilter
 from apps.handset.tracker import (
     Position,
     Heading,
@@ -12,6 +13,7 @@ from core import storage
 from core.compat import reset
 from core.utils import ActivityTimer
 from devices.power import shutdown
+from devices import sbd_codec
 
 
 def degdm(val):
@@ -33,10 +35,20 @@ class TrackingDevice:
     # specifically) into account
     km2deg = 111.112
 
+    #: Send location reports as 16 byte binary SBD messages instead of
+    #: ascii PK001 messages
+    binary_reports = True
+
+    #: Gains of the position filter, see `PositionFilter`, empty for the
+    #: defaults
+    smoothing = {}
+
     def __init__(self):
         self.my_location_msg = ""
         self.my_location = Position(0, 0)
         self.my_course = Course(Heading(0), 0)
+        self.smoother = PositionFilter(**self.smoothing)
+        self.fix_utc = None
         self.last_target_update = 0
         self.buoy_location = None
         self.buoy_course = None
@@ -75,11 +87,9 @@ class TrackingDevice:
                                                     self.clock,
                                                     600)
             self.timers['loc_send'].start()
-            self.rb.atcmd("+CIER=1,1,1", False)
-            self.clock.sleep(.05)
-            self.rb.atcmd("+SBDAREG=1", False)
+            self.rb.atcmd(self.rb.cier_config, False)
             self.clock.sleep(.05)
-            self.rb.atcmd("+SBDMTA=1", False)
+            self.rb.enable_ring_alerts()
             self.clock.sleep(.05)
             self.rb.create_sbd_session()
 
@@ -98,13 +108,9 @@ class TrackingDevice:
             self.mode = mode
 
     def update_my_location(self):
-        ns = self.gps.location_data['NS']
-        ew = self.gps.location_data['EW']
-        lat = self.gps.location_data['latitude']
-        lon = self.gps.location_data['longitude']
-        cog = self.gps.course_data['t_course']
-        sog = self.gps.course_data['ground_speed']
-        utc = self.gps.location_data['utc']
+        fix = self.gps.fix
+        # kept as NMEA hhmmss to compare with target reports
+        utc = self.gps.location_data.get('utc')
 
         if utc:
             try:
@@ -112,33 +118,21 @@ class TrackingDevice:
             except Exception:
                 print("bad UTC to float")
 
-        if cog and sog:
-            try:
-                self.my_course = Course(
-                    Heading(float(cog)),
-                    float(sog)/self.km2deg)
-                self.updated = True
-            except Exception as e:
-                print("update_my_location A: {}".format(e))
-
-        if ns and ew and lat and lon:
-            try:
-                if ns == "N":
-                    lat = degdm(lat)
-                else:
-                    lat = -degdm(lat)
-
-                if ew == "E":
-                    lon = degdm(lon)
-                else:
-                    lon = -degdm(lon)
-
-                self.my_location = Position(lat, lon)
-                self.updated = True
+        if not fix.valid or fix.utc == self.fix_utc:
+            return
+        self.fix_utc = fix.utc
 
-            except Exception as e:
-                print("{}, {}, {}".format(lat, lon, self.my_location))
-                print("update_my_location b: {}".format(e))
+        # the display link and the intercept follow the smoothed fix
+        smoother = self.smoother
+        smoother.update(fix.lat, fix.lon, fix.utc, fix.cog, fix.sog)
+        try:
+            self.my_course = Course(Heading(smoother.cog),
+                                    smoother.sog/self.km2deg)
+            self.my_location = Position(smoother.lat, smoother.lon)
+            self.updated = True
+        except Exception as e:
+            print("{}, {}, {}".format(fix.lat, fix.lon, self.my_location))
+            print("update_my_location: {}".format(e))
 
     def send_my_location(self):
         data_fields = "{},{},{},{}".format(
@@ -309,6 +303,13 @@ class TrackingDevice:
         msg = "PK001;" + msg
         return msg
 
+    def location_report(self, fix):
+        batt = 0
+        if self.batt:
+            batt = self.batt.main_v
+        return sbd_codec.encode_position(
+            fix.lat, fix.lon, fix.utc, fix.cog, fix.sog, 0, batt)
+
     def send_location(self):
         if not self.gps or not self.rb:
             return
@@ -316,11 +317,18 @@ class TrackingDevice:
         if self.gps.wait_for_firstfix:
             return
 
-        location_data = {}
-        location_data.update(**self.gps.location_data)
-        location_data.update(**self.gps.course_data)
-        location_data.update(**self.gps.signal_data)
-        msg = self.location_msg(location_data)
+        if self.binary_reports:
+            try:
+                msg = self.location_report(self.gps.fix)
+            except Exception as e:
+                print("send_location: {}".format(e))
+                return
+        else:
+            location_data = {}
+            location_data.update(**self.gps.location_data)
+            location_data.update(**self.gps.course_data)
+            location_data.update(**self.gps.signal_data)
+            msg = self.location_msg(location_data)
         self.timers['loc_send'].reset()  # init timer, yah
         self.my_location_msg = msg
 
@@ -343,12 +351,17 @@ class TrackingDevice:
             self.batt.main_v).encode('ascii')
 
     def send_iridium(self):
-        if not self.rb.wait_for_send and not self.rb.messages:
-            if self.buoy_commands:
-                self.rb.messages.append(self.buoy_commands.pop(0))
-            elif self.my_location_msg:
-                self.rb.messages.append(self.my_location_msg)
-                self.my_location_msg = ""
+        ''' Queue every pending buoy command and the location report
+            together, so the driver packs them into as few sessions as
+            fit.  Messages queued while a message is being sent wait for
+            the next session.
+        '''
+        if self.buoy_commands:
+            self.rb.messages.extend(self.buoy_commands)
+            self.buoy_commands = []
+        if self.my_location_msg:
+            self.rb.messages.append(self.my_location_msg)
+            self.my_location_msg = ""
 
     def sync(self, sync_word):
         print("Syncing on {}".format(sync_word))
@@ -80,14 +80,25 @@ async def init_hardware():
 
 
 async def run_gps():
+    last_utc = None
     while True:
         hal.gps.run()
-        for k, v in hal.gps.location_data.items():
-            await send('{{"gps/location/{}": "{}"}}'.format(k, v))
+        fix = hal.gps.fix
+        if fix.valid and fix.utc != last_utc:
+            last_utc = fix.utc
+            await send(json.dumps({
+                "gps/location/utc": "{:02d}:{:02d}:{:02d}".format(
+                    fix.utc // 3600, fix.utc // 60 % 60, fix.utc % 60),
+                "gps/location/NS": "S" if fix.lat < 0 else "N",
+                "gps/location/latitude": "{:.5f}".format(abs(fix.lat)),
+                "gps/location/EW": "W" if fix.lon < 0 else "E",
+                "gps/location/longitude": "{:.5f}".format(abs(fix.lon)),
+                "gps/course/t_course": fix.cog,
+                "gps/course/ground_speed": fix.sog,
+                "gps/fix/hdop": fix.hdop,
+                "gps/fix/sats": fix.sats}))
         for k, v in hal.gps.signal_data.items():
             await send('{{"gps/signal/{}": "{}"}}'.format(k, v))
-        for k, v in hal.gps.course_data.items():
-            await send('{{"gps/course/{}": "{}"}}'.format(k, v))
         await uasyncio.sleep(1)
 
 
@@ -117,8 +128,9 @@ async def run_rb():
              'ra_flag': None,
              'queue': None}
 
-    hal.rb.atcmd("+SBDAREG=1", False)
-    hal.rb.atcmd("+SBDMTA=1", False)
+    sessions = None
+
+    hal.rb.enable_ring_alerts()
     hal.rb.create_sbd_session()
 
     while True:
@@ -131,6 +143,10 @@ async def run_rb():
             if nv != v:
                 await send('{{"rb/{}": "{}"}}'.format(k, nv))
                 pVals[k] = nv
+        if hal.rb.session_log.total != sessions:
+            sessions = hal.rb.session_log.total
+            state["rb/sessions"] = hal.rb.session_log.summary()
+            await send(json.dumps({"rb/sessions": state["rb/sessions"]}))
         await uasyncio.sleep_ms(100)
 
 
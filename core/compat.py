@@ -35,6 +35,11 @@ except TypeError:
         '''
         return int.from_bytes(val, endian, signed=signed)
 
+try:
+    import uasyncio
+except ImportError:
+    import asyncio as uasyncio
+
 try:
     import collections
 except ImportError:
@@ -0,0 +1,441 @@
+'''
+Mock ISU
+--------
+
+An in-process stand in for a 9602/9603 Iridium Short Burst Data modem, for
+load testing the RockBlock driver off device.
+
+`MockISU` has the same surface as `core.mock_machine.UART` (`any`, `read`,
+`write`, `readline`) so it can be passed to `ModemController.connect` or
+attached as a driver's `conn` directly.  Commands written to it are parsed
+and answered the way the ISU answers them, with echo and verbose result
+codes:
+
+=============  ==============================================
+command        behaviour
+=============  ==============================================
+AT+SBDWT       READY, then the text line is loaded as MO
+AT+SBDWB=n     READY, then n bytes and a checksum loaded as MO
+AT+SBDRT       MT buffer as text
+AT+SBDRB       MT buffer as length, bytes and checksum
+AT+SBDIX[A]    SBD session, answered after a session latency
+AT+SBDSX       MO/MT buffer status
+AT+SBDDn       clear buffers
+AT+CIER        indicator event reporting, +CIEV:0 and +CIEV:3
+AT+SBDREG[?]   registration, which can fail like a session
+AT-MSGEO       ISU position
+=============  ==============================================
+
+Everything else is answered with OK.
+
+Time is taken from a clock object, usually a `SimClock` which the test
+advances, so hours of constellation time run in seconds.  By default signal
+follows a model of satellite passes: a satellite crosses the sky every
+`pass_period` seconds, CSQ follows its elevation, and the chance a session
+fails depends on the CSQ when the session is attempted.  A fixed CSQ trace
+can be given instead.
+
+Messages delivered by successful sessions are recorded in `delivered`, and
+`deliver` queues mobile terminated messages at the gateway.
+'''
+import math
+import random
+from core.mock_machine import UART
+
+
+#: Chance a session fails by CSQ at the time of the attempt
+FAIL_RATES = (1.0, 0.9, 0.6, 0.3, 0.15, 0.05)
+
+#: Earth and Iridium orbit radius, km
+EARTH_RADIUS = 6371
+ORBIT_RADIUS = 7151
+#: Iridium orbital period, seconds
+ORBIT_PERIOD = 6000
+
+
+class SimClock:
+    ''' A clock which only moves when told to, with the `Clock` device's
+        time, sleep and wait interface.
+    '''
+
+    def __init__(self, start=0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def wait(self, seconds):
+        self.now += seconds
+
+    def wait_ms(self, ms):
+        self.now += ms / 1000
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class EnablePin:
+    ''' Enable pin which accumulates the seconds the ISU is powered.
+
+        :param clock: object with a time method
+        :param isu: MockISU to power up and down
+    '''
+
+    def __init__(self, clock, isu=None):
+        self.clock = clock
+        self.isu = isu
+        self._value = 0
+        self.since = 0
+        self.total = 0
+        self.power_ups = 0
+
+    def __call__(self):
+        return self._value
+
+    def value(self):
+        return self._value
+
+    def on(self):
+        if not self._value:
+            self._value = 1
+            self.since = self.clock.time()
+            self.power_ups += 1
+            if self.isu:
+                self.isu.power_on()
+
+    def off(self):
+        if self._value:
+            self._value = 0
+            self.total += self.clock.time() - self.since
+            if self.isu:
+                self.isu.power_off()
+
+    @property
+    def on_time(self):
+        ''' Seconds powered, including the current period '''
+        if self._value:
+            return self.total + self.clock.time() - self.since
+        return self.total
+
+
+class MockISU(UART):
+    ''' Simulated Iridium SBD modem.
+
+        :param clock: object with a time method
+        :param csq_trace: None for the satellite pass model, or a list of
+            (seconds, csq) steps repeated for the length of the test
+        :param tuple fail_rates: chance a session fails by CSQ
+        :param tuple session_time: (min, max) seconds an SBDIX session takes
+        :param int pass_period: seconds between satellite passes
+        :param int seed: random seed
+        :ivar int sv_report_period: seconds between +CIEV:3 reports
+    '''
+
+    sv_report_period = 60
+
+    def __init__(self, clock, csq_trace=None, fail_rates=FAIL_RATES,
+                 session_time=(8, 22), pass_period=540, seed=0):
+        super().__init__(1, 19200)
+        self.clock = clock
+        self.csq_trace = csq_trace
+        self.trace_len = sum(d for d, _ in csq_trace) if csq_trace else 0
+        self.fail_rates = fail_rates
+        self.session_time = session_time
+        self.pass_period = pass_period
+        self.random = random.Random(seed)
+        self.start = clock.time()
+        self.echo = True
+        self.delivered = []
+        self.mt_queue = []
+        self.sessions = 0
+        self.failed = 0
+        self.momsn = 0
+        self.mtmsn = 0
+        self.power_off()
+
+    def power_on(self):
+        ''' Reset volatile state as at power up '''
+        self.powered = True
+        self.cier = [0, 0, 0, 0, 0]
+        self.last_csq = None
+        self.last_sv = 0
+        self.registered = False
+
+    def power_off(self):
+        ''' Drop buffers and anything in progress as at power down '''
+        self.powered = False
+        self.cier = [0, 0, 0, 0, 0]
+        self.rx_cmd = b""
+        self._readbuf = b""
+        self.outgoing = []
+        self.payload = None
+        self.busy_until = None
+        self.mo = None
+        self.mt = None
+
+    # -- constellation model
+
+    def _pass_angle(self, now):
+        ''' Angle from zenith of the serving satellite, radians '''
+        t = (now - self.start) % self.pass_period - self.pass_period / 2
+        return 2 * math.pi * t / ORBIT_PERIOD
+
+    def elevation(self, now=None):
+        ''' Elevation in degrees of the serving satellite '''
+        now = self.clock.time() if now is None else now
+        theta = self._pass_angle(now)
+        x = ORBIT_RADIUS * math.cos(theta) - EARTH_RADIUS
+        y = ORBIT_RADIUS * math.sin(theta)
+        return math.degrees(math.atan2(x, abs(y)))
+
+    def csq(self, now=None):
+        ''' Signal strength at now, 0-5 '''
+        now = self.clock.time() if now is None else now
+        if self.csq_trace:
+            t = (now - self.start) % self.trace_len
+            for duration, csq in self.csq_trace:
+                if t < duration:
+                    return csq
+                t -= duration
+        return max(0, min(5, int(self.elevation(now) / 12)))
+
+    def sv_position(self, now):
+        ''' Serving satellite id and ECEF position with the ISU at (0, 0, R)
+        '''
+        sv_id = int((now - self.start) // self.pass_period) % 66
+        theta = self._pass_angle(now)
+        return (sv_id, int(ORBIT_RADIUS * math.sin(theta)), 0,
+                int(ORBIT_RADIUS * math.cos(theta)))
+
+    # -- UART surface
+
+    def any(self):
+        self.update()
+        return super().any()
+
+    def read(self, n=None):
+        self.update()
+        if n is None:
+            return super().read()
+        out, self._readbuf = self._readbuf[:n], self._readbuf[n:]
+        return out
+
+    def readinto(self, buf, nbytes=None):
+        self.update()
+        return super().readinto(buf, nbytes)
+
+    def readline(self):
+        self.update()
+        return super().readline()
+
+    def write(self, val):
+        if isinstance(val, str):
+            val = val.encode("ascii")
+        if not self.powered:
+            return len(val)
+        self.rx_cmd += val
+        self.update()
+        return len(val)
+
+    # -- ISU
+
+    def _out(self, data, delay=0):
+        self.outgoing.append((self.clock.time() + delay, data))
+
+    def _result(self, *lines, delay=0, ok=True):
+        out = b"".join(line.encode("ascii") + b"\r\n" for line in lines)
+        if ok:
+            out += (b"\r\n" if lines else b"") + b"OK\r\n"
+        self._out(out, delay)
+
+    def update(self):
+        ''' Advance the ISU to the clock's time: emit indicator events,
+            finish sessions and process written commands.
+        '''
+        if not self.powered:
+            return
+        now = self.clock.time()
+        if self.cier[0] and self.cier[1]:
+            csq = self.csq(now)
+            if csq != self.last_csq:
+                self.last_csq = csq
+                self._out("+CIEV:0,{}\r\n".format(csq).encode("ascii"))
+        if self.cier[0] and self.cier[4]:
+            if now - self.last_sv >= self.sv_report_period:
+                self.last_sv = now
+                sv_id, x, y, z = self.sv_position(now)
+                self._out("+CIEV:3,{},0,0,{},{},{}\r\n".format(
+                    sv_id, x, y, z).encode("ascii"))
+
+        if self.busy_until is not None and now >= self.busy_until:
+            self.busy_until = None
+
+        while self.busy_until is None and self.rx_cmd:
+            if not self._process():
+                break
+
+        ready = [out for out in self.outgoing if out[0] <= now]
+        if ready:
+            self.outgoing = [out for out in self.outgoing if out[0] > now]
+            for _, data in ready:
+                self._readbuf += data
+
+    def _process(self):
+        ''' Process one command or payload from the written bytes.
+
+            :rtype: bool
+            :return: False if more bytes are needed
+        '''
+        if self.payload is not None:
+            return self._load_payload()
+
+        idx = self.rx_cmd.find(b"\r")
+        if idx < 0:
+            return False
+        line, self.rx_cmd = self.rx_cmd[:idx], self.rx_cmd[idx + 1:]
+        try:
+            line = line.decode("ascii").strip()
+        except UnicodeError:
+            return True
+        if not line:
+            return True
+        if self.echo:
+            self._out(line.encode("ascii") + b"\r")
+        if not line.upper().startswith("AT"):
+            self._result("ERROR", ok=False)
+            return True
+        self.command(line[2:])
+        return True
+
+    def _load_payload(self):
+        kind, size = self.payload
+        if kind == "text":
+            idx = self.rx_cmd.find(b"\r")
+            if idx < 0:
+                return False
+            self.mo = self.rx_cmd[:idx]
+            self.rx_cmd = self.rx_cmd[idx + 1:]
+            self.payload = None
+            self._result("0")
+            return True
+
+        if len(self.rx_cmd) < size + 2:
+            return False
+        data = self.rx_cmd[:size]
+        crc = self.rx_cmd[size:size + 2]
+        self.rx_cmd = self.rx_cmd[size + 2:]
+        self.payload = None
+        if (sum(data) & 0xFFFF).to_bytes(2, 'big') != crc:
+            self._result("2")
+        else:
+            self.mo = data
+            self._result("0")
+        return True
+
+    def command(self, cmd):
+        ''' Answer a command, without the AT prefix '''
+        upper = cmd.upper()
+        if upper == "+SBDWT":
+            self.payload = ("text", None)
+            self._out(b"READY\r\n")
+        elif upper.startswith("+SBDWB="):
+            size = int(cmd[7:])
+            if not 1 <= size <= 340:
+                self._result("3")
+            else:
+                self.payload = ("binary", size)
+                self._out(b"READY\r\n")
+        elif upper == "+SBDRT":
+            text = (self.mt or b"").decode("ascii")
+            self._result("+SBDRT:", text)
+        elif upper == "+SBDRB":
+            mt = self.mt or b""
+            self._out(len(mt).to_bytes(2, 'big') + mt +
+                      (sum(mt) & 0xFFFF).to_bytes(2, 'big') + b"\r\nOK\r\n")
+        elif upper.startswith("+SBDIX"):
+            self.session()
+        elif upper.startswith("+SBDSX"):
+            self._result("+SBDSX: {}, {}, {}, {}, {}, {}".format(
+                int(self.mo is not None), self.momsn, int(self.mt is not None),
+                self.mtmsn, int(bool(self.mt_queue)), len(self.mt_queue)))
+        elif upper.startswith("+SBDD"):
+            which = cmd[5:] or "0"
+            if which in ("0", "2"):
+                self.mo = None
+            if which in ("1", "2"):
+                self.mt = None
+            self._result("0")
+        elif upper == "+CIER?":
+            self._result("+CIER:{},{},{},{},{}".format(*self.cier))
+        elif upper.startswith("+CIER="):
+            for i, val in enumerate(cmd[6:].split(",")[:5]):
+                self.cier[i] = int(val == "1")
+            self.last_csq = None
+            self.last_sv = 0
+            self._result()
+        elif upper == "+SBDREG?":
+            self._result("+SBDREG:{}".format(2 if self.registered else 1))
+        elif upper == "+SBDREG":
+            self.register()
+        elif upper == "-MSGEO":
+            self._result("-MSGEO: 0,0,{},00000000".format(EARTH_RADIUS))
+        elif upper in ("E0", "E1"):
+            self.echo = upper == "E1"
+            self._result()
+        else:
+            self._result()
+
+    def register(self):
+        ''' Register with the network, answered after a session latency '''
+        now = self.clock.time()
+        latency = self.random.uniform(*self.session_time)
+        self.busy_until = now + latency
+        csq = self.csq(now)
+        if self.random.random() < self.fail_rates[csq]:
+            self._result("+SBDREG:1,{}".format(32 if csq == 0 else 18),
+                         delay=latency)
+            return
+        self.registered = True
+        self._result("+SBDREG:2,0", delay=latency)
+
+    def session(self):
+        ''' Run an SBD session, answered after the session latency '''
+        now = self.clock.time()
+        self.sessions += 1
+        latency = self.random.uniform(*self.session_time)
+        self.busy_until = now + latency
+
+        csq = self.csq(now)
+        if self.random.random() < self.fail_rates[csq]:
+            self.failed += 1
+            mosta = 32 if csq == 0 else 18
+            self._result("+SBDIX: {}, {}, 2, {}, 0, {}".format(
+                mosta, self.momsn, self.mtmsn, len(self.mt_queue)),
+                delay=latency)
+            return
+
+        mosta = 0
+        self.registered = True
+        if self.mo is not None:
+            self.momsn += 1
+            self.delivered.append((now + latency, self.mo))
+        mtsta, mtlen = 0, 0
+        if self.mt_queue:
+            self.mt = self.mt_queue.pop(0)
+            self.mtmsn += 1
+            mtsta, mtlen = 1, len(self.mt)
+        self._result("+SBDIX: {}, {}, {}, {}, {}, {}".format(
+            mosta, self.momsn, mtsta, self.mtmsn, mtlen, len(self.mt_queue)),
+            delay=latency)
+
+    def deliver(self, msg):
+        ''' Queue a mobile terminated message at the gateway
+
+            :param bytes msg: message
+        '''
+        self.mt_queue.append(msg)
+        if self.powered:
+            self._out(b"SBDRING\r\n")
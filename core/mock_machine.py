@@ -84,6 +84,20 @@ class UART:
         self._readbuf = b""
         return out
 
+    def readinto(self, buf, nbytes=None):
+        ''' Moves bytes from the read buffer into buf
+            :param buf: writable buffer
+            :param int nbytes: maximum number of bytes to read, defaults to
+                the length of buf
+            :rtype: int
+            :return: number of bytes read, or None if there were none
+        '''
+        n = len(buf) if nbytes is None else min(nbytes, len(buf))
+        out = self._readbuf[:n]
+        self._readbuf = self._readbuf[len(out):]
+        buf[:len(out)] = out
+        return len(out) or None
+
     def write(self, val):
         ''' Adds data as bytes to the write buffer.  If data is not encoded,
             will attempt ascii encoding.
@@ -0,0 +1,243 @@
+"""
+Outbox
+------
+
+A persistent queue of outgoing messages stored on the flash filesystem, so
+messages which could not be sent survive a deep sleep or reset.
+
+The outbox file is an append-only log of fixed format records.  Adding a
+message, recording a send attempt, and removing a delivered message each
+append a single record, and the queue is rebuilt by replaying the log when
+the outbox is loaded.  When the log holds many more records than live
+entries it is compacted by rewriting only the live entries.
+
+========  =====================================================
+record    layout
+========  =====================================================
+add       b'A', id (2), priority (1), kind (1), attempts (1),
+          created (4), length (2), message
+attempt   b'T', id (2)
+remove    b'D', id (2)
+========  =====================================================
+
+All integers are big endian.  `kind` is 0 for text and 1 for binary
+messages.  A truncated record at the end of the log, as left by a reset
+during a write, is ignored.
+"""
+from core.compat import time
+import os
+
+
+class OutboxEntry:
+    ''' A queued message.
+
+        :ivar int id: identifier of the entry in the outbox log
+        :ivar int priority: higher priority entries are sent first when
+            draining by priority
+        :ivar int created: clock time the message was queued
+        :ivar int attempts: number of times the message has been sent
+        :ivar str|bytes msg: the message
+    '''
+
+    def __init__(self, id, priority, created, msg, attempts=0):
+        self.id = id
+        self.priority = priority
+        self.created = created
+        self.msg = msg
+        self.attempts = attempts
+
+    def age(self, now):
+        ''' Seconds since the message was queued '''
+        return now - self.created
+
+
+class Outbox:
+    ''' Flash backed message queue.
+
+        :param str path: file holding the outbox log
+        :param clock: object with a time method
+        :param int max_entries: oldest entries are dropped beyond this
+        :param int max_age: entries older than this many seconds are dropped
+            when the outbox is loaded, None to keep them indefinitely
+    '''
+
+    def __init__(self, path="outbox", clock=time, max_entries=64,
+                 max_age=None):
+        self.path = path
+        self.clock = clock
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.entries = []
+        self.records = 0
+        self.next_id = 0
+        self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def load(self):
+        ''' Rebuild the queue by replaying the outbox log '''
+        self.entries = []
+        self.records = 0
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = self._recover()
+
+        by_id = {}
+        pos = 0
+        while pos + 3 <= len(data):
+            op = data[pos]
+            _id = int.from_bytes(data[pos + 1:pos + 3], 'big')
+            if op == ord('A'):
+                if pos + 12 > len(data):
+                    break
+                priority = data[pos + 3]
+                kind = data[pos + 4]
+                attempts = data[pos + 5]
+                created = int.from_bytes(data[pos + 6:pos + 10], 'big')
+                n = int.from_bytes(data[pos + 10:pos + 12], 'big')
+                if pos + 12 + n > len(data):
+                    break
+                msg = data[pos + 12:pos + 12 + n]
+                if kind == 0:
+                    msg = msg.decode('ascii')
+                entry = OutboxEntry(_id, priority, created, msg, attempts)
+                by_id[_id] = entry
+                self.entries.append(entry)
+                pos += 12 + n
+            elif op == ord('T'):
+                if _id in by_id:
+                    by_id[_id].attempts += 1
+                pos += 3
+            elif op == ord('D'):
+                entry = by_id.pop(_id, None)
+                if entry:
+                    self.entries.remove(entry)
+                pos += 3
+            else:
+                break
+            self.records += 1
+
+        if self.entries:
+            self.next_id = (self.entries[-1].id + 1) & 0xFFFF
+
+        expired = []
+        if self.max_age is not None:
+            now = self.clock.time()
+            expired = [e for e in self.entries if e.age(now) > self.max_age]
+            for entry in expired:
+                self.entries.remove(entry)
+
+        if (pos != len(data) or expired or
+                self.records > 2 * len(self.entries) + 16):
+            self.compact()
+
+    def _recover(self):
+        ''' Finish a compaction interrupted between removing the log and
+            renaming the compacted copy over it, see `compact`.
+
+            :rtype: bytes
+            :return: the recovered log, empty if there is none
+        '''
+        tmp = self.path + ".tmp"
+        try:
+            os.rename(tmp, self.path)
+            with open(self.path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return b''
+
+    def _append(self, record):
+        with open(self.path, 'ab') as f:
+            f.write(record)
+        self.records += 1
+
+    def _add_record(self, entry):
+        if isinstance(entry.msg, bytes):
+            kind, msg = 1, entry.msg
+        else:
+            kind, msg = 0, entry.msg.encode('ascii')
+        return (b'A' + entry.id.to_bytes(2, 'big') +
+                bytes([entry.priority, kind, min(entry.attempts, 255)]) +
+                (entry.created & 0xFFFFFFFF).to_bytes(4, 'big') +
+                len(msg).to_bytes(2, 'big') + msg)
+
+    def put(self, msg, priority=0):
+        ''' Queue a message.
+
+            :param str|bytes msg: message to queue
+            :param int priority: 0-255, higher is sent first when draining
+                by priority
+            :rtype: OutboxEntry
+            :return: the new entry
+        '''
+        entry = OutboxEntry(self.next_id, priority, int(self.clock.time()),
+                            msg)
+        self.next_id = (self.next_id + 1) & 0xFFFF
+        self.entries.append(entry)
+        self._append(self._add_record(entry))
+
+        if len(self.entries) > self.max_entries:
+            self.remove(self.entries[:len(self.entries) - self.max_entries])
+        return entry
+
+    def pending(self, by_priority=False):
+        ''' Queued entries, oldest first, or highest priority first and
+            oldest first within a priority.
+
+            :param bool by_priority: order by priority
+            :rtype: list
+            :return: list of OutboxEntry
+        '''
+        if by_priority:
+            # sort on queue position too, sort isn't stable on micropython
+            order = sorted((-e.priority, i, e)
+                           for i, e in enumerate(self.entries))
+            return [e for _, _, e in order]
+        return list(self.entries)
+
+    def attempt(self, entries):
+        ''' Record a send attempt for each entry '''
+        for entry in entries:
+            entry.attempts += 1
+            self._append(b'T' + entry.id.to_bytes(2, 'big'))
+
+    def remove(self, entries):
+        ''' Remove delivered or dropped entries and compact the log when it
+            holds mostly dead records.
+        '''
+        for entry in entries:
+            if entry in self.entries:
+                self.entries.remove(entry)
+                self._append(b'D' + entry.id.to_bytes(2, 'big'))
+
+        if self.records > 2 * len(self.entries) + 16:
+            self.compact()
+
+    def compact(self):
+        ''' Rewrite the log with only the live entries and their attempt
+            counts.
+        '''
+        tmp = self.path + ".tmp"
+        with open(tmp, 'wb') as f:
+            for entry in self.entries:
+                f.write(self._add_record(entry))
+        try:
+            os.rename(tmp, self.path)
+        except OSError:
+            # FAT won't rename over an existing file.  The compacted copy is
+            # complete before the log is removed, so `load` recovers it if
+            # the unit resets in between.
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            os.rename(tmp, self.path)
+        self.records = len(self.entries)
+
+    def clear(self):
+        ''' Drop all entries '''
+        self.entries = []
+        self.compact()
@@ -0,0 +1,260 @@
+"""
+Ring Buffer
+-----------
+
+A preallocated byte ring buffer used to frame lines received from UART
+peripherals without growing byte strings on the heap.
+
+Bytes are written into a fixed bytearray, or read into it straight from the
+peripheral with `readinto`.  Each chunk is scanned in place for CR/LF
+terminators once, as it is written, and the positions of line ends are kept
+in a preallocated queue, so partial lines are never rescanned when more data
+arrives.  Complete lines are returned as memoryview slices into the buffer,
+or into a scratch buffer when a line wraps around the end of the ring.  A
+returned slice is only valid until the next write, so consumers must decode
+or copy it before reading more data.
+
+Positions are stream offsets which only ever increase; they are mapped into
+the bytearray modulo its size.
+"""
+from array import array
+
+#: Line terminators recognised by the scanner
+CR = 13
+LF = 10
+
+
+class RingBuffer:
+    ''' Fixed size byte ring buffer with an incremental CR/LF line scanner.
+
+        :ivar int size: capacity of the buffer in bytes
+        :ivar int start: stream position of the first unconsumed byte
+        :ivar int end: stream position one past the last written byte
+        :ivar int dropped: number of bytes discarded due to overflow
+    '''
+
+    def __init__(self, size=512):
+        self.size = size
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.scratch = bytearray(size)
+        # queue of stream positions of terminators which end a line
+        self.eols = array('i', [0] * (size // 2 + 1))
+        self.eol_head = 0
+        self.eol_count = 0
+        self.start = 0
+        self.end = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def clear(self):
+        ''' Discard all buffered data '''
+        self.start = self.end
+        self.eol_head = 0
+        self.eol_count = 0
+
+    def _push_eol(self, pos):
+        if self.eol_count == len(self.eols):
+            self._pop_eol()
+        idx = (self.eol_head + self.eol_count) % len(self.eols)
+        self.eols[idx] = pos
+        self.eol_count += 1
+
+    def _pop_eol(self):
+        pos = self.eols[self.eol_head]
+        self.eol_head = (self.eol_head + 1) % len(self.eols)
+        self.eol_count -= 1
+        return pos
+
+    def _scan(self, base, n):
+        ''' Record the line ends in the n bytes written to the ring at stream
+            position base.  Terminators directly following another terminator
+            end an empty line and are not recorded.
+
+            The bytes are scanned in place, MicroPython's bytearray has no
+            find and slicing them out to bytes would allocate a copy.
+        '''
+        buf = self.buf
+        size = self.size
+        i = base % size
+        term = base <= self.start or buf[i - 1] in (CR, LF)
+        for k in range(n):
+            c = buf[i]
+            if c == CR or c == LF:
+                if not term:
+                    self._push_eol(base + k)
+                term = True
+            else:
+                term = False
+            i += 1
+            if i == size:
+                i = 0
+
+    def write(self, data):
+        ''' Copy data into the ring and record any line ends it contains.  If
+            there isn't enough free space the oldest bytes are discarded and
+            counted in `dropped`.
+
+            :param bytes data: bytes to append
+            :rtype: int
+            :return: number of bytes written
+        '''
+        n = len(data)
+        if n == 0:
+            return 0
+
+        if n > self.size:
+            # only the newest bytes fit
+            self.dropped += n - self.size
+            self.end += n - self.size
+            self.clear()
+            data = data[n - self.size:]
+            n = self.size
+
+        overflow = n - (self.size - len(self))
+        if overflow > 0:
+            self.dropped += overflow
+            self._consume(self.start + overflow)
+
+        base = self.end
+        pos = base % self.size
+        first = self.size - pos
+        if n <= first:
+            self.buf[pos:pos + n] = data
+        else:
+            # wraps around the end, the only case which slices data
+            self.buf[pos:self.size] = data[:first]
+            self.buf[0:n - first] = data[first:]
+        self.end += n
+        self._scan(base, n)
+        return n
+
+    def readinto(self, stream, n):
+        ''' Read up to n bytes from stream directly into the ring, without
+            an intermediate bytes object, and record any line ends they
+            contain.  Only as many bytes as there is free space for are
+            read, the rest are left in the stream until lines have been
+            consumed.  When the ring is already full the oldest bytes are
+            discarded to make room, as in `write`.
+
+            :param stream: UART or serial port with a readinto method
+            :param int n: number of bytes pending on the stream
+            :rtype: int
+            :return: number of bytes read
+        '''
+        size = self.size
+        free = size - len(self)
+        if free:
+            n = min(n, free)
+        else:
+            # full, make room as write does so callers polling for a reply
+            # without consuming lines still see new data
+            n = min(n, size)
+            self.dropped += n
+            self._consume(self.start + n)
+
+        got = 0
+        while got < n:
+            pos = self.end % size
+            want = min(n - got, size - pos)
+            k = stream.readinto(self.mv[pos:pos + want])
+            if not k:
+                break
+            base = self.end
+            self.end += k
+            self._scan(base, k)
+            got += k
+            if k < want:
+                break
+        return got
+
+    def _consume(self, pos):
+        ''' Advance the read position to pos, dropping line ends before it '''
+        self.start = pos
+        while self.eol_count and self.eols[self.eol_head] < pos:
+            self._pop_eol()
+
+    def _view(self, pos, end):
+        ''' Return a contiguous memoryview of the bytes between the stream
+            positions pos and end, copying into the scratch buffer when the
+            region wraps.
+        '''
+        size = self.size
+        n = end - pos
+        pos = pos % size
+        if pos + n <= size:
+            return self.mv[pos:pos + n]
+        first = size - pos
+        self.scratch[0:first] = self.mv[pos:size]
+        self.scratch[first:n] = self.mv[0:n - first]
+        return memoryview(self.scratch)[0:n]
+
+    def _trim(self, pos, end):
+        ''' Skip terminators left at either end of a line by `blank` '''
+        buf = self.buf
+        size = self.size
+        while pos < end and buf[pos % size] in (CR, LF):
+            pos += 1
+        while end > pos and buf[(end - 1) % size] in (CR, LF):
+            end -= 1
+        return pos, end
+
+    def blank(self, token):
+        ''' Find a complete line equal to token and overwrite it with line
+            terminators, removing it without moving any other buffered data.
+            The scanner skips the resulting empty line.
+
+            :param bytes token: line contents to remove
+            :rtype: bool
+            :return: True if the line was found
+        '''
+        n = len(token)
+        buf = self.buf
+        size = self.size
+        pos = self.start
+        for i in range(self.eol_count):
+            eol = self.eols[(self.eol_head + i) % len(self.eols)]
+            lo, hi = self._trim(pos, eol)
+            pos = eol + 1
+            if hi - lo != n:
+                continue
+            for k in range(n):
+                if buf[(lo + k) % size] != token[k]:
+                    break
+            else:
+                for k in range(lo, hi):
+                    buf[k % size] = CR
+                return True
+        return False
+
+    def readline(self):
+        ''' Return the next complete, non-empty line without its terminator.
+
+            :rtype: memoryview
+            :return: line contents, or None if no complete line is buffered
+        '''
+        while self.eol_count:
+            eol = self._pop_eol()
+            pos, end = self._trim(self.start, eol)
+            self.start = eol + 1
+            if end > pos:
+                return self._view(pos, end)
+
+        if len(self) == self.size:
+            # full without a terminator, the line can never complete
+            self.dropped += self.size
+            self.clear()
+        return None
+
+    def lines(self):
+        ''' Generate all complete lines currently buffered.
+
+            :rtype: generator
+            :return: memoryview for each complete, non-empty line
+        '''
+        line = self.readline()
+        while line is not None:
+            yield line
+            line = self.readline()
@@ -0,0 +1,366 @@
+"""
+Async RockBlock
+---------------
+
+A coroutine based variant of the RockBlock driver.
+
+The blocking driver sleeps and busy waits while the ISU charges, while
+waiting for the READY prompt, and between SBD retries, which stalls every
+other device for the length of a session.  This driver does the same work
+with awaitable calls built on a `uasyncio.StreamReader` over the UART, so
+GPS and LoRa tasks keep running while a session is in progress.
+Connections which aren't streams, e.g. the mock UART off device, are polled
+instead.
+
+Responses are framed with the controller's ring buffer and routed through
+the same ISU response handlers as the blocking driver.  Only one AT command
+is in flight at a time; the coroutine holding the lock reads the stream and
+routes any unsolicited responses (+CIEV, SBDRING) it sees while waiting.
+The binary SBDRB reply is read through the same `MTReader` as the blocking
+driver, which passes lines arriving ahead of it on to be routed.
+
+.. code-block:: python
+
+    rb = AsyncRockBlock(clock=clock)
+    rb.connect(pin_defs.rb)
+    uasyncio.create_task(rb.run())
+    ok = await rb.send("PK001;...")
+"""
+from core.compat import (
+    time,
+    uasyncio,
+)
+from devices.rockblock import RockBlock
+from devices import sbd_codec
+
+
+class AsyncRockBlock(RockBlock):
+    """ Coroutine based driver for a RockBlock device
+
+        :ivar int session_timeout: seconds to wait for an SBDIX result
+        :ivar int signal_timeout: seconds to wait for usable signal before
+            attempting a session anyway
+        :ivar int retries: SBD sessions attempted per message
+    """
+
+    FINAL = ("OK", "ERROR")
+
+    #: Seconds between reads of a connection which isn't a stream
+    POLL = 0.05
+
+    def __init__(self, clock=time):
+        super().__init__(clock)
+        self.lock = uasyncio.Lock()
+        self.sreader = None
+        self.swriter = None
+        self.sbdix = None
+        self.session_timeout = 60
+        self.signal_timeout = 120
+        self.retries = 5
+
+    def connect(self, devices):
+        ''' Connect driver with underlying drivers.  Does not start the ISU,
+            await `start` for that.
+
+            :param dict devices: 'en' enable pin, 'conn' UART
+        '''
+        self.en = devices['en']
+        self.conn = devices['conn']
+        self.conn_type = devices['conn_type']
+        if hasattr(self.conn, 'ioctl'):
+            self.sreader = uasyncio.StreamReader(self.conn)
+            self.swriter = uasyncio.StreamWriter(self.conn, {})
+
+    async def start(self):
+        ''' Start up RockBlock w/ 5s charging time without blocking '''
+        if self.en.value() == 1:
+            return
+        self.en.on()
+        await uasyncio.sleep(5)
+        self.last_sat_time = 0
+        self.outbox_hold = False
+        await self.command(self.cier_config)
+
+    def create_sbd_session(self):
+        ''' Sessions are run by `send` and `read_mt`, nothing to schedule '''
+        pass
+
+    @property
+    def mt_flag(self):
+        return self._mt_flag
+
+    @mt_flag.setter
+    def mt_flag(self, val):
+        ''' Track the ISU MT flag.  The message is read with `read_mt`. '''
+        self._mt_flag = val
+
+    def handle_sbdix(self, resp):
+        ''' Keep the SBDIX result for the session waiting on it '''
+        self.sbdix = self.parse_sbdix(resp)
+        return {}
+
+    def atcmd(self, msg, reply=True, timeout=5, callback=None):
+        ''' Commands issued by response handlers are run as tasks '''
+        uasyncio.create_task(self.command(msg, timeout))
+
+    async def _write(self, data):
+        if self.swriter is None:
+            self.raw_write(data)
+            return
+        self.swriter.write(data)
+        await self.swriter.drain()
+
+    async def _read(self, timeout):
+        ''' Wait for bytes from the UART.
+
+            :param float timeout: seconds to wait for data
+            :rtype: bytes
+            :return: bytes read, or None on timeout
+        '''
+        if self.sreader is not None:
+            try:
+                return await uasyncio.wait_for(self.sreader.read(64), timeout)
+            except uasyncio.TimeoutError:
+                return None
+        start = self.clock.time()
+        while not self.any():
+            if self.clock.time() - start >= timeout:
+                return None
+            await uasyncio.sleep(self.POLL)
+        return self.raw_read()
+
+    def _route(self):
+        ''' Route the complete lines in the receive buffer and return them.
+
+            :rtype: list
+            :return: decoded lines
+        '''
+        items = []
+        line = self.rx.readline()
+        while line is not None:
+            item = self.decode(line)
+            if item:
+                new_data = self.route_response(item)
+                if new_data:
+                    self.data.update(new_data)
+                items.append(item)
+            line = self.rx.readline()
+        return items
+
+    async def _pump(self, timeout):
+        ''' Route any complete lines already buffered, otherwise read
+            pending bytes from the UART and route the lines they complete.
+
+            :param float timeout: seconds to wait for data
+            :rtype: list
+            :return: decoded lines
+        '''
+        items = self._route()
+        if items:
+            return items
+        data = await self._read(timeout)
+        if data:
+            self.rx.write(data)
+        return self._route()
+
+    async def _wait_final(self, timeout, prompt=None):
+        ''' Read until a final result code or prompt.
+
+            :rtype: tuple
+            :return: (final result or prompt or None on timeout,
+                list of intermediate lines)
+        '''
+        lines = []
+        start = self.clock.time()
+        remaining = timeout
+        while remaining > 0:
+            for item in await self._pump(remaining):
+                if item in self.FINAL or item == prompt:
+                    return item, lines
+                lines.append(item)
+            remaining = timeout - (self.clock.time() - start)
+        return None, lines
+
+    async def command(self, cmd, timeout=5):
+        ''' Send an AT command and wait for its result.
+
+            :param str cmd: command without the AT prefix
+            :param int timeout: seconds to wait for the result
+            :rtype: tuple
+            :return: ('OK', 'ERROR' or None, list of response lines)
+        '''
+        async with self.lock:
+            await self._write(("AT" + cmd + "\r").encode('ascii'))
+            return await self._wait_final(timeout)
+
+    async def poll(self, timeout=1):
+        ''' Route unsolicited responses while no command is in flight '''
+        async with self.lock:
+            await self._pump(timeout)
+
+    async def status(self):
+        ''' Query the ISU's MO/MT buffer status with AT+SBDSX.
+
+            :rtype: dict
+            :return: {'mo_flag', 'momsn', 'mt_flag', 'mtmsn', 'ra_flag'} or
+                None if the ISU didn't respond
+        '''
+        self.wait_for_status = True
+        result, _ = await self.command("+SBDSX")
+        if result != "OK":
+            return None
+        return {'mo_flag': self.mo_flag, 'momsn': self.momsn,
+                'mt_flag': self.mt_flag, 'mtmsn': self.mtmsn,
+                'ra_flag': self.ra_flag}
+
+    async def write_mo(self, msg):
+        ''' Write a message to the MO buffer, text with AT+SBDWT or bytes
+            with AT+SBDWB.
+
+            :param str|bytes msg: message
+            :rtype: bool
+            :return: True if the ISU accepted the message
+        '''
+        if isinstance(msg, bytes):
+            cmd = "+SBDWB={}".format(len(msg))
+            payload = msg + self.sbd_crc(msg)
+        else:
+            cmd = "+SBDWT"
+            payload = (msg + "\r").encode('ascii')
+
+        async with self.lock:
+            await self._write(("AT" + cmd + "\r").encode('ascii'))
+            result, _ = await self._wait_final(self.SBD_WRITE_WAIT, "READY")
+            if result != "READY":
+                return False
+            await self._write(payload)
+            result, lines = await self._wait_final(self.SBD_WRITE_WAIT)
+        # SBDWB answers 0 on success, SBDWT just OK
+        return result == "OK" and "1" not in lines and "2" not in lines
+
+    async def wait_for_signal(self, timeout):
+        ''' Route responses until the link estimator considers the signal
+            usable and the serving satellite is above the scheduler's
+            minimum elevation.
+
+            :rtype: bool
+            :return: True if signal is usable
+        '''
+        start = self.clock.time()
+        while not (self.link.ready() and self.scheduler.elevation_ok()):
+            if self.clock.time() - start > timeout:
+                return False
+            await self.poll(1)
+        return True
+
+    async def run_session(self, ring_alert=False):
+        ''' Run an SBDIX session.
+
+            :rtype: dict
+            :return: SBDIX result or None if the session timed out
+        '''
+        self.sbdix = None
+        cmd = "+SBDIXA" if ring_alert else "+SBDIX"
+        await self.command(cmd, self.session_timeout)
+        result = self.sbdix
+        if result:
+            self.momsn = result['momsn']
+            self.mtmsn = result['mtmsn']
+            self._queue = result['queue']
+            if result['mtsta'] == 1:
+                self._mt_flag = 1
+        return result
+
+    async def send(self, msg):
+        ''' Send a message, retrying sessions with back-off until it is
+            delivered or retries are exhausted.  Retries are delayed until
+            the scheduler's predicted next good signal window, and other
+            tasks run while the driver waits on the ISU.
+
+            :param str|bytes msg: message to send
+            :rtype: bool
+            :return: True if the message was delivered
+        '''
+        self.wait_for_send = True
+        try:
+            if not await self.write_mo(msg):
+                return False
+
+            for retry in range(self.retries):
+                await uasyncio.sleep(self.scheduler.delay(retry))
+                await self.wait_for_signal(self.signal_timeout)
+                csq = self.csq
+                result = await self.run_session()
+                sent = bool(result) and 0 <= result['mosta'] <= 4
+                self.scheduler.attempted(sent)
+                self.link.outcome(csq, sent)
+                self.scheduler.csq_thresh = self.link.threshold - 1
+                if sent:
+                    await self.command("+SBDD0")
+                    return True
+                print("session failed, retry: {}".format(retry))
+
+            await self.command("+SBDD0")
+            print("Out of retries, failed message")
+            return False
+        finally:
+            self.wait_for_send = False
+
+    async def read_mt(self):
+        ''' Read the MT buffer as binary with AT+SBDRB.
+
+            :rtype: bytes
+            :return: message payload, or None if the read failed or the
+                checksum didn't match
+        '''
+        reader = self.mt_reader
+        async with self.lock:
+            # responses buffered ahead of the reply are handled first
+            self._route()
+            reader.reset()
+            await self._write(b"AT+SBDRB\r")
+            start = self.clock.time()
+            while not reader.done:
+                remaining = self.SBD_WRITE_WAIT - (self.clock.time() - start)
+                data = await self._read(remaining) if remaining > 0 else None
+                if not data:
+                    return None
+                n = reader.feed(data, self.rx.write)
+                if n < len(data):
+                    self.rx.write(data[n:])
+            await self._wait_final(self.SBD_WRITE_WAIT)
+
+        self._mt_flag = 0
+        if not reader.ok:
+            return None
+        return bytes(reader.payload)
+
+    async def run(self):
+        ''' Driver task.  Routes unsolicited responses, sends queued
+            messages packed into as few sessions as possible, and reads MT
+            messages when the ISU reports them.
+        '''
+        while True:
+            if self.messages:
+                msg = self.pack_messages(self.messages)
+                await self.send(msg)
+            elif self.outbox_pending:
+                entries = self.outbox.pending(self.outbox_by_priority)
+                msg, count = sbd_codec.pack_messages(
+                    [entry.msg for entry in entries], self.mo_max)
+                self.outbox.attempt(entries[:count])
+                if await self.send(msg):
+                    self.outbox.remove(entries[:count])
+                else:
+                    self.outbox_hold = True
+            elif self.ra_flag and not self.wait_for_recv:
+                self.wait_for_recv = True
+                await self.wait_for_signal(self.signal_timeout)
+                await self.run_session(ring_alert=True)
+                self._ra_flag = False
+                self.wait_for_recv = False
+
+            if self.mt_flag:
+                self.handle_mt_msg(await self.read_mt())
+
+            await self.poll(1)
@@ -0,0 +1,263 @@
+"""
+AT Command Queue
+----------------
+
+Correlates AT commands with their responses.
+
+Commands are queued and written to the modem one at a time.  The command in
+flight collects the lines the modem returns until a final result code, OK
+or ERROR, completes it, or until its timeout expires.  The next command is
+only written once the previous one has completed, so every final result is
+matched to the command which produced it.
+
+A command which times out may still be answered.  Before the next command is
+written the queue resyncs with a bare AT, discarding result codes until the
+echo of that AT and its own result have been read, so a late OK or ERROR is
+never taken as the result of the next command.  This relies on the ISU's
+default of echoing commands, which `devices.iridium.MTReader` also needs.
+
+Lines are still routed to the response handlers as they arrive; the queue
+only tracks which command they belong to.  A completed command acts as a
+simple future: inspect `done`, `ok`, `result` and `lines`, or pass a
+callback which is called with the command when it completes.
+
+Commands which need to write data after a prompt, such as AT+SBDWT and
+AT+SBDWB after READY, carry the data as a payload which the queue writes
+when the prompt arrives.
+
+.. code-block:: python
+
+    cmd = rb.commands.submit("+SBDSX", timeout=5)
+    ...
+    if cmd.done and cmd.ok:
+        print(cmd.lines)
+"""
+from core.compat import time
+
+
+class ATCommand:
+    ''' An AT command and its outcome.
+
+        :ivar str cmd: command without the AT prefix
+        :ivar int timeout: seconds to wait for a final result
+        :ivar callback: called with the command when it completes
+        :ivar bytes payload: data written when the prompt is received
+        :ivar str prompt: line which requests the payload
+        :ivar reader: consumes a binary response in place of the line
+            reader, see `devices.iridium.MTReader`
+        :ivar str result: 'OK', 'ERROR' or 'TIMEOUT' once complete
+        :ivar list lines: intermediate response lines
+    '''
+
+    def __init__(self, cmd, timeout=5, callback=None, payload=None,
+                 prompt="READY", reader=None):
+        self.cmd = cmd
+        self.timeout = timeout
+        self.callback = callback
+        self.payload = payload
+        self.prompt = prompt
+        self.reader = reader
+        self.sent = None
+        self.payload_sent = False
+        self.code = None
+        self.result = None
+        self.lines = []
+
+    @property
+    def done(self):
+        return self.result is not None
+
+    @property
+    def ok(self):
+        return self.result == "OK"
+
+    def complete(self, result):
+        self.result = result
+        if self.callback:
+            self.callback(self)
+
+
+class CommandQueue:
+    ''' Queue of AT commands for a modem with one command in flight.
+
+        :param modem: controller with a raw_write method
+        :param clock: object with a time method
+        :param int max_timeouts: consecutive timeouts before the modem is
+            considered stalled
+    '''
+
+    FINAL = ("OK", "ERROR")
+
+    #: Seconds to wait for the answer to the AT written to resync
+    RESYNC_TIMEOUT = 5
+
+    def __init__(self, modem, clock=time, max_timeouts=3):
+        self.modem = modem
+        self.clock = clock
+        self.max_timeouts = max_timeouts
+        self.pending = []
+        self.current = None
+        self.timeouts = 0
+        self.stalled_timeouts = 0
+        self.resync_sent = None
+        self.resync_echoed = False
+
+    def __len__(self):
+        return len(self.pending) + int(self.current is not None)
+
+    @property
+    def busy(self):
+        return self.current is not None or self.resyncing
+
+    @property
+    def resyncing(self):
+        ''' Waiting for the answer to the AT written after a timeout '''
+        return self.resync_sent is not None
+
+    @property
+    def reader(self):
+        ''' The binary reader of the command in flight, while it is still
+            reading.
+        '''
+        command = self.current
+        if command is None or command.reader is None or command.reader.done:
+            return None
+        return command.reader
+
+    @property
+    def stalled(self):
+        ''' The modem has stopped answering commands.
+
+            :rtype: bool
+        '''
+        return self.stalled_timeouts >= self.max_timeouts
+
+    def submit(self, cmd, timeout=5, callback=None, payload=None,
+               prompt="READY", reader=None):
+        ''' Queue a command, writing it now if no command is in flight.
+
+            :param str cmd: command without the AT prefix
+            :param int timeout: seconds to wait for a final result
+            :param callback: called with the command when it completes
+            :param bytes payload: data to write when prompt is received
+            :param str prompt: line which requests the payload
+            :param reader: consumes a binary response, reset when the
+                command is written
+            :rtype: ATCommand
+            :return: the queued command
+        '''
+        command = ATCommand(cmd, timeout, callback, payload, prompt, reader)
+        self.pending.append(command)
+        self.run()
+        return command
+
+    def _send(self, command):
+        self.current = command
+        command.sent = self.clock.time()
+        if command.reader is not None:
+            command.reader.reset()
+        self.modem.raw_write(("AT" + command.cmd + "\r").encode("ascii"))
+
+    def _resync(self):
+        self.resync_sent = self.clock.time()
+        self.resync_echoed = False
+        self.modem.raw_write(b"AT\r")
+
+    def _complete(self, result):
+        command = self.current
+        self.current = None
+        if result == "TIMEOUT":
+            self.timeouts += 1
+            self.stalled_timeouts += 1
+            print("AT{} timed out".format(command.cmd))
+        else:
+            self.stalled_timeouts = 0
+        command.complete(result)
+
+    def feed(self, line):
+        ''' Match a response line to the command in flight.
+
+            :param str line: decoded response line
+            :rtype: bool
+            :return: True if the line completed the command
+        '''
+        if self.resyncing:
+            if line == "AT":
+                self.resync_echoed = True
+            elif line in self.FINAL:
+                if not self.resync_echoed:
+                    print("late {} discarded".format(line))
+                    return False
+                # the modem answers, whatever became of the timed out command
+                self.resync_sent = None
+                self.stalled_timeouts = 0
+                self.run()
+                return True
+            return False
+
+        command = self.current
+        if command is None:
+            return False
+
+        if line in self.FINAL:
+            self._complete("ERROR" if command.code else line)
+            self.run()
+            return True
+
+        if command.payload is not None:
+            if not command.payload_sent and line == command.prompt:
+                command.payload_sent = True
+                self.modem.raw_write(command.payload)
+                return False
+            if command.payload_sent and line in ("1", "2", "3"):
+                # 1 is a write timeout, the only code without a final OK
+                command.code = int(line)
+                if line == "1":
+                    self._complete("ERROR")
+                    self.run()
+                    return True
+
+        if not line.startswith("AT"):
+            command.lines.append(line)
+        return False
+
+    def run(self):
+        ''' Expire the command in flight if it has timed out and write the
+            next command if none is in flight.  After a timeout the next
+            command waits until the modem has been resynced.
+        '''
+        command = self.current
+        if command is not None:
+            if self.clock.time() - command.sent <= command.timeout:
+                return
+            self._complete("TIMEOUT")
+            self._resync()
+            return
+
+        if self.resyncing:
+            if self.clock.time() - self.resync_sent <= self.RESYNC_TIMEOUT:
+                return
+            # another AT could be answered after this one and be taken as
+            # the next command's result, keep waiting and let the stall
+            # count decide when to power cycle
+            self.timeouts += 1
+            self.stalled_timeouts += 1
+            self.resync_sent = self.clock.time()
+            print("AT resync timed out")
+            return
+
+        if self.pending:
+            self._send(self.pending.pop(0))
+
+    def clear(self):
+        ''' Drop all queued commands, e.g. after the modem is powered down.
+            The command in flight is completed with 'TIMEOUT'.
+        '''
+        pending, self.pending = self.pending, []
+        if self.current is not None:
+            command, self.current = self.current, None
+            command.complete("TIMEOUT")
+        for command in pending:
+            command.complete("TIMEOUT")
+        self.stalled_timeouts = 0
+        self.resync_sent = None
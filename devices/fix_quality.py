@@ -0,0 +1,140 @@
+"""
+Fix Quality
+-----------
+
+Decides when a GPS fix is good enough to report, so the GPS can be turned
+off as soon as it has one.
+
+A position is available as soon as the receiver has any fix, but the first
+fixes after a start are often 2D or computed from few satellites with a
+poor geometry.  The policy estimates the horizontal accuracy of each fix as
+its HDOP times a typical user range error, and accepts a fix which meets a
+target accuracy, is 3D, uses enough satellites and has an acceptable PDOP.
+
+Fixes are kept in a small ring of candidates as they arrive.  If no fix
+meets the target within the time budget, the best candidate, 3D before 2D
+and then by HDOP, is reported instead of waiting longer.
+
+.. code-block:: python
+
+    policy.start()
+    ...
+    gps.run()
+    policy.offer(gps.fix)
+    if policy.done():
+        report(policy.best())
+"""
+from core.compat import time
+from devices.gps import Fix
+
+
+#: Typical user equivalent range error in meters, scales HDOP to accuracy
+UERE = 5.
+
+
+class FixPolicy:
+    ''' Accepts a fix which meets a target accuracy, or the best fix seen
+        once the time budget is spent.
+
+        :param float target: horizontal accuracy to reach, meters
+        :param int budget: seconds after start to wait for the target
+        :param float max_pdop: highest PDOP of an acceptable fix
+        :param int min_sats: fewest satellites in an acceptable fix
+        :param int size: number of candidate fixes kept
+        :param clock: object with a time method
+        :ivar bool met: the last fix offered met the target
+    '''
+
+    def __init__(self, target=10., budget=120, max_pdop=6., min_sats=4,
+                 size=4, clock=time):
+        self.target = target
+        self.budget = budget
+        self.max_pdop = max_pdop
+        self.min_sats = min_sats
+        self.clock = clock
+        self.ring = [Fix() for _ in range(size)]
+        self.start()
+
+    def start(self, now=None):
+        ''' Forget the candidates and start the time budget. '''
+        self.start_time = self.clock.time() if now is None else now
+        self.count = 0
+        self.head = 0
+        self.last = 0
+        self.met = False
+
+    @staticmethod
+    def accuracy(fix):
+        ''' Estimated horizontal accuracy of a fix, meters.
+
+            :rtype: float
+        '''
+        return fix.hdop * UERE
+
+    @staticmethod
+    def usable(fix):
+        ''' Check if a fix has a position at all.
+
+            :rtype: bool
+        '''
+        return fix.valid and (fix.quality > 0 or fix.mode >= 2)
+
+    def good(self, fix):
+        ''' Check if a fix meets the target.
+
+            :rtype: bool
+        '''
+        return (fix.mode == 3 and fix.sats >= self.min_sats and
+                fix.pdop <= self.max_pdop and
+                self.accuracy(fix) <= self.target)
+
+    def offer(self, fix):
+        ''' Keep a fix as a candidate.  A fix for the same time as the last
+            candidate replaces it, as the sentences of an epoch arrive.
+
+            :param Fix fix: current fix
+            :rtype: bool
+            :return: True if the fix meets the target
+        '''
+        if not self.usable(fix):
+            return False
+        if self.count and self.ring[self.last].utc == fix.utc:
+            slot = self.last
+        else:
+            slot = self.head
+            self.head = (self.head + 1) % len(self.ring)
+            self.count = min(self.count + 1, len(self.ring))
+        self.ring[slot].copy(fix)
+        self.last = slot
+        self.met = self.good(fix)
+        return self.met
+
+    def expired(self, now=None):
+        ''' Check if the time budget is spent.
+
+            :rtype: bool
+        '''
+        now = self.clock.time() if now is None else now
+        return now - self.start_time >= self.budget
+
+    def done(self, now=None):
+        ''' Check if there is a fix to report: one which met the target, or
+            any candidate once the time budget is spent.
+
+            :rtype: bool
+        '''
+        return self.met or (self.count > 0 and self.expired(now))
+
+    def best(self):
+        ''' The fix to report, None without candidates.
+
+            :rtype: Fix
+        '''
+        if self.met:
+            return self.ring[self.last]
+        best = None
+        for fix in self.ring[:self.count]:
+            if best is None or ((fix.mode != 3, fix.hdop) <
+                                (best.mode != 3, best.hdop)):
+                best = fix
+        return best
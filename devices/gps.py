@@ -1,5 +1,112 @@
 from core.compat import time
+from devices.gps_assist import nmea_days
 from devices.mtk_nmea import MTKTalker
+from devices.nmea_parsers import FieldSelector
+from devices.sky_view import SkyView
+from devices.sbd_codec import nmea_degrees, utc_seconds
+
+
+#: km/h per knot, RMC reports speed in knots
+KNOTS_KMH = 1.852
+
+
+class Fix:
+    ''' Last known fix in numeric form, converted once as sentences are
+        parsed so consumers don't each parse NMEA strings.
+
+        =========  ======================================
+        attribute  value
+        =========  ======================================
+        lat        latitude, decimal degrees, negative S
+        lon        longitude, decimal degrees, negative W
+        cog        true course over ground, degrees
+        sog        speed over ground, km/h
+        utc        seconds since midnight UTC
+        quality    GGA fix quality, 0 is no fix
+        hdop       horizontal dilution of precision
+        pdop       position dilution of precision
+        mode       GSA fix mode, 2 is 2D, 3 is 3D, 0 if unknown
+        sats       satellites used in the fix
+        alt        altitude above mean sea level, meters
+        date       RMC date, days since 2000-01-01, 0 if unknown
+        valid      a position has been set
+        =========  ======================================
+    '''
+
+    __slots__ = ('lat', 'lon', 'cog', 'sog', 'utc', 'quality', 'hdop',
+                 'pdop', 'mode', 'sats', 'alt', 'date', 'valid')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        ''' Forget the fix '''
+        self.lat = 0.
+        self.lon = 0.
+        self.cog = 0.
+        self.sog = 0.
+        self.utc = 0
+        self.quality = 0
+        self.hdop = 99.
+        self.pdop = 99.
+        self.mode = 0
+        self.sats = 0
+        self.alt = 0.
+        self.date = 0
+        self.valid = False
+
+    def copy(self, other):
+        ''' Copy another fix into this one, without allocating '''
+        for name in self.__slots__:
+            setattr(self, name, getattr(other, name))
+
+    def update(self, data):
+        ''' Convert the fields of a parsed sentence which are present.
+
+            :param dict data: parsed NMEA fields
+        '''
+        lat = data.get('latitude')
+        ns = data.get('NS')
+        lon = data.get('longitude')
+        ew = data.get('EW')
+        if lat and ns and lon and ew:
+            self.lat = nmea_degrees(lat, ns)
+            self.lon = nmea_degrees(lon, ew)
+            self.valid = True
+        val = data.get('utc')
+        if val:
+            self.utc = utc_seconds(val)
+        val = data.get('t_course') or data.get('speed_over_course')
+        if val:
+            self.cog = float(val)
+        val = data.get('ground_speed')
+        if val:
+            self.sog = float(val)
+        else:
+            val = data.get('speed_over_ground')
+            if val:
+                self.sog = float(val) * KNOTS_KMH
+        val = data.get('fix')
+        if val:
+            self.quality = int(val)
+        val = data.get('hdop')
+        if val:
+            self.hdop = float(val)
+        val = data.get('pdop')
+        if val:
+            self.pdop = float(val)
+        val = data.get('fix_mode2')
+        if val:
+            self.mode = int(val)
+        val = data.get('sats_used')
+        if val:
+            self.sats = int(val)
+        val = data.get('msl_alt')
+        if val:
+            self.alt = float(val)
+        val = data.get('date')
+        if val:
+            self.date = nmea_days(val)
 
 
 class GPS(MTKTalker):
@@ -19,7 +126,18 @@ class GPS(MTKTalker):
         :ivar dict location_data: last known location data reported from
             gps device
         :ivar dict course_data: last known course data reported from gps device
+        :ivar Fix fix: last known fix in numeric form
+        :ivar SkyView sky: satellites in view, from GSV sequences
         :ivar int last_fix_time:  Time of last GPS fix
+        :ivar str output_profile: name of the sentence output profile set
+            when the device is started, see `devices.mtk_nmea.OUTPUT_PROFILES`.
+            None leaves the device's output as it is.
+        :ivar GPSAssist assist: saves the last fix and injects it when the
+            device is started, see `devices.gps_assist`
+        :ivar int ttff: seconds from start to the first fix, None until
+            there is one
+        :ivar int boot_wait: seconds to wait for the device's startup
+            message before configuring it anyway
         :ivar bool passthrough: Outputs raw NMEA sentences as seen from device
         :ivar bool wait_for_firstfix: Indicates if device has received it's
             first GPS fix since start
@@ -31,18 +149,40 @@ class GPS(MTKTalker):
     signal_attrs = ("fix", "fix_mode1", "fix_mode2", "num_sv")
     #: Keys for picking course data from parsed NMEA sentences
     course_atts = ('t_course', 'ground_speed')
+    #: Keys for fix quality, only kept in numeric form in `fix`
+    quality_attrs = ('hdop', 'pdop', 'sats_used')
+    #: Keys kept in `fix` to assist the next start
+    assist_attrs = ('msl_alt', 'date')
+    #: Keys of RMC, which stands in for GGA and VTG when a profile turns
+    #: those off
+    rmc_attrs = ('status', 'speed_over_ground', 'speed_over_course')
+    #: Keys of the device's system messages, PMTK010
+    system_attrs = ('system_msg',)
+
+    #: PMTK010 message sent once the device has booted
+    STARTUP = "001"
 
     def __init__(self, clock=time):
         self.clock = clock
         super().__init__()
         self.last_sat_time = 0
+        self.start_time = self.clock.time()
         self.signal_data = {}
         self.location_data = {}
         self.course_data = {}
+        self.fix = Fix()
+        self.sky = SkyView()
         self.last_fix_time = None
         self.waypoints = []
         self.passthrough = False
         self.wait_for_firstfix = True
+        self.output_profile = None
+        self.assist = None
+        self.ttff = None
+        self.fix_clock = None
+        self.boot_wait = 2
+        self.boot_start = None
+        self.restarted = False
 
     def connect(self, devices):
         """ Sets up the hardware connections as the enable pin for the device
@@ -51,6 +191,10 @@ class GPS(MTKTalker):
         """
         self.en = devices['en']
         super().connect(devices['conn'])
+        self.stream.subscribe(FieldSelector(
+            self.location_attrs + self.signal_attrs + self.course_atts +
+            self.quality_attrs + self.rmc_attrs + self.assist_attrs +
+            self.system_attrs))
 
     def any(self):
         """ Returns length of data pending in the connection's buffer.
@@ -72,24 +216,46 @@ class GPS(MTKTalker):
                 start_time         self.clock.time()
                 signal_data        {}
                 location_data      {}
+                fix                cleared
+                sky                cleared
                 last_sat_time      self.clock.time()
                 =================  =====
+
+            Commands sent while the device boots are lost, so it is
+            configured by `run` once it reports its startup message, or
+            `boot_wait` seconds after power up: the `assist` restarts the
+            receiver, waiting for it to boot again if it does, and injects
+            the saved fix, then the `output_profile`, if any, is sent.
         """
 
         self.wait_for_firstfix = True
         self.start_time = self.clock.time()
+        self.restarted = False
         if not self.en():
             self.en.on()
+            self.boot_start = self.start_time
+        else:
+            # already running, nothing to wait for
+            self.boot_start = self.start_time - self.boot_wait
         self.conn.write(b"A\r\n")
+        self.ttff = None
+        self.fix_clock = None
         self.signal_data.clear()
         self.location_data.clear()
+        self.fix.clear()
+        self.sky.clear()
         self.last_sat_time = self.clock.time()
 
     def stop(self):
         """ Turn off the GPS unit, and clear incomplete unhandled device
-            responses.
+            responses.  A fix obtained since start is saved by the `assist`.
         """
         self.en.off()
+        self.boot_start = None
+        if self.assist and self.fix_clock is not None:
+            self.assist.update(self.fix, self.fix_clock)
+            self.assist.store()
+            self.fix_clock = None
         # flush the stream
         if self.stream:
             self.stream.clear()
@@ -109,30 +275,76 @@ class GPS(MTKTalker):
             k: self.stream.data.get(k)
             for k in self.location_attrs}
 
-        for k in self.course_atts:
-            self.course_data[k] = self.stream.data.get(k)
+        data = self.stream.data
+        cog = data.get('t_course') or data.get('speed_over_course')
+        if cog:
+            self.course_data['t_course'] = cog
+            sog = data.get('ground_speed')
+            if not sog and data.get('speed_over_ground'):
+                sog = "{:.2f}".format(
+                    float(data['speed_over_ground']) * KNOTS_KMH)
+            self.course_data['ground_speed'] = sog
+
+        if data.get('system_msg') == self.STARTUP and (
+                self.boot_start is not None):
+            self._booted()
+
+        if data.get('status') == "A":
+            # valid RMC fix, GGA may not be in the output profile
+            self._first_fix()
 
         for k in self.signal_attrs:
             val = self.stream.data.get(k)
             if val:
                 self.signal_data[k] = val
                 if k == "fix" and val != "0":
-                    self.wait_for_firstfix = False
-                    self.last_sat_time = self.clock.time()
+                    self._first_fix()
                 if k == "fix_mode2" and val != "1":
                     # self.wait_for_firstfix = False
                     self.last_sat_time = self.clock.time()
 
-        self.stream.data.clear()
+        if data.get('num_sv') is not None:
+            # GSV, satellites are assembled from the whole sentence
+            self.sky.feed(self.protocol.datafields, self.protocol.pkt_type[:2])
+
+        try:
+            self.fix.update(self.stream.data)
+        except ValueError:
+            pass
+        self.stream.clear_data()
         if all(new_location_data.values()):
             self.location_data.update(new_location_data)
             utc = new_location_data['utc']
             self.last_fix_time = utc
+            self.fix_clock = self.clock.time()
+
+    def _booted(self):
+        ''' Configure the device once it has booted '''
+        self.boot_start = None
+        if self.assist and not self.restarted:
+            self.restarted = True
+            if self.assist.wake(self):
+                # wait for the restart to boot
+                self.boot_start = self.clock.time()
+                return
+        if self.assist:
+            self.assist.inject(self)
+        if self.output_profile:
+            self.set_profile(self.output_profile)
+
+    def _first_fix(self):
+        self.last_sat_time = self.clock.time()
+        if self.wait_for_firstfix:
+            self.wait_for_firstfix = False
+            self.ttff = self.last_sat_time - self.start_time
+            if self.assist:
+                self.assist.first_fix(self.ttff)
 
     def run(self):
         ''' Read the underlying data stream, process it, and handle the
             passthrough of NMEA sentences to std out.
-            Update data from the processed stream data
+            Update data from the processed stream data, and configure the
+            device once it has booted.
         '''
         self.stream.read()
 
@@ -144,6 +356,10 @@ class GPS(MTKTalker):
 
             self.update()
 
+        if (self.boot_start is not None and
+                self.clock.time() - self.boot_start >= self.boot_wait):
+            self._booted()
+
     def import_waypoint(self, wp_data):
         """ Add, modify, or delete waypoint data.
 
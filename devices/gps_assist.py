@@ -0,0 +1,296 @@
+"""
+GPS Assist
+----------
+
+Keeps the last good fix across deep sleep and uses it to shorten the time
+to first fix when the GPS is powered up again.
+
+The position, altitude, UTC date and time of the last fix are written to a
+small file on the flash filesystem when the GPS is stopped, along with the
+system clock time of the fix.  The system clock keeps running through deep
+sleep, so on the next wake the current UTC time is the fix time plus the
+clock time elapsed since.  Once the MTK receiver has booted it is given the
+time with PMTK740 and the position with PMTK741, so it can predict which
+satellites are in view instead of searching the whole sky.
+
+The strategy depends on the age of the saved fix:
+
+=========  ==============  ==========================================
+strategy   age             action
+=========  ==============  ==========================================
+hot        <= `hot_age`    hot restart, keeps ephemeris, then inject
+                           once the receiver has booted again
+warm       <= `max_age`    inject only, the ephemeris is stale but
+                           the almanac the receiver kept still helps
+cold       older/unknown   no restart or injection, the receiver's
+                           own start
+=========  ==============  ==========================================
+
+Commands sent while the receiver boots are lost, so the GPS driver calls
+`wake` once it has booted after power up, and `inject` once it has booted
+again after the restart, see `devices.gps.GPS.start`.
+
+A clock which went backwards since the fix was saved, as after a power
+loss, makes the age unknown.
+
+The time to first fix of the last `TTFF_LOG` wakes is kept in the same
+file, with the strategy used, so strategies can be compared in the field.
+
+========  =====================================================
+record    layout
+========  =====================================================
+hint      b'GA', lat (f), lon (f), alt (f), days (H), utc (I),
+          clock (I), next log slot (B)
+log       `TTFF_LOG` times, (H), then `TTFF_LOG` strategies (B)
+========  =====================================================
+
+All values are little endian.  `days` counts from 2000-01-01, 0 is no
+hint.
+"""
+from array import array
+from core.compat import time
+import struct
+
+
+#: Default file holding the saved fix on the flash filesystem
+ASSIST_FILE = "gps_assist"
+
+#: Number of time to first fix results kept
+TTFF_LOG = 8
+
+HINT_FORMAT = "<2sfffHIIB"
+HINT_SIZE = struct.calcsize(HINT_FORMAT)
+LOG_FORMAT = "<{}H".format(TTFF_LOG)
+MAGIC = b"GA"
+
+#: Strategy names by code, as recorded in the time to first fix log
+STRATEGIES = ('none', 'hot', 'warm', 'cold')
+
+_MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _leap(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def days_from_date(year, month, day):
+    ''' Days since 2000-01-01 of a date from 2000 on.
+
+        :rtype: int
+    '''
+    days = 0
+    for y in range(2000, year):
+        days += 366 if _leap(y) else 365
+    for m in range(1, month):
+        days += _MONTH_DAYS[m - 1]
+        if m == 2 and _leap(year):
+            days += 1
+    return days + day - 1
+
+
+def date_from_days(days):
+    ''' Date of a day counted from 2000-01-01.
+
+        :rtype: tuple
+        :return: (year, month, day)
+    '''
+    year = 2000
+    while True:
+        length = 366 if _leap(year) else 365
+        if days < length:
+            break
+        days -= length
+        year += 1
+    month = 1
+    while True:
+        length = _MONTH_DAYS[month - 1]
+        if month == 2 and _leap(year):
+            length += 1
+        if days < length:
+            break
+        days -= length
+        month += 1
+    return year, month, days + 1
+
+
+def nmea_days(date):
+    ''' Convert an RMC ddmmyy date to days since 2000-01-01.
+
+        :param str date: NMEA date
+        :rtype: int
+    '''
+    return days_from_date(2000 + int(date[4:6]), int(date[2:4]),
+                          int(date[0:2]))
+
+
+class GPSAssist:
+    ''' Saved fix and time to first fix log of a GPS.
+
+        :param str path: file to keep the saved fix in
+        :param clock: object with a time method, which keeps running through
+            deep sleep
+        :param int hot_age: oldest fix, in seconds, to hot restart with
+        :param int max_age: oldest fix, in seconds, to inject at all
+        :ivar str strategy: strategy used at the last wake
+    '''
+
+    def __init__(self, path=ASSIST_FILE, clock=time, hot_age=2*3600,
+                 max_age=7*24*3600):
+        self.path = path
+        self.clock = clock
+        self.hot_age = hot_age
+        self.max_age = max_age
+        self.lat = 0.
+        self.lon = 0.
+        self.alt = 0.
+        self.days = 0
+        self.utc = 0
+        self.saved = 0
+        self.ttff = array('H', [0] * TTFF_LOG)
+        self.used = bytearray(TTFF_LOG)
+        self.head = 0
+        self.strategy = None
+
+    def load(self):
+        ''' Read the saved fix and log, if there is one.
+
+            :rtype: bool
+            :return: True if a saved fix was read
+        '''
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            return False
+        if len(raw) < HINT_SIZE + TTFF_LOG * 3:
+            return False
+        (magic, self.lat, self.lon, self.alt, self.days, self.utc,
+         self.saved, self.head) = struct.unpack(HINT_FORMAT, raw[:HINT_SIZE])
+        if magic != MAGIC:
+            self.days = 0
+            return False
+        pos = HINT_SIZE
+        self.ttff = array('H', struct.unpack(LOG_FORMAT,
+                                             raw[pos:pos + TTFF_LOG * 2]))
+        pos += TTFF_LOG * 2
+        self.used = bytearray(raw[pos:pos + TTFF_LOG])
+        self.head %= TTFF_LOG
+        return self.days > 0
+
+    def store(self):
+        ''' Write the saved fix and log to the flash filesystem. '''
+        hint = struct.pack(HINT_FORMAT, MAGIC, self.lat, self.lon, self.alt,
+                           self.days, self.utc, self.saved, self.head)
+        try:
+            with open(self.path, 'wb') as f:
+                f.write(hint)
+                f.write(struct.pack(LOG_FORMAT, *self.ttff))
+                f.write(self.used)
+        except OSError as e:
+            print("gps assist: {}".format(e))
+
+    def update(self, fix, when):
+        ''' Keep a fix to assist the next start.
+
+            :param Fix fix: fix with a position and date
+            :param int when: clock time of the fix
+        '''
+        if not fix.valid or not fix.date:
+            return False
+        self.lat = fix.lat
+        self.lon = fix.lon
+        self.alt = fix.alt
+        self.days = fix.date
+        self.utc = fix.utc
+        self.saved = int(when)
+        return True
+
+    def age(self, now=None):
+        ''' Seconds since the saved fix, None if it is unknown.
+
+            :rtype: int
+        '''
+        if not self.days:
+            return None
+        now = int(self.clock.time() if now is None else now)
+        age = now - self.saved
+        if age < 0:
+            return None
+        return age
+
+    def choose(self, now=None):
+        ''' Pick the restart strategy for the age of the saved fix.
+
+            :rtype: str
+        '''
+        age = self.age(now)
+        if age is None or age > self.max_age:
+            return 'cold'
+        if age <= self.hot_age:
+            return 'hot'
+        return 'warm'
+
+    def now_utc(self, now=None):
+        ''' Current UTC date and time, from the saved fix and the clock.
+
+            :rtype: tuple
+            :return: (year, month, day, hour, minute, second)
+        '''
+        seconds = self.utc + self.age(now)
+        days = self.days + seconds // 86400
+        seconds %= 86400
+        year, month, day = date_from_days(days)
+        return (year, month, day,
+                seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+    def wake(self, gps, now=None):
+        ''' Pick the strategy for this wake, and hot restart the receiver
+            if it is the one to use.
+
+            :param gps: `MTKTalker` to configure, booted
+            :rtype: bool
+            :return: True if the receiver was restarted, `inject` once it
+                has booted again
+        '''
+        self.strategy = self.choose(now)
+        if self.strategy == 'hot':
+            gps.restart('hot')
+            return True
+        return False
+
+    def inject(self, gps, now=None):
+        ''' Give the receiver the saved time and position, unless the
+            strategy is cold.
+
+            :param gps: `MTKTalker` to configure, booted
+        '''
+        if self.strategy not in ('hot', 'warm'):
+            return
+        when = self.now_utc(now)
+        gps.set_time(*when)
+        gps.set_position(self.lat, self.lon, self.alt, *when)
+
+    def first_fix(self, seconds):
+        ''' Log the time to first fix of this wake.
+
+            :param int seconds: time from start to the first fix
+        '''
+        self.ttff[self.head] = max(0, min(int(seconds), 0xFFFF))
+        self.used[self.head] = STRATEGIES.index(self.strategy or 'none')
+        self.head = (self.head + 1) % TTFF_LOG
+
+    def stats(self):
+        ''' Mean time to first fix and number of wakes, by strategy.
+
+            :rtype: dict
+            :return: {strategy: (mean seconds, count)}
+        '''
+        totals = {}
+        for idx in range(TTFF_LOG):
+            code = self.used[idx]
+            if not code:
+                continue
+            total, count = totals.get(STRATEGIES[code], (0, 0))
+            totals[STRATEGIES[code]] = (total + self.ttff[idx], count + 1)
+        return {name: (total // count, count)
+                for name, (total, count) in totals.items()}
@@ -1,5 +1,7 @@
 import gc
+from array import array
 from core.compat import time
+from devices import sbd_codec
 
 
 class SBDSession:
@@ -18,7 +20,8 @@ class SBDSession:
     '''
 
     def __init__(self, state_callback, run_callback, timeout=30,
-                 retry=0, delay=0, on_complete=None):
+                 retry=0, delay=0, on_complete=None, clock=time):
+        self.clock = clock
         self.state_callback = state_callback
         self.run_callback = run_callback
         self.timeout = timeout
@@ -26,7 +29,7 @@ class SBDSession:
         self.delay = delay
         if delay > 0:
             self.status = 2
-            self.start = time.time()
+            self.start = self.clock.time()
         else:
             self.status = 0
             self.start = 0
@@ -49,7 +52,7 @@ class SBDSession:
         '''
         if self.status == 0:
             self.prev_state = self.state_callback()
-            self.start = time.time()
+            self.start = self.clock.time()
             self.status = 1
             self.run_callback()
 
@@ -64,7 +67,7 @@ class SBDSession:
         for k, v in status.items():
             if hasattr(self, k):
                 setattr(self, k, v)
-        self.end = time.time()
+        self.end = self.clock.time()
         self.status = 4
         if self.on_complete:
             self.on_complete()
@@ -81,7 +84,7 @@ class SBDSession:
             return True
 
         elif self.status == 1:
-            if time.time() - self.start < self.timeout:
+            if self.clock.time() - self.start < self.timeout:
                 return True
             else:
                 self.status = 3
@@ -89,7 +92,7 @@ class SBDSession:
 
         elif self.status == 2:
             # delayed start, check delay and trigger attempt if delay over
-            if time.time() - self.start > self.delay:
+            if self.clock.time() - self.start > self.delay:
                 self.status = 0
             return True
 
@@ -97,11 +100,231 @@ class SBDSession:
             return False
 
 
+class SBDSessionLog:
+    ''' Fixed size ring of completed SBD session records, for telemetry on
+        where Iridium time and energy goes.
+
+        Each record holds the session's status, retry number, MO status,
+        latency from attempt to result and the CSQ at the attempt, in
+        preallocated arrays.
+
+        :param int size: number of sessions kept
+    '''
+
+    def __init__(self, size=32):
+        self.size = size
+        self.status = array('b', [0] * size)
+        self.retry = array('b', [0] * size)
+        self.mosta = array('h', [0] * size)
+        self.csq = array('b', [0] * size)
+        self.latency = array('f', [0] * size)
+        self.head = 0
+        self.count = 0
+        self.total = 0
+
+    def __len__(self):
+        return self.count
+
+    def record(self, session, now):
+        ''' Record a completed or failed session.
+
+            :param SBDSession session: session with status 3 or 4
+            :param int now: clock time, used as the end of failed sessions
+        '''
+        i = self.head
+        end = session.end if session.status == 4 else now
+        state = session.prev_state or {}
+        self.status[i] = session.status
+        self.retry[i] = min(session.retry, 127)
+        self.mosta[i] = -1 if session.mosta is None else session.mosta
+        self.csq[i] = state.get('csq', -1)
+        self.latency[i] = max(0, end - session.start) if session.start else 0
+        self.head = (i + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        self.total += 1
+
+    def _percentile(self, values, pct):
+        if not values:
+            return None
+        values = sorted(values)
+        return round(values[min(len(values) - 1, len(values) * pct // 100)], 1)
+
+    def summary(self):
+        ''' Summarise the recorded sessions.
+
+            ================  ===========================================
+            key               meaning
+            ================  ===========================================
+            'sessions'        sessions recorded since start
+            'success'         fraction of kept sessions delivering MO
+            'p50', 'p95'      session latency percentiles, seconds
+            'retries'         failed sessions per delivered message
+            'csq'             count of attempts by CSQ, 0-5
+            'csq_ok'          count of delivering attempts by CSQ, 0-5
+            ================  ===========================================
+
+            :rtype: dict
+        '''
+        delivered = 0
+        latencies = []
+        csq = [0] * 6
+        csq_ok = [0] * 6
+        for i in range(self.count):
+            ok = self.status[i] == 4 and 0 <= self.mosta[i] <= 4
+            delivered += ok
+            latencies.append(self.latency[i])
+            if 0 <= self.csq[i] <= 5:
+                csq[self.csq[i]] += 1
+                csq_ok[self.csq[i]] += ok
+        n = self.count
+        return {
+            'sessions': self.total,
+            'success': round(delivered / n, 3) if n else None,
+            'p50': self._percentile(latencies, 50),
+            'p95': self._percentile(latencies, 95),
+            'retries': (round((n - delivered) / delivered, 2)
+                        if delivered else None),
+            'csq': csq,
+            'csq_ok': csq_ok,
+        }
+
+
+class MTReader:
+    ''' Streaming reader for an AT+SBDRB response.
+
+        The response is the echoed command, a two byte length, the message
+        and a two byte checksum, followed by the final result code.  Bytes
+        are fed in as they arrive from the UART and the message is copied
+        straight into a preallocated buffer while the checksum is summed,
+        so messages up to the full MT size are read without truncation or
+        reallocation.
+
+        Unsolicited results, e.g. +CIEV, can arrive after the command is
+        written and before its response.  Until the echo or the length is
+        seen, a byte which can't start the response starts a text line,
+        which is passed through to the line reader.  A length too large for
+        the buffer can't be a response, so its bytes are discarded up to
+        the end of the line and the reader waits for the response again.
+
+        :param int size: largest message accepted
+        :ivar int resyncs: lengths discarded while reading the response
+    '''
+
+    WAIT = 0
+    HEAD = 1
+    ECHO = 2
+    DATA = 3
+    CRC = 4
+    LINE = 5
+    RESYNC = 6
+    DONE = 7
+
+    def __init__(self, size=sbd_codec.MT_MAX):
+        self.size = size
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.head = bytearray(2)
+        self.reset()
+
+    def reset(self):
+        ''' Prepare for a new response '''
+        self.state = self.WAIT
+        self.fill = 0
+        self.length = 0
+        self.crc = 0
+        self.ok = False
+        self.resyncs = 0
+
+    @property
+    def done(self):
+        return self.state == self.DONE
+
+    @property
+    def payload(self):
+        ''' The message read, valid until the next read '''
+        return self.mv[:self.length]
+
+    def feed(self, data, passthrough=None):
+        ''' Consume bytes of the response.
+
+            :param bytes data: bytes read from the UART
+            :param passthrough: called with the bytes of text lines read
+                ahead of the response, in order, e.g. the line reader's
+                write method
+            :rtype: int
+            :return: number of bytes consumed, bytes beyond the response
+                are left for the line reader
+        '''
+        mv = memoryview(data)
+        i = 0
+        end = len(data)
+        high = self.size >> 8
+        while i < end and self.state != self.DONE:
+            state = self.state
+            if state == self.WAIT:
+                byte = data[i]
+                if byte == 0x41:
+                    # 'A' of the echoed command
+                    self.state = self.ECHO
+                elif byte <= high:
+                    # high byte of the length, never a text character
+                    self.state = self.HEAD
+                else:
+                    self.state = self.LINE
+
+            elif state == self.HEAD or state == self.CRC:
+                if state == self.HEAD and not self.fill and data[i] > high:
+                    # text after the echo, not the length
+                    self.state = self.WAIT
+                    continue
+                self.head[self.fill] = data[i]
+                self.fill += 1
+                i += 1
+                if self.fill < 2:
+                    continue
+                self.fill = 0
+                if state == self.CRC:
+                    self.ok = (self.head[0] << 8 | self.head[1]) == (
+                        self.crc & 0xFFFF)
+                    self.state = self.DONE
+                else:
+                    self.length = self.head[0] << 8 | self.head[1]
+                    if self.length > self.size:
+                        self.length = 0
+                        self.resyncs += 1
+                        self.state = self.RESYNC
+                    else:
+                        self.state = self.DATA if self.length else self.CRC
+
+            elif state == self.DATA:
+                n = min(self.length - self.fill, end - i)
+                chunk = mv[i:i + n]
+                self.mv[self.fill:self.fill + n] = chunk
+                self.crc += sum(chunk)
+                self.fill += n
+                i += n
+                if self.fill == self.length:
+                    self.fill = 0
+                    self.state = self.CRC
+
+            else:
+                # ECHO runs to CR, LINE and RESYNC to LF
+                idx = data.find(b"\r" if state == self.ECHO else b"\n", i)
+                stop = end if idx < 0 else idx + 1
+                if state == self.LINE and passthrough is not None:
+                    passthrough(mv[i:stop])
+                i = stop
+                if idx >= 0:
+                    self.state = self.HEAD if state == self.ECHO else self.WAIT
+        return i
+
+
 class SBDCommandMixin:
 
     SBD_INITX_PAUSE = 1
     SBD_WRITE_WAIT = 5
     SBD_WRITE_PAUSE = 1
+    SBD_SESSION_WAIT = 30
 
     def sbd_clear_buffer(self, buffer_num):
         ''' Using this command or power cycling the phone are the only means
@@ -120,7 +343,12 @@ class SBDCommandMixin:
         :param int buffer_num: Buffer to clear, 0 - clears the MO,
             1 - clears to MT, 2 - clears both
         '''
-        return self.atcmd("+SBDD" + str(buffer_num), False)
+        def cleared(command):
+            # the MO buffer is empty, don't wait for a status to say so
+            if command.ok and buffer_num in (0, 2):
+                self.mo_flag = 0
+
+        return self.atcmd("+SBDD" + str(buffer_num), False, callback=cleared)
 
     def sbd_clear_mo(self):
         ''' Clears the MO buffer'''
@@ -164,7 +392,9 @@ class SBDCommandMixin:
 
             :param str value: "?" queries RA status
         """
-        return self.atcmd("+SBDMTA" + str(value), False)
+        if value != "?":
+            value = "=" + str(value)
+        return self.atcmd("+SBDMTA" + value, False)
 
     def sbd_status(self, extended=True):
         '''Returns status of the MO and MT buffers.  Short or extended.
@@ -177,8 +407,13 @@ class SBDCommandMixin:
         _cmd = "+SBDS"
         if extended:
             _cmd += "X"
-        self.atcmd(_cmd, False)
         self.wait_for_status = True
+        return self.atcmd(_cmd, False, callback=self._status_done)
+
+    def _status_done(self, command):
+        if not command.ok:
+            # the status response is lost, don't wait for it
+            self.wait_for_status = False
 
     def sbd_session_timeout(self, value="?"):
         '''Session time out, in seconds'''
@@ -204,12 +439,17 @@ class SBDCommandMixin:
             _cmd += "A"  # if in response to ring alert
         if location:
             _cmd += "=" + location
-        self.atcmd(_cmd, reply=False)
+        return self.atcmd(_cmd, reply=False, timeout=self.SBD_SESSION_WAIT)
 
     def sbd_write(self, message):
         """ Write an ascii message to the SBD modem's MO buffer for sending.
 
+            The message is queued as the payload of AT+SBDWT and written when
+            the ISU responds with READY.
+
             :param str message: message to send
+            :rtype: ATCommand
+            :return: the queued write command
 
         """
         gc.collect()
@@ -221,13 +461,8 @@ class SBDCommandMixin:
             message += '\r'
 
         print("rb msg load: {}".format(message))
-        # this tosses some data, can append to unterminated string...
-        self.atcmd("+SBDWT", False)  # Initiate long write
-        if self.wait_for_reply(b"READY\r\n", self.SBD_WRITE_WAIT):
-            self.ascii_write(message)
-            return True
-
-        return False
+        return self.commands.submit(
+            "+SBDWT", self.SBD_WRITE_WAIT, payload=message.encode("ascii"))
 
     def sbd_write_binary(self, raw_msg):
         ''' Write a binary raw_msg to ISU.
@@ -238,6 +473,9 @@ class SBDCommandMixin:
             "All reponse codes except 1 are followed by 'OK'"
 
             :param bytes raw_msg: byte message to place in MO buffer
+            :rtype: ATCommand
+            :return: the queued write command, its code is the ISU's
+                response code if the write failed
 
         '''
         gc.collect()
@@ -248,13 +486,8 @@ class SBDCommandMixin:
         raw_msg = raw_msg + self.sbd_crc(raw_msg)
         # Note: no termination required, based on number of bytes processed.
 
-        self.atcmd("+SBDWB={}".format(msg_len), False)
-
-        # Wait for a string for n seconds
-        if self.wait_for_reply(b"READY\r\n", self.SBD_WRITE_WAIT):
-            self.raw_write(raw_msg)
-        else:
-            return False
+        return self.commands.submit(
+            "+SBDWB={}".format(msg_len), self.SBD_WRITE_WAIT, payload=raw_msg)
 
     def sbd_read_text(self):
         """ Issue the command to read the MT buffer into the data stream """
@@ -262,25 +495,51 @@ class SBDCommandMixin:
         return self.atcmd("+SBDRT", False)
 
     def sbd_read_binary(self):
-        """ Issue the command to read the MT buffer into the datastream as
-            binary data.
+        """ Issue the command to read the MT buffer as binary data.
+
+            The response is streamed through the driver's `MTReader` as it
+            arrives, and the message is handled by `on_mt_read` once the
+            final result code is received.
+
+            :rtype: ATCommand
+            :return: the queued read command
         """
-        gc.collect()
-        self.atcmd("+SBDRB", False)
-        time.sleep(self.modem_wait)
-
-        data = [word for word
-                in self.raw_read().replace(b"\n", b"\r").split(b"\r")
-                if word != b""]
-
-        # FIXME: More protocol checking for raw_read() result
-        data = b"".join(data[self.idx:-1])  # Strip off echo and result code
-        size = int.from_bytes(data[:2], 'big')
-        value = data[2: -2]
-        if data[-2:] == self.sbd_crc(value) and len(value) == size:
-            return value
+        return self.commands.submit(
+            "+SBDRB", self.SBD_WRITE_WAIT, callback=self.on_mt_read,
+            reader=self.mt_reader)
+
+    def on_mt_read(self, command):
+        """ Handle a completed AT+SBDRB, see `handle_mt_msg`.
+
+            :param ATCommand command: completed read command
+        """
+        self.wait_for_read = False
+        reader = command.reader
+        if not (command.ok and reader.ok):
+            self.errors.append("MT read failed: {}".format(command.result))
+            return
+        self.handle_mt_msg(bytes(reader.payload))
+
+    def handle_mt_msg(self, payload):
+        """ Handle a message read from the MT buffer.  Binary messages are
+            decoded with `handle_binary_msg` and the MT buffer cleared, text
+            messages are routed as responses as they would be when read with
+            AT+SBDRT.
+
+            :param bytes payload: message without length or checksum
+        """
+        if not payload:
+            return
+        if payload[0] < 0x20:
+            new_data = self.handle_binary_msg(payload)
+            self.sbd_clear_mt()
         else:
-            raise Exception(value)
+            try:
+                new_data = self.route_response(payload.decode('ascii'))
+            except UnicodeError:
+                new_data = {'errors': True}
+        if new_data:
+            self.data.update(new_data)
 
     def sbd_crc(self, raw_message):
         """ Calculate the CRC of the SBD raw message.
@@ -297,12 +556,144 @@ class SBDCommandMixin:
         return self.atcmd("+SBDTC", False)
 
 
+#: Shared field buffer for the response handlers, which run one at a time.
+#: Handlers copy the fields they need before calling anything which could
+#: issue a command and scan another response into it, e.g. a property setter.
+_FIELDS = array('i', [0] * 8)
+
+
+def scan_ints(resp, out=_FIELDS):
+    """ Scan the comma separated integer fields of an ISU response into a
+        preallocated array, without building intermediate strings or lists.
+
+        Fields start after the first ':', or at the start of the response if
+        there is none.  Spaces are skipped and scanning stops at the first
+        character which isn't part of a field or when `out` is full.
+
+        :param str resp: ISU response, e.g. '+SBDIX: 0, 12, 0, 0, 0, 0'
+        :param array out: integer array the fields are written to
+        :rtype: int
+        :return: number of fields scanned
+    """
+    i = resp.find(":") + 1
+    end = len(resp)
+    size = len(out)
+    count = 0
+    value = 0
+    sign = 1
+    digits = False
+    while i < end:
+        c = ord(resp[i])
+        i += 1
+        if 48 <= c <= 57:
+            value = value * 10 + c - 48
+            digits = True
+        elif c == 45 and not digits:  # '-'
+            sign = -1
+        elif c == 44:  # ','
+            if not digits or count == size:
+                break
+            out[count] = sign * value
+            count += 1
+            value = 0
+            sign = 1
+            digits = False
+        elif c != 32:
+            break
+    if digits and count < size:
+        out[count] = sign * value
+        count += 1
+    return count
+
+
+def _fields(resp, n):
+    """ Scan at least n fields of a response into the shared buffer.
+
+        :raises ValueError: if the response is short
+    """
+    if scan_ints(resp) < n:
+        raise ValueError(resp)
+    return _FIELDS
+
+
 class ISUResponseMixin:
-    """ Mixin class to hold response parsers for the ISU modem """
+    """ Mixin class to hold response parsers for the ISU modem
+
+        :cvar tuple ROUTES: (prefix, handler name) pairs used to route
+            responses
+        :cvar bool log_routes: print each routed response and its prefix
+    """
+
+    ROUTES = (
+        ("AT", "handle_default"),
+        ("OK", "handle_default"),
+        ("+AREG", "handle_areg"),
+        ("+SBDD", "handle_sbdclear"),
+        ("+SBDSX", "handle_sbdsx"),
+        ("+SBDREG", "handle_sbdreg"),
+        ("+SBDRING", "handle_sbdring"),
+        # the 9602/9603 ring alert result code has no '+'
+        ("SBDRING", "handle_sbdring"),
+        ("+SBDIX", "handle_sbdix"),
+        ("+CIER", "handle_cier"),
+        ("+CIEV", "handle_ciev"),
+        ("+SBDMTA", "handle_sbdmta"),
+        ("+SBDTC", "handle_sbdtc"),
+        ("-MSSTM", "handle_msstm"),
+        ("-MSGEO", "handle_msgeo"),
+        ("+SBDRT", "handle_sbdtxt"),
+        ("SBDTC", "handle_sbdtc"),
+        ("HARDWARE", "handle_hw_failure"),
+        ("+DATA", "handle_data_msg"),
+        ("+WPL", "handle_waypoint_msg"), )
+
+    log_routes = False
+
+    #: Indicator event reporting: CSQ and service availability
+    CIER_CONFIG = "+CIER=1,1,1"
+    #: Indicator event reporting including satellite beam positions
+    CIER_SV_CONFIG = "+CIER=1,1,1,0,1"
+
+    #: Request satellite beam position reports, see `cier_config`
+    sv_reports = False
+
+    @property
+    def cier_config(self):
+        """ The CIER command enabling the indicator events this driver
+            uses.  Satellite beam positions let the pass scheduler skip
+            sessions while the serving satellite is low, at the cost of a
+            +CIEV:3 line each time the beam changes, so they are only
+            requested when `sv_reports` is set.
+
+            :rtype: str
+        """
+        if self.sv_reports:
+            return self.CIER_SV_CONFIG
+        return self.CIER_CONFIG
+
+    @classmethod
+    def _route_index(cls):
+        """ Build the dispatch index for this class once and cache it on the
+            class.
+
+            :rtype: tuple
+            :return: ({prefix: handler}, prefixes longest first)
+        """
+        if getattr(cls, "_route_cls", None) is not cls:
+            cls._route_cls = cls
+            cls._routes = {
+                match: getattr(cls, name) for match, name in cls.ROUTES}
+            cls._route_prefixes = tuple(sorted(
+                cls._routes, key=len, reverse=True))
+        return cls._routes, cls._route_prefixes
 
     def route_response(self, resp):
         """ Message are routed based on matching the initial characers in
-            the response with the keys of this dict.
+            the response with the prefixes in ROUTES.
+
+            The token before the first ':' is looked up directly, falling
+            back to the longest matching prefix for responses such as echoed
+            commands which don't carry one.
 
             If there is a match, the handler is called on the response and a
             dict is returned based on successful parsing.
@@ -312,35 +703,26 @@ class ISUResponseMixin:
             :return: response specific dictionary
 
         """
-        responses = [
-            ("AT", self.handle_default),
-            ("OK", self.handle_default),
-            ("+AREG", self.handle_areg),
-            ("+SBDD", self.handle_sbdclear),
-            ("+SBDSX", self.handle_sbdsx),
-            ("+SBDREG", self.handle_sbdreg),
-            ("+SBDRING", self.handle_sbdring),
-            ("+SBDIX", self.handle_sbdix),
-            ("+CIER", self.handle_cier),
-            ("+CIEV", self.handle_ciev),
-            ("+SBDMTA", self.handle_sbdmta),
-            ("+SBDTC", self.handle_sbdtc),
-            ("-MSSTM", self.handle_msstm),
-            ("-MSGEO", self.handle_msgeo),
-            ("+SBDRT", self.handle_sbdtxt),
-            ("SBDTC", self.handle_sbdtc),
-            ("HARDWARE", self.handle_hw_failure),
-            ("+DATA", self.handle_data_msg),
-            ("+WPL", self.handle_waypoint_msg), ]
-
-        for match, handler in responses:
-            if resp.startswith(match):
-                print("{} -> {}".format(resp, match))
-                try:
-                    out = handler(resp)
-                except Exception:
-                    out = {}
-                return out
+        routes, prefixes = self._route_index()
+        idx = resp.find(":")
+        match = resp[:idx] if idx > -1 else resp
+        handler = routes.get(match)
+
+        if handler is None:
+            for match in prefixes:
+                if resp.startswith(match):
+                    handler = routes[match]
+                    break
+            else:
+                return None
+
+        if self.log_routes:
+            print("{} -> {}".format(resp, match))
+        try:
+            out = handler(self, resp)
+        except Exception:
+            out = {}
+        return out
 
     def handle_default(self, resp):
         """ Default response handler which returns an empty dict.  Basically
@@ -364,9 +746,11 @@ class ISUResponseMixin:
             :return: {'reg_evt': (int), 'reg_sta': (int)}
 
         """
-        cmd, ret = resp.replace(" ", "").split(":")
-        evt, reg_err = ret.split(",")
-        return {"reg_evt": int(evt), "reg_sta": self._reg(int(reg_err))}
+        f = _fields(resp, 2)
+        evt, reg_sta = f[0], self._reg(f[1])
+        # 1: automatic registration happened, 0: a location update is due
+        self.on_registration(2 if evt == 1 and reg_sta == 0 else 1, reg_sta)
+        return {"reg_evt": evt, "reg_sta": reg_sta}
 
     def _reg(self, reg_err):
         # 0: 0 - good
@@ -400,15 +784,21 @@ class ISUResponseMixin:
     def handle_sbdreg(self, resp):
         """ Checks the registration status of the ISU with the constellation.
 
+            The response to AT+SBDREG? carries the status alone.
+
             :param str resp: SBDREG command response from ISU
             :rtype: dict
             :return: {"reg_sta": status, "reg_err": error code}
         """
-        cmd, ret = resp.replace(" ", "").split(":")
-        status, reg_err = ret.split(",")
-        self.reg_status = int(status)
-        self.reg_error = self._reg(int(reg_err))
-        return {"reg_sta": int(status), "reg_err": self._reg(int(reg_err))}
+        n = scan_ints(resp)
+        if n < 1:
+            raise ValueError(resp)
+        status = _FIELDS[0]
+        error = _FIELDS[1] if n > 1 else 0
+        self.reg_status = status
+        self.reg_error = self._reg(error)
+        self.on_registration(self.reg_status, self.reg_error)
+        return {"reg_sta": self.reg_status, "reg_err": self.reg_error}
 
     def handle_sbdsx(self, resp):
         """ Handle SBDSX response from ISU
@@ -428,14 +818,14 @@ class ISUResponseMixin:
             :return: empty dictionary
 
         """
-        cmd, ret = resp.replace(" ", "").split(":")
-        ret = ret.split(",")
-
-        self.mo_flag = ret[0] == "1"
-        self.momsn = max(0, int(ret[1]))
-        self.mt_flag = ret[2] == "1"
-        self.mtmsn = max(0, int(ret[3]))
-        self.ra_flag = ret[4] == "1"
+        f = _fields(resp, 5)
+        # the flag setters can start a session, copy the fields first
+        mo_flag, momsn, mt_flag, mtmsn, ra_flag = f[0], f[1], f[2], f[3], f[4]
+        self.mo_flag = mo_flag == 1
+        self.momsn = max(0, momsn)
+        self.mt_flag = mt_flag == 1
+        self.mtmsn = max(0, mtmsn)
+        self.ra_flag = ra_flag == 1
         # this queue is almost always unreliable.
         # self.queue = max(0, int(ret[5]))
         self.last_status_check = self.clock.time()
@@ -456,21 +846,31 @@ class ISUResponseMixin:
             :param str resp: SBSDIX repsonse from ISU
 
         """
-        cmd, ret = resp.replace(" ", "").split(":")
-        ret = ret.split(",")
-        data = {
-            "mosta": int(ret[0]),  # FIXME: _mo_status(int(ret[0])),
-            "momsn": int(ret[1]),
-            "mtsta": int(ret[2]),
-            "mtmsn": int(ret[3]),
-            "mtlen": int(ret[4]),
-            "queue": int(ret[5])}
+        data = self.parse_sbdix(resp)
         if self.session:
             self.session.complete(data)
         else:
             self.errors.append("Session result with no session")
         print(data)
 
+    @staticmethod
+    def parse_sbdix(resp):
+        """ Parse the fields of an SBDIX response.
+
+            :param str resp: SBSDIX repsonse from ISU
+            :rtype: dict
+            :return: {'mosta', 'momsn', 'mtsta', 'mtmsn', 'mtlen', 'queue'}
+
+        """
+        f = _fields(resp, 6)
+        return {
+            "mosta": f[0],  # FIXME: _mo_status(f[0]),
+            "momsn": f[1],
+            "mtsta": f[2],
+            "mtmsn": f[3],
+            "mtlen": f[4],
+            "queue": f[5]}
+
     def handle_cier(self, resp):
         ''' Handle a CIER response from the ISU.
 
@@ -480,20 +880,23 @@ class ISUResponseMixin:
             this command regularly ensures that the ISU will always be
             emitting CSQ data.
 
-            When the ISU responds that CSQ data is not being emitted, this
-            handler will emit the CIER command to configure CSQ data.
+            When the ISU responds that event reporting is off, that CSQ data
+            is not being emitted, or that satellite position data is not
+            when `sv_reports` is set, this handler will emit the CIER command
+            to configure it.
 
             :param str resp: CIER response from ISU
             :rtype: dict
             :return: empty dict
 
         '''
-        _, ret = resp.replace(" ", "").split(":")
-        print(ret)
-        ret = ret.split(",")
-        if len(ret) > 2:
-            if ret[1] == "0":
-                self.atcmd("+CIER=1,1,1", False)
+        n = scan_ints(resp)
+        print(resp)
+        f = _FIELDS
+        if n > 2:
+            if f[0] == 0 or f[1] == 0 or (
+                    self.sv_reports and n > 4 and f[4] == 0):
+                self.atcmd(self.cier_config, False)
         return {}
 
     def handle_ciev(self, resp):
@@ -525,20 +928,27 @@ class ISUResponseMixin:
             :return: Signal and satellite information
 
         """
-        _, ret = resp.replace(" ", "").split(":")
-        signal, tail = ret.split(",", 1)
-        if signal == "0":
-            data = {"csq": int(tail)}
-            self.csq = int(tail)
-        elif signal == "1":
-            data = {"netav": tail == "1"}
-        elif signal == "2":
-            data = {"anterr": tail == "1"}
-        elif signal == "3":
-            sv_id, bm_id, sv_bm, sv_x, sv_y, sv_z = map(int, tail.split(","))
+        n = scan_ints(resp)
+        f = _FIELDS
+        if n < 2:
+            raise ValueError(resp)
+        signal, value = f[0], f[1]
+        if signal == 0:
+            self.csq = value
+            data = {"csq": value}
+        elif signal == 1:
+            data = {"netav": value == 1}
+        elif signal == 2:
+            data = {"anterr": value == 1}
+        elif signal == 3:
+            if n < 7:
+                raise ValueError(resp)
+            sv_id, bm_id, sv_bm = f[1], f[2], f[3]
+            sv_x, sv_y, sv_z = f[4], f[5], f[6]
             data = {
                 "sv_id": sv_id, "bm_id": bm_id, "sv_bm": sv_bm,
                 "sv_x": sv_x, "sv_y": sv_y, "sv_z": sv_z}
+            self.on_satellite(sv_id, sv_x, sv_y, sv_z)
         return data
 
     def handle_sbdring(self, resp):
@@ -587,7 +997,21 @@ class ISUResponseMixin:
         return {}
 
     def handle_msgeo(self, resp):
-        return {}
+        """ Handle MSGEO response from ISU.
+
+            MSGEO reports the ISU's geolocation, computed by the network, in
+            earth centered, earth fixed coordinates.
+
+            :param str resp: MSGEO response from ISU
+            :rtype: dict
+            :return: {'isu_x', 'isu_y', 'isu_z'}
+
+        """
+        f = _fields(resp, 3)
+        x, y, z = f[0], f[1], f[2]
+        if x or y or z:
+            self.on_isu_position(x, y, z)
+        return {"isu_x": x, "isu_y": y, "isu_z": z}
 
     def handle_hw_failure(self, resp):
         return {}
@@ -631,26 +1055,111 @@ class ISUResponseMixin:
         """
         print("pkea: {}".format(resp))
         resp = resp.replace("+DATA:", "")
-        fields = resp.split(";")  # command terminator
 
         data = {}
         errors = False
-        # FIXME: handle multiple commands and stuff
-        for field in fields:
+        if resp.startswith(sbd_codec.TEXT_FRAME):
+            # several messages packed into one SBD message
+            try:
+                frames = sbd_codec.unpack_text(resp)
+            except ValueError:
+                frames = []
+                errors = True
+        else:
+            frames = [resp]
+
+        for frame in frames:
+            errors |= self._parse_fields(frame, data)
+
+        if len(data) > 0:
+            self.new_data = True
+
+        self.wait_for_recv = False
+        self.wait_for_data = False
+        self.sbd_clear_mt()
+        return {'pkea': data, 'errors': errors}
+
+    @staticmethod
+    def _add_packet(data, pkt_type, value):
+        """ Add a packet to data.  Messages are packed in the order they
+            were queued, so a packet type repeated in one SBD message keeps
+            its last, newest, value and consumers always see one value per
+            packet type.
+        """
+        data[pkt_type] = value
+
+    def _parse_fields(self, msg, data):
+        """ Parse ';' terminated "pkt_type,fields" commands from msg into
+            data.
+
+            :rtype: bool
+            :return: True if any command failed to parse
+        """
+        errors = False
+        for field in msg.split(";"):  # command terminator
             try:
                 pkt_type, data_fields = field.split(',', 1)
-                data[pkt_type] = data_fields
+                self._add_packet(data, pkt_type, data_fields)
+
+            except Exception:
+                errors = True
+        return errors
 
-            except Exception as e:
+    def handle_binary_msg(self, raw):
+        """ Handle a binary message read from the MT buffer.
+
+            Binary messages are identified by their first byte, see
+            `devices.sbd_codec`.  Position reports are decoded into a
+            'PK001' packet with numeric fields and command messages into
+            the packets of their ascii equivalents.  Waypoints are returned
+            under 'wpl', as from +WPL responses, and config records are
+            merged into one 'CONFIG' packet.  Packed messages are split and
+            each one is handled in turn; text messages among them are
+            parsed as they would be from a +DATA response.
+
+            :param bytes raw: message payload without length or checksum
+            :rtype: dict
+            :return: {'pkea': {packet_type: packet_fields}, 'errors': errors
+                [, 'wpl': list of waypoints]}
+
+        """
+        data = {}
+        waypoints = []
+        errors = False
+        try:
+            if raw[0] == sbd_codec.MULTI:
+                frames = sbd_codec.unpack_messages(raw)
+            else:
+                frames = [raw]
+        except (IndexError, ValueError):
+            frames = []
+            errors = True
+
+        for frame in frames:
+            try:
+                if frame[0] == sbd_codec.POSITION_REPORT:
+                    self._add_packet(data, 'PK001',
+                                     sbd_codec.decode_position(frame))
+                elif frame[0] == sbd_codec.COMMAND:
+                    for pkt_type, value in sbd_codec.decode_commands(frame):
+                        if pkt_type == "WPL":
+                            waypoints.append(value)
+                        elif pkt_type == "CONFIG":
+                            data.setdefault(pkt_type, {}).update(value)
+                        else:
+                            self._add_packet(data, pkt_type, value)
+                else:
+                    errors |= self._parse_fields(frame.decode('ascii'), data)
+            except (IndexError, ValueError):
                 errors = True
-                # errors.append(e)
 
         if len(data) > 0:
             self.new_data = True
 
         self.wait_for_recv = False
         self.wait_for_data = False
-        self.sbd_clear_mt()
+        if waypoints:
+            return {'pkea': data, 'errors': errors, 'wpl': waypoints}
         return {'pkea': data, 'errors': errors}
 
     def handle_waypoint_msg(self, resp):
@@ -663,11 +1172,12 @@ class ISUResponseMixin:
 
             >>> msg = "+WPL:<cmd>;lat,3745.7876;EW,W;lon,12223.4358;NS,N;name,PAIKEA001;"
 
-            cmd in ['ADD', 'DEL', 'MOD']
+            cmd in ['ADD', 'DEL', 'MOD'], and is passed on by its first
+            letter, as `GPS.import_waypoint` takes it.
 
             :param str resp: +WPL response from ISU
             :rtype: dict
-            :returns: waypoint dictionary
+            :returns: {'wpl': [waypoint dictionary]}
         '''
         resp = resp.replace("+WPL:", "")
         # "<cmd>;lat,3745.7876;lon,12223.4358;name,PAIKEA001;"
@@ -675,9 +1185,9 @@ class ISUResponseMixin:
         # [<cmd>, lat,3745.7876, lon,12223.4358, name,PAIKEA001]
         cmd = items.pop(0)
         # [lat,3745.7876, lon,12223.4358, name,PAIKEA001]
-        data = {'cmd': cmd}
+        data = {'cmd': cmd[:1]}
         for item in items:
             if item.find(',') > -1:
                 k, v = item.split(',')
                 data[k] = v
-        return {'wpl': data}
+        return {'wpl': [data]}
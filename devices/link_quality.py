@@ -0,0 +1,223 @@
+"""
+Link Quality Estimator
+----------------------
+
+Decides when the Iridium signal is good enough to spend energy on an SBD
+session.
+
+A single CSQ reading over a fixed threshold is a poor predictor of a
+successful SBDIX: CSQ is reported in coarse bars, changes quickly as
+satellites move and as the antenna is shaded, and the level which is
+really needed depends on the unit's antenna and mounting.  The estimator
+tracks a smoothed CSQ and its trend, how long the current level has been
+held, and, per CSQ level, how many session attempts made at that level
+delivered their message.
+
+The CSQ threshold is learned from those outcomes.  Each level starts from
+a prior success rate, good above the configured threshold and poor at or
+below it, and is pulled towards what the unit actually achieves as
+attempts at that level are recorded.  Counts are halved as they grow so the
+estimate keeps following changes in the unit's environment.
+
+Sessions are normally only attempted at or above the learned threshold, so
+the level just below it would never be tried again, and the threshold
+could only rise.  An exploratory attempt is allowed there, at most once
+every `explore` seconds, when the level is held, which lets the threshold
+fall again when the unit's environment improves.
+
+An attempt is allowed when the CSQ is above the learned threshold, or at
+it and held for `min_hold` seconds, twice that if the signal was falling
+when it reached the threshold.
+
+The counts are kept in `core.storage` under `key`, when one is set, so what
+was learned survives a deep sleep reset.  To spare the flash they are
+written every `save_every` outcomes rather than after each one, and callers
+`flush` what hasn't been written before sleeping.
+"""
+from array import array
+from core.compat import time
+from core import storage
+
+
+class LinkEstimator:
+    ''' Tracks CSQ and learns which levels lead to successful sessions.
+
+        :param clock: object with a time method
+        :param int csq_thresh: CSQ must be above this before anything is
+            learned
+        :param float min_rate: success rate a CSQ level needs to be used
+        :param int min_hold: seconds a level at the threshold must be held
+        :param float alpha: smoothing factor of the CSQ average
+        :param int max_count: attempts per level before counts are halved
+        :param int explore: seconds between exploratory attempts below the
+            threshold
+        :param str key: storage key to keep the counts under, None to keep
+            them in RAM only
+        :param int save_every: outcomes recorded between writes to storage
+    '''
+
+    LEVELS = 6
+    PRIOR_WEIGHT = 4
+    PRIOR_GOOD = 0.8
+    PRIOR_POOR = 0.2
+
+    def __init__(self, clock=time, csq_thresh=2, min_rate=0.5, min_hold=3,
+                 alpha=0.3, max_count=32, explore=1800, key=None,
+                 save_every=8):
+        self.clock = clock
+        self.csq_thresh = csq_thresh
+        self.min_rate = min_rate
+        self.min_hold = min_hold
+        self.alpha = alpha
+        self.max_count = max_count
+        self.explore = explore
+        self.key = key
+        self.save_every = save_every
+        self.unsaved = 0
+        self.attempts = array('h', [0] * self.LEVELS)
+        self.successes = array('h', [0] * self.LEVELS)
+        self.csq = 0
+        self.since = self.clock.time()
+        self.average = 0.
+        self.trend = 0.
+        self.threshold = csq_thresh + 1
+        self.explored = self.since
+
+    def load(self):
+        ''' Read the counts kept under `key`, if there are any.
+
+            :rtype: bool
+            :return: True if counts were read
+        '''
+        if self.key is None:
+            return False
+        try:
+            value = storage.get(self.key)
+        except OSError:
+            return False
+        if not isinstance(value, str):
+            return False
+        try:
+            fields = [int(field) for field in value.split()]
+        except ValueError:
+            return False
+        if len(fields) != self.LEVELS * 2 + 1:
+            return False
+        for level in range(self.LEVELS):
+            self.attempts[level] = fields[level]
+            self.successes[level] = fields[self.LEVELS + level]
+        self.explored = fields[-1]
+        self._learn()
+        return True
+
+    def store(self):
+        ''' Keep the counts under `key` '''
+        self.unsaved = 0
+        if self.key is None:
+            return
+        value = " ".join(str(count) for count in
+                         list(self.attempts) + list(self.successes) +
+                         [int(self.explored)])
+        try:
+            storage.put(self.key, value)
+        except OSError as e:
+            print("link quality: {}".format(e))
+
+    def _level(self, csq):
+        return max(0, min(self.LEVELS - 1, int(csq)))
+
+    def signal(self, csq, now=None):
+        ''' Record a CSQ reading.
+
+            :param int csq: signal strength, 0-5
+        '''
+        now = self.clock.time() if now is None else now
+        csq = self._level(csq)
+        if csq != self.csq:
+            self.csq = csq
+            self.since = now
+        average = self.average + self.alpha * (csq - self.average)
+        self.trend = average - self.average
+        self.average = average
+
+    def held(self, now=None):
+        ''' Seconds the current CSQ level has been held '''
+        now = self.clock.time() if now is None else now
+        return now - self.since
+
+    def rate(self, csq):
+        ''' Estimated chance a session attempted at a CSQ level delivers.
+
+            :param int csq: signal strength, 0-5
+            :rtype: float
+        '''
+        level = self._level(csq)
+        if level > self.csq_thresh:
+            prior = self.PRIOR_GOOD
+        else:
+            prior = self.PRIOR_POOR
+        return ((self.successes[level] + prior * self.PRIOR_WEIGHT) /
+                (self.attempts[level] + self.PRIOR_WEIGHT))
+
+    def _learn(self):
+        for level in range(1, self.LEVELS):
+            if self.rate(level) >= self.min_rate:
+                self.threshold = level
+                return
+        self.threshold = self.LEVELS - 1
+
+    def outcome(self, csq, success):
+        ''' Record the result of a session attempted at a CSQ level.
+
+            :param int csq: CSQ when the attempt was made
+            :param bool success: True if the message was delivered
+        '''
+        level = self._level(csq)
+        if level < self.threshold:
+            self.explored = self.clock.time()
+        self.attempts[level] += 1
+        if success:
+            self.successes[level] += 1
+        if self.attempts[level] > self.max_count:
+            self.attempts[level] //= 2
+            self.successes[level] //= 2
+        self._learn()
+        self.unsaved += 1
+        if self.unsaved >= self.save_every:
+            self.store()
+
+    def flush(self):
+        ''' Keep any outcomes recorded since the counts were last stored,
+            e.g. before a deep sleep.
+        '''
+        if self.unsaved:
+            self.store()
+
+    def ready(self, now=None):
+        ''' Check if signal is good enough to attempt a session now.
+
+            :rtype: bool
+        '''
+        now = self.clock.time() if now is None else now
+        if self.csq < self.threshold:
+            # explore the level below, which is otherwise never attempted
+            return (self.csq == self.threshold - 1 and self.csq > 0 and
+                    now - self.explored >= self.explore and
+                    self.held(now) >= self.min_hold * 2)
+        if self.csq > self.threshold:
+            return True
+        # marginal signal, wait longer if it's on the way down
+        hold = self.min_hold * 2 if self.trend < 0 else self.min_hold
+        return self.held(now) >= hold
+
+    def stats(self):
+        ''' Learned state, for telemetry.
+
+            :rtype: dict
+            :return: {'threshold', 'average', 'rates'}
+        '''
+        return {
+            'threshold': self.threshold,
+            'average': round(self.average, 2),
+            'rates': [round(self.rate(level), 2)
+                      for level in range(self.LEVELS)]}
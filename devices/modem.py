@@ -7,21 +7,26 @@ Modem Controllers implement the `connect` interface and switch between
 connection types.  Connection types are current 'u' for UART and 's' for
 Serial.  This allows modems to be tested though a serial port or a uart.
 
-The controller buffers received partial lines as the `unterminated` instance
-variable.
+The controller buffers received bytes in a preallocated ring buffer, `rx`,
+which frames complete lines incrementally so partial lines are never
+re-decoded or re-split as more data arrives.
 
 """
 from core.compat import time
+from core.ringbuf import RingBuffer
 import gc
 
 
 class ModemController:
 
+    #: Size of the receive ring buffer, large enough for a full SBDRT reply
+    RX_BUFFER_SIZE = 512
+
     def __init__(self):
         self.modem_wait = .05
         self.conn = None
         self.conn_type = None
-        self.unterminated = b''
+        self.rx = RingBuffer(self.RX_BUFFER_SIZE)
 
     def connect(self, conn, conn_type):
         ''' Connect the controller to a serial or uart peripheral
@@ -123,45 +128,65 @@ class ModemController:
         self.idx = int(self.echo)
         return True
 
-    def read(self):
-        ''' Read data from device and return non blank reads, decode as ascii
-            per the device spec.
+    def fill(self):
+        ''' Read pending bytes from the underlying peripheral straight into
+            the receive ring buffer.
 
-            :rtype: list
-            :rtype: list of AT return items, decoded
+            :rtype: bool
+            :return: True if any bytes were read
+        '''
+        n = self.any()
+        if not n:
+            return False
+        return self.rx.readinto(self.conn, n) > 0
+
+    def lines(self):
+        ''' Read data from device and generate complete, non blank lines.
 
+            Lines are memoryview slices into the receive buffer and are only
+            valid until the next read from the device.
+
+            :rtype: generator
+            :return: memoryview of each complete line
         '''
-        gc.collect()
-        val = self.raw_read()
+        self.fill()
+        return self.rx.lines()
 
-        if val is None:
-            return ""
-        else:
-            # TODO: drop bad character only and let parsers decide?
-            for i, b in enumerate(val):
-                if b > 127:
-                    break
-            else:
-                i = len(val)
-            val = val[0:i]
+    @staticmethod
+    def decode(line):
+        ''' Decode a line from the receive buffer as ascii per the device
+            spec.
 
-            try:
-                val.decode('ascii')
-                self.unterminated += val
-            except UnicodeError:
-                pass
+            :param memoryview line: line from the receive buffer
+            :rtype: str
+            :return: decoded line or None if it isn't ascii
+        '''
+        try:
+            return str(line, 'ascii')
+        except UnicodeError:
+            return None
+
+    def read(self):
+        ''' Read data from device and return non blank reads, decode as ascii
+            per the device spec.  Lines which fail to decode are dropped.
 
-            items = self.unterminated.decode("ascii").replace("\n", "\r").split("\r")  # NOQA
+            :rtype: list
+            :rtype: list of AT return items, decoded
 
-            if len(items) > 1:
-                self.unterminated = items[-1].encode("ascii")
-                return [item for item in items[:-1] if item != '']
-            else:
-                return ""
+        '''
+        items = []
+        self.fill()
+        line = self.rx.readline()
+        while line is not None:
+            item = self.decode(line)
+            if item:
+                items.append(item)
+            line = self.rx.readline()
+        return items
 
     def more(self):
         ''' Return length of controller's unprocessed buffer '''
-        return len(self.unterminated) > 0
+        return len(self.rx) > 0
 
     def atcmd(self, msg, reply=True):
         ''' Append AT prefix to msg and \\r suffix, and optionally wait
@@ -188,9 +213,10 @@ class ModemController:
 
     def wait_for_reply(self, reply, wait_seconds):
         ''' Wait on modem for a specific string.  Appends all modem response
-            to unterminated buffer and returns True if reply is in reposnse.
+            to the receive buffer and returns True if reply is in reposnse.
 
-            Removes `reply` from unterminated buffer.
+            Removes `reply` from the receive buffer, leaving any other
+            buffered lines to be routed on the next read.
 
             :param bytes reply: byte buffer indicating reply on which this
                 method waits
@@ -202,19 +228,15 @@ class ModemController:
         '''
         gc.collect()
         read_start_time = time.time()
+        token = reply.strip()
+        found = self.rx.blank(token)
 
-        while reply not in self.unterminated:
-            val = self.raw_read()
-
-            if val is not None:
-                self.unterminated += val
+        while not found:
+            if self.fill():
+                found = self.rx.blank(token)
 
             if time.time() - read_start_time > max(self.modem_wait,
                                                    wait_seconds):
                 break
 
-        if reply not in self.unterminated:
-            return False
-        else:
-            self.unterminated = self.unterminated.replace(b"READY", b"")
-            return True
+        return found
@@ -14,6 +14,19 @@ NMEAProtocol = ProtocolSpec(
     datafield_delimiter=',',
     postfix="\r\n")
 
+#: Sentences in the order of the PMTK314 rate fields
+PMTK314_SENTENCES = ('gll', 'rmc', 'vtg', 'gga', 'gsa', 'gsv')
+
+#: Number of rate fields in a PMTK314 packet, the rest are reserved
+PMTK314_FIELDS = 19
+
+#: Named output configurations: sentence output rates, in fixes per
+#: sentence, and the fix interval in milliseconds
+OUTPUT_PROFILES = {
+    'buoy-report': ({'rmc': 1, 'gga': 1, 'gsa': 1, 'gsv': 5}, 1000),
+    'handset-nav': ({'rmc': 1, 'vtg': 1}, 1000),
+}
+
 
 class MTKTalker():
     ''' An MTK Talker is an MTK branded GPS device which produces sentences
@@ -55,16 +68,42 @@ class MTKTalker():
         '''
         return lambda prot: prot.pkt_type.lower()[2:]
 
-    def send(self, pkt_type, datafields):
+    def send(self, pkt_type, datafields=None):
         ''' Construct and send a packet to underlying driver.
 
             :param str pkt_type: packet type identifier
-            :param str datafields: string of delimited datafields for packet
+            :param str datafields: string of delimited datafields for packet,
+                None for a packet without data fields
         '''
-        command = self.protocol.create_packet(
+        self.conn.write(self.protocol.packet_into(
             self.talker_id, pkt_type, datafields
-        )
-        self.conn.write(command.encode("ascii"))
+        ))
+
+    def set_output(self, rates, interval=1000):
+        ''' Set the fix interval and which sentences are output.
+
+            :param dict rates: sentence type to output rate, 1 outputs the
+                sentence every fix, n every nth fix.  Sentences which aren't
+                listed are turned off.
+            :param int interval: fix interval in milliseconds
+        '''
+        fields = ["0"] * PMTK314_FIELDS
+        for idx, sentence in enumerate(PMTK314_SENTENCES):
+            fields[idx] = str(rates.get(sentence, 0))
+        self.send("220", str(interval))
+        self.send("314", ",".join(fields))
+
+    def set_profile(self, name):
+        ''' Apply one of the `OUTPUT_PROFILES`.
+
+            :param str name: profile name
+        '''
+        rates, interval = OUTPUT_PROFILES[name]
+        self.set_output(rates, interval)
+
+    def reset_output(self):
+        ''' Restore the device's default sentence output '''
+        self.send("314", "-1")
 
     def get_power_save(self):
         return self.create_packet("420")
@@ -81,8 +120,25 @@ class MTKTalker():
             'warm': "102",
             'cold': "103",
             'full': "104"}
-        pkt_type = restart_types[restart_type]
-        return self.create_packet(pkt_type)
+        self.send(restart_types[restart_type])
+
+    def set_time(self, year, month, day, hour, minute, second):
+        ''' Give the receiver the current UTC time, PMTK740. '''
+        self.send("740", "{},{:02},{:02},{:02},{:02},{:02}".format(
+            year, month, day, hour, minute, second))
+
+    def set_position(self, lat, lon, alt, year, month, day, hour, minute,
+                     second):
+        ''' Give the receiver a reference position and the UTC time it
+            applies at, PMTK741.
+
+            :param float lat: latitude, decimal degrees, negative S
+            :param float lon: longitude, decimal degrees, negative W
+            :param float alt: altitude, meters
+        '''
+        self.send("741", "{:.6f},{:.6f},{:.1f},{},{:02},{:02},{:02},{:02},"
+                         "{:02}".format(lat, lon, alt, year, month, day,
+                                        hour, minute, second))
 
     def set_power_save(self, mode=0):
         return self.create_packet("320", ","+str(mode))
@@ -95,7 +95,7 @@ def gsv(nmea_data):
     result['elevation'] = data[4]
     result['azimuth'] = data[5]
     result['snr'] = data[6]
-    # This is not yet done
+    # only the first satellite, see devices.sky_view for the full table
     return result
 
 
@@ -111,3 +111,94 @@ MTK_PARSERS = {'gsa': gsa,
                'tk010': lambda x: {},
                'tk011': lambda x: {},
                'ack': lambda x: {}}
+
+
+#: Index of each field in the data fields of a sentence, by sentence type.
+#: The field names match the keys produced by the parsers above.
+SENTENCE_FIELDS = {
+    'gga': {'utc': 0, 'latitude': 1, 'NS': 2, 'longitude': 3, 'EW': 4,
+            'fix': 5, 'sats_used': 6, 'hdop': 7, 'msl_alt': 8,
+            'msl_alt_units': 9, 'geo_sep': 10, 'geoid_units': 11,
+            'age_of_diff_corr': 12, 'dgps_station_id': 13},
+    'gsa': {'fix_mode1': 0, 'fix_mode2': 1, 'pdop': 14, 'hdop': 15,
+            'vdop': 16},
+    'rmc': {'utc': 0, 'status': 1, 'latitude': 2, 'NS': 3, 'longitude': 4,
+            'EW': 5, 'speed_over_ground': 6, 'speed_over_course': 7,
+            'date': 8, 'mag_var': 9, 'mode': 10},
+    'vtg': {'t_course': 0, 't_ref': 1, 'm_course': 2, 'm_ref': 3,
+            'nautical_speed': 4, 'nautical_speed_units': 5,
+            'ground_speed': 6, 'ground_speed_units': 7},
+    'gsv': {'msgs': 0, 'seq_num': 1, 'num_sv': 2, 'sv_prn': 3,
+            'elevation': 4, 'azimuth': 5, 'snr': 6},
+    'tk010': {'system_msg': 0},
+}
+
+
+class FieldSelector:
+    ''' Field selective parsing for consumers which only need some fields.
+
+        Each sentence type extracts only the subscribed fields, located by
+        index with `find` rather than splitting the sentence, into a record
+        which is allocated once.  Sentence types without subscribed fields
+        are not parsed at all.
+
+        The record holds the fields of the last sentence parsed, fields the
+        sentence doesn't carry are None.
+
+        :param fields: names of the fields to extract, see `SENTENCE_FIELDS`
+        :param dict tables: field indexes by sentence type
+        :ivar dict record: field values by name
+    '''
+
+    def __init__(self, fields, tables=SENTENCE_FIELDS):
+        self.names = tuple(fields)
+        self.record = {name: None for name in self.names}
+        self.plan = {}
+        for sentence, table in tables.items():
+            wanted = sorted((idx, name) for name, idx in table.items()
+                            if name in self.record)
+            if wanted:
+                self.plan[sentence] = tuple(wanted)
+
+    def wants(self, sentence):
+        ''' Check if any subscribed field is carried by a sentence type
+
+            :param str sentence: routed sentence type, e.g. 'gga'
+            :rtype: bool
+        '''
+        return sentence in self.plan
+
+    def reset(self):
+        ''' Set every field of the record to None '''
+        record = self.record
+        for name in self.names:
+            record[name] = None
+
+    def parse(self, sentence, datafields, delimiter=","):
+        ''' Extract the subscribed fields of a sentence into the record.
+
+            :param str sentence: routed sentence type, e.g. 'gga'
+            :param str datafields: data fields of the sentence
+            :param str delimiter: data field delimiter
+            :rtype: bool
+            :return: True if the sentence type was parsed
+        '''
+        plan = self.plan.get(sentence)
+        self.reset()
+        if plan is None:
+            return False
+        record = self.record
+        idx = 0
+        start = 0
+        for want, name in plan:
+            while idx < want:
+                start = datafields.find(delimiter, start) + 1
+                if start == 0:
+                    # short sentence, the remaining fields are missing
+                    return True
+                idx += 1
+            end = datafields.find(delimiter, start)
+            if end < 0:
+                end = len(datafields)
+            record[name] = datafields[start:end]
+        return True
@@ -0,0 +1,144 @@
+"""
+ISU Registration
+----------------
+
+Tracks the ISU's registration with the Iridium network and schedules
+AT+SBDREG attempts.
+
+An unregistered ISU still completes SBDIX sessions, which register it
+implicitly, but it isn't paged when mobile terminated messages arrive, so
+ring alerts are missed and messages are only collected by polling with
+sessions.  The manager enables automatic registration, registers
+explicitly when the ISU reports it isn't registered, and holds features
+which depend on ring alerts until it is.
+
+Failed registrations are retried with a back-off chosen by the class of
+the registration error, as classified by `ISUResponseMixin._reg`:
+
+=====  ================  ====================================
+class  meaning           retry
+=====  ================  ====================================
+  1    bad location      slow, the location must change first
+  2    retry             exponential, from `RETRY_BASE`
+  3    rejected          slow
+  4    no service        once there is signal again
+  5    radio disabled    slow
+=====  ================  ====================================
+"""
+from core.compat import time
+
+
+#: Base delay in seconds before re-registering, by registration error class
+RETRY_DELAY = (0, 600, 10, 900, 30, 300)
+
+#: Longest delay in seconds between registration attempts
+RETRY_MAX = 900
+
+
+class Registration:
+    ''' Registration state of an ISU.
+
+        ======  ==============
+        status  meaning
+        ======  ==============
+            0   detached
+            1   not registered
+            2   registered
+            3   denied
+        ======  ==============
+
+        :param clock: object with a time method
+        :ivar int status: SBDREG status, None until reported
+        :ivar int error: registration error class of the last attempt
+    '''
+
+    DETACHED = 0
+    NOT_REGISTERED = 1
+    REGISTERED = 2
+    DENIED = 3
+
+    def __init__(self, clock=time):
+        self.clock = clock
+        self.status = None
+        self.error = 0
+        self.failures = 0
+        self.pending = False
+        self.next_attempt = 0
+        self.attempts = 0
+        self.waiting = {}
+
+    @property
+    def registered(self):
+        return self.status == self.REGISTERED
+
+    def update(self, status, error=0):
+        ''' Record a registration status reported by the ISU.
+
+            :param int status: SBDREG status
+            :param int error: registration error class
+        '''
+        self.pending = False
+        self.status = status
+        self.error = error or 0
+        if self.registered:
+            self.failures = 0
+            self.next_attempt = 0
+            waiting, self.waiting = self.waiting, {}
+            for callback in waiting.values():
+                callback()
+        elif self.error:
+            delay = RETRY_DELAY[min(self.error, len(RETRY_DELAY) - 1)]
+            if self.error == 2:
+                delay = delay << min(self.failures, 6)
+            self.failures += 1
+            self.next_attempt = self.clock.time() + min(delay, RETRY_MAX)
+
+    def lost(self):
+        ''' The ISU was reset or powered down, its registration must be
+            checked again.
+        '''
+        self.status = None
+        self.pending = False
+
+    def failed(self):
+        ''' A registration attempt got no result from the ISU '''
+        self.update(self.NOT_REGISTERED, 2)
+
+    def unknown(self):
+        ''' Check if the status should be queried from the ISU.
+
+            :rtype: bool
+        '''
+        return self.status is None and not self.pending
+
+    def query(self):
+        ''' Note the status was queried with AT+SBDREG? '''
+        self.pending = True
+
+    def due(self, csq):
+        ''' Check if a registration attempt should be made now.
+
+            :param int csq: current signal strength
+            :rtype: bool
+        '''
+        if self.pending or self.status is None or self.registered:
+            return False
+        return csq > 0 and self.clock.time() >= self.next_attempt
+
+    def attempt(self):
+        ''' Note a registration attempt was made '''
+        self.pending = True
+        self.attempts += 1
+
+    def when_registered(self, callback):
+        ''' Call callback once the ISU is registered, now if it already is.
+            A callback is held once however often it is requested.  They
+            are keyed by name, as MicroPython creates a new bound method
+            object, which doesn't compare equal, on each attribute access.
+
+            :param callback: function without arguments
+        '''
+        if self.registered:
+            callback()
+        else:
+            self.waiting[callback.__name__] = callback
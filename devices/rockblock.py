@@ -6,10 +6,17 @@ from core.compat import (
     time,
 )
 from devices.modem import ModemController
+from devices import sbd_codec
+from devices.atqueue import CommandQueue
+from devices.link_quality import LinkEstimator
+from devices.registration import Registration
+from devices.sat_scheduler import PassScheduler
 from devices.iridium import (
     SBDCommandMixin,
     ISUResponseMixin,
+    MTReader,
     SBDSession,
+    SBDSessionLog,
 )
 
 
@@ -30,8 +37,14 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
         self._ra_flag = False
         self._queue = 0
         self.csq_thresh = 2
+        self.scheduler = PassScheduler(clock, csq_thresh=self.csq_thresh)
+        self.link = LinkEstimator(clock, csq_thresh=self.csq_thresh)
         self.status_check_period = 30
+        self.stale_period = 300
         self.last_status_check = 0
+        self.last_indicator = 0
+        self.polls = 0
+        self.polls_skipped = 0
         self.last_sat_time = 0
         self.errors = []
         self.wait_for_send = False
@@ -41,9 +54,18 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
         self.wait_for_status = False
         self.new_data = False
         self.reg_status = None
-        self.reg_err = None
-        self.last_reg_attempt = 0
+        self.reg_error = None
+        self.registration = Registration(clock)
+        self.ring_alerts = False
         self.messages = []
+        self.commands = CommandQueue(self, clock)
+        self.session_log = SBDSessionLog()
+        self.mt_reader = MTReader()
+        self.mo_max = sbd_codec.MO_MAX
+        self.outbox = None
+        self.outbox_by_priority = False
+        self.outbox_hold = False
+        self.in_flight = []
         self.bad_session = False
         self.quiet = False
 
@@ -62,31 +84,83 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
     def start(self):
         ''' Start up RockBlock w/ 5s charging time
 
-            resets self.last_sat_time to 0
+            resets self.last_sat_time to 0 and resumes draining the outbox
         '''
         if self.en.value() == 1:
             return
         self.en.on()  # assert the enable pin
         self.clock.sleep(5)
         self.last_sat_time = 0
+        self.last_indicator = 0
+        self.outbox_hold = False
+        if self.ring_alerts:
+            self.enable_ring_alerts()
 
     def stop(self, save=False):
-        ''' Disables RockBlock via enable pin '''
+        ''' Disables RockBlock via enable pin and drops queued commands '''
         if save:
             self.atcmd("&Y0")
             self.atcmd("*F")
         self.en.off()
+        self.commands.clear()
+        self.registration.lost()
+
+    def atcmd(self, msg, reply=True, timeout=5, callback=None):
+        ''' Send an AT command.  Commands which don't wait for a reply are
+            queued and matched to their result as responses are read.
+
+            :param str msg: command without the AT prefix
+            :param bool reply: write now and read the response sequentially
+            :param int timeout: seconds to wait for a queued command's result
+            :param callback: called with the queued command on completion
+            :rtype: list or ATCommand
+            :return: response if reply=True, else the queued command
+        '''
+        if reply:
+            return super().atcmd(msg, reply)
+        return self.commands.submit(msg, timeout, callback)
+
+    def fill(self):
+        ''' Move pending bytes from the ISU into the receive ring buffer,
+            streaming a binary SBDRB response through the MT reader first.
+            Text lines read ahead of the response are passed through to the
+            ring buffer in order.
+
+            :rtype: bool
+            :return: True if any bytes were read
+        '''
+        reader = self.commands.reader
+        if reader is None:
+            return super().fill()
+        val = self.raw_read()
+        if not val:
+            return False
+        n = reader.feed(val, self.rx.write)
+        if n < len(val):
+            self.rx.write(val[n:])
+        return True
 
     def read_from_device(self):
         ''' Reads data from ISU, routing responses to parsers through the
             `route_response` member function.  If data is returned from
             parsed response, data is added to the self.data dict.
+
+            Lines are framed in the receive ring buffer and decoded one at a
+            time, so partial lines left in the buffer are not re-processed.
+            Each line is also matched to the queued command in flight.
         '''
+        rx = self.rx
         while self.any():
-            for item in self.read():
-                new_data = self.route_response(item)
-                if new_data:
-                    self.data.update(new_data)
+            self.fill()
+            line = rx.readline()
+            while line is not None:
+                item = self.decode(line)
+                if item:
+                    self.commands.feed(item)
+                    new_data = self.route_response(item)
+                    if new_data:
+                        self.data.update(new_data)
+                line = rx.readline()
 
     def create_sbd_session(self):
         ''' Creates an SBD session with current state and callback to
@@ -94,17 +168,16 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
 
             If a session exists and has not yet completed, does nothing.
 
-            If a session exists and is completed, checks the session, and
-            schedules a new one.
+            If a session exists and is completed, checks the session, which
+            schedules a retry if one is needed.  Status reported before the
+            completed session was checked describes that session's message,
+            so no other session is created for it.
         '''
         if not self.session:
-            self.session = SBDSession(self.state, self.sbd_initx)
-        else:
-            if self.session.status in [0, 1, 2]:
-                return
-            else:
-                self.check_session()  # handle result from session
-                self.session = SBDSession(self.state, self.sbd_initx)
+            self.session = SBDSession(self.state, self.sbd_initx,
+                                      clock=self.clock)
+        elif self.session.status not in [0, 1, 2]:
+            self.check_session()  # handle result from session
 
     @property
     def csq(self):
@@ -131,31 +204,88 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
             :returns: messaging state
 
         '''
-        return {'momsn': self.momsn, 'mtmsn': self.mtmsn, 'queue': self.queue}
+        return {'momsn': self.momsn, 'mtmsn': self.mtmsn, 'queue': self.queue,
+                'csq': self.csq}
 
     def on_csq(self, val):
         ''' Triggers activity linked to changes in csq.
 
-            Checks the current csq_threshold, and if crosssed,
-            will attemped a session if a session is scheduled.
-
-            If the ISU is not registered, a registration will be attempted.
+            Feeds the link estimator, and if it considers the signal good
+            enough, will attemped a session if a session is scheduled and
+            the serving satellite isn't below the scheduler's minimum
+            elevation.
 
             If any signal has been seen, updates self.last_sat_time.
         '''
-        if int(val) > self.csq_thresh:
+        self.last_indicator = self.clock.time()
+        self.scheduler.signal(val)
+        self.link.signal(val)
+        if self.link.ready() and self.scheduler.elevation_ok():
             if self.session is not None:
                 if self.session.status == 0:
                     self.session.attempt()
 
-            # if self.reg_status != 2 and (
-            #         self.clock.time() - self.last_reg_attempt > 5):
-            #     self.last_reg_attempt = self.clock.time()
-            #     self.atcmd("+SBDREG")
-
         if int(val) > 0:
             self.last_sat_time = self.clock.time()
 
+    def on_satellite(self, sv_id, x, y, z):
+        ''' Track the serving satellite's position for session scheduling
+
+            :param int sv_id: satellite id
+        '''
+        self.last_indicator = self.clock.time()
+        self.scheduler.satellite(sv_id, x, y, z)
+
+    def on_registration(self, status, reg_class):
+        ''' Track the ISU's registration reported by +SBDREG or +AREG
+
+            :param int status: SBDREG status, 2 is registered
+            :param int reg_class: class of the registration error
+        '''
+        self.registration.update(status, reg_class)
+
+    def _reg_done(self, command):
+        if self.registration.pending:
+            # no status was reported
+            self.registration.failed()
+
+    def check_registration(self):
+        ''' Query the registration status when it's unknown, and register
+            when the ISU isn't registered and the back-off has expired.
+
+            Registration is only managed while ring alerts are wanted, and
+            is left to a pending SBD session, which registers the ISU as it
+            runs.
+        '''
+        if not self.ring_alerts:
+            return
+        reg = self.registration
+        if reg.unknown():
+            reg.query()
+            self.atcmd("+SBDREG?", False, callback=self._reg_done)
+        elif not self.session and reg.due(self.csq):
+            reg.attempt()
+            self.atcmd("+SBDREG", False, self.SBD_SESSION_WAIT,
+                       self._reg_done)
+
+    def enable_ring_alerts(self):
+        ''' Enable automatic registration, and ring alerts once the ISU is
+            registered.  Ring alerts are enabled again each time the ISU is
+            started.
+        '''
+        self.ring_alerts = True
+        self.atcmd("+SBDAREG=1", False)
+        self.registration.when_registered(self._ring_alerts_on)
+
+    def _ring_alerts_on(self):
+        self.sbd_ring_alerts(1)
+
+    def on_isu_position(self, x, y, z):
+        ''' Track the ISU's network reported position for session
+            scheduling
+        '''
+        self.scheduler.isu_position(x, y, z)
+
     @property
     def mo_flag(self):
         ''' Indicates a message is waiting on the ISU to be sent.
@@ -194,9 +324,8 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
     def mt_flag(self, val):
         ''' Set the driver's mt flag based on truth of val.
 
-            If True, the `wait_for_receive` flag is set and a read command
-            is emitting to the ISU to add the message to the ISU's data
-            stream
+            If True, the `wait_for_receive` flag is set and the message is
+            read from the ISU as binary
 
             :param val: Truthy value for flag
 
@@ -206,7 +335,7 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
         if val:
             # doesn't reset status of MT flag.
             self.wait_for_read = True
-            self.sbd_read_text()
+            self.sbd_read_binary()
 
     @property
     def momsn(self):
@@ -268,6 +397,7 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
         '''
         self._ra_flag = val
         if val:
+            self.last_indicator = self.clock.time()
             self.wait_for_recv = True
             self.create_sbd_session()
 
@@ -302,14 +432,22 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
             If there are errors, print them and clear them.
 
             If the driver is not waiting to send a message, and there are
-            messages to send, pop off the oldest message and send it.
+            messages to send, pack as many of the oldest messages as fit into
+            one SBD message and send it.  In memory messages are sent before
+            the outbox is drained.
 
-            Check the ISU status ever 30s.
+            Poll the ISU status, see `poll_due`.
 
             If the current csq is greater than 0, update last_sat time.
         '''
         self.read_from_device()
+        self.commands.run()
+        self.check_registration()
         if self.session:
+            # CIEV only reports changes, don't wait on one under steady signal
+            if (self.session.status == 0 and self.link.ready() and
+                    self.scheduler.elevation_ok()):
+                self.session.attempt()
             self.check_session()
 
         if self.errors:
@@ -317,9 +455,13 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
                 print("rb.run: {}".format(err))
             self.errors = []
 
-        if not self.wait_for_send and not self.mo_flag and self.messages:
-            msg = self.messages.pop(0)
-            self.send_message(msg)
+        # the MO buffer belongs to an outstanding session until it's checked
+        if not self.wait_for_send and not self.mo_flag and not self.session:
+            if self.messages:
+                msg = self.pack_messages(self.messages)
+                self.send_message(msg)
+            elif self.outbox_pending:
+                self.send_outbox()
 
         if self.csq > 0:
             self.last_sat_time = self.clock.time()
@@ -330,28 +472,66 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
         if self.quiet:
             return
 
-        if self.clock.time() - self.last_status_check > self.status_check_period:  # NOQA
-            self.atcmd("+CIER?", False)
-            self.clock.sleep(.01)
-            self.sbd_status(True)
-            self.last_status_check = self.clock.time()
+        now = self.clock.time()
+        if now - self.last_status_check > self.status_check_period:
+            if self.poll_due(now):
+                self.polls += 1
+                self.atcmd("+CIER?", False)
+                self.clock.sleep(.01)
+                self.sbd_status(True)
+                if self.scheduler.isu is None:
+                    self.clock.sleep(.01)
+                    self.atcmd("-MSGEO", False)
+            else:
+                self.polls_skipped += 1
+            self.last_status_check = now
+
+    def poll_due(self, now):
+        ''' Check if the ISU's status should be polled.
 
+            Indicator events (+CIEV) and ring alerts are reported by the ISU
+            as they happen, so an idle driver only polls when it hasn't heard
+            one for `stale_period` seconds, e.g. after power up or if
+            indicator reporting was lost.  While messages or a session are
+            pending the status is polled every `status_check_period`
+            seconds.
+
+            :param float now: current time
+            :rtype: bool
+        '''
+        if self.session or self.messages or self.wait:
+            return True
+        return now - self.last_indicator > self.stale_period
+
+    def learn_link(self, session, sent):
+        ''' Teach the link estimator the outcome of a session at the CSQ it
+            was attempted at, and share the learned threshold with the
+            scheduler so it predicts windows of usable signal.
+
+            :param SBDSession session: attempted session
+            :param bool sent: True if the MO message was delivered
+        '''
+        if not session.prev_state:
+            return
+        self.link.outcome(session.prev_state['csq'], sent)
+        self.scheduler.csq_thresh = self.link.threshold - 1
 
     def retry_session(self, retry):
-        ''' Retry a session, implementing a back-off delay based on the number
-            of attempts.
+        ''' Retry a session, delayed until the scheduler's predicted next
+            good signal window.
 
             If retry is less than 5, a new SBD session is created with a delay
-            related to the number of retries.
+            predicted from CSQ and satellite pass history, falling back to a
+            back-off based on the number of retries.
 
             :param int retry: attempt number
 
         '''
-        SBD_BACKOFF = [0, 5, 10, 30, 60]
-        period = SBD_BACKOFF[min(4, retry)]
+        period = self.scheduler.delay(retry)
         print("session failed, retry: {} period: {}".format(retry, period))
         self.session = SBDSession(self.state, self.sbd_initx,
-                                  retry=retry, delay=period)
+                                  retry=retry, delay=period,
+                                  clock=self.clock)
 
     def check_session(self):
         ''' Check the current sbd session.
@@ -372,10 +552,13 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
 
         done = False
         self.last_session = self.session
+        self.session_log.record(self.last_session, self.clock.time())
         retry = self.last_session.retry + 1
 
         if self.last_session.status == 3:
             # session timeout, rebuild the session
+            self.scheduler.attempted(False)
+            self.learn_link(self.last_session, False)
             self.retry_session(retry)
             self.bad_session = True
             print("session timeout")
@@ -385,18 +568,28 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
         if self.last_session.status == 4:
             setqueue = False
             # Send successful
-            if self.last_session.mosta in [0, 1, 2, 3, 4]:
+            sent = self.last_session.mosta in [0, 1, 2, 3, 4]
+            if self.last_session.mosta is not None:
+                self.scheduler.attempted(sent)
+                self.learn_link(self.last_session, sent)
+            if sent and not self.registration.registered:
+                # a completed session registers the ISU
+                self.registration.update(Registration.REGISTERED)
+            if sent:
                 self.wait_for_send = False
                 self.sbd_clear_mo()
                 setqueue = True
                 done = True
+                if self.in_flight:
+                    self.outbox.remove(self.in_flight)
+                    self.in_flight = []
 
             # Received message
             if self.last_session.mtsta == 1:
                 self.wait_for_recv = False
                 self.wait_for_read = True
                 setqueue = True
-                self.sbd_read_text()
+                self.sbd_read_binary()
 
             if retry <= 4 and not done:
                 self.retry_session(retry)
@@ -409,6 +602,10 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
                 self.wait_for_read = False
                 self.wait_for_recv = False
                 print("Out of retries, failed message")
+                if self.in_flight:
+                    # keep the batch in the outbox for the next start
+                    self.outbox_hold = True
+                    self.in_flight = []
 
             if done:
                 self.session = None
@@ -423,16 +620,90 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
         ''' Write a message to the ISU and trigger a SBD Status reponse to
             check if ISU now has a pending message.
 
-            :param str message: String to send
+            Strings are written as text with AT+SBDWT, bytes as binary with
+            AT+SBDWB.  The status request is queued behind the write, so it
+            reports the MO buffer after the write completes.
+
+            :param str|bytes message: message to send
 
         '''
         self.wait_for_send = True
-        self.sbd_write(msg)
-        self.clock.wait(.01)
-        # self.sbd_write(msg)
-        self.clock.wait(.01)
+        if isinstance(msg, bytes):
+            cmd = self.sbd_write_binary(msg)
+        else:
+            cmd = self.sbd_write(msg)
+        cmd.callback = lambda command: self.on_write(command, msg)
         self.sbd_status(True)
 
+    def on_write(self, command, msg):
+        ''' Handle the result of writing a message to the MO buffer.
+
+            A message whose write timed out is queued again; an ISU which
+            stopped answering is reset by the application once the command
+            queue reports it stalled.  Messages the ISU rejected as
+            malformed are dropped.
+
+            :param ATCommand command: completed SBDWT or SBDWB command
+            :param str|bytes msg: the message written
+        '''
+        if command.ok:
+            return
+        print("rb write failed: {} {}".format(command.result, command.code))
+        self.wait_for_send = False
+        if self.in_flight:
+            # entries stay in the outbox and are sent again
+            self.in_flight = []
+        elif command.result == "TIMEOUT" or command.code == 1:
+            self.messages.insert(0, msg)
+
+    def pack_messages(self, messages):
+        ''' Remove as many of the oldest messages as fit in one SBD message
+            from messages and pack them, so they are delivered in a single
+            session.
+
+            :param list messages: queue of str or bytes messages
+            :rtype: str|bytes
+            :return: packed message
+        '''
+        msg, count = sbd_codec.pack_messages(messages, self.mo_max)
+        for _ in range(count):
+            messages.pop(0)
+        return msg
+
+    def queue_message(self, msg, priority=0):
+        ''' Queue a message to send, persisting it in the outbox if there
+            is one.
+
+            :param str|bytes msg: message to send
+            :param int priority: outbox priority
+        '''
+        if self.outbox is not None:
+            self.outbox.put(msg, priority)
+        else:
+            self.messages.append(msg)
+
+    @property
+    def outbox_pending(self):
+        ''' Indicates outbox entries are waiting to be sent.  Draining is
+            held after a batch fails all its retries until the next start.
+
+            :rtype: bool
+        '''
+        return bool(self.outbox) and not self.outbox_hold
+
+    def send_outbox(self):
+        ''' Pack as many outbox entries as fit into one SBD message, oldest
+            or highest priority first, record the attempt and send it.  The
+            entries are removed from the outbox once a session delivers
+            them.
+        '''
+        entries = self.outbox.pending(self.outbox_by_priority)
+        msg, count = sbd_codec.pack_messages(
+            [entry.msg for entry in entries], self.mo_max)
+        self.in_flight = entries[:count]
+        self.outbox.attempt(self.in_flight)
+        self.send_message(msg)
+
     def sat_ping(self):
         ''' Send a PONG response over ISU '''
         self.send_message("PONG")
@@ -452,7 +723,8 @@ class RockBlock(ModemController, SBDCommandMixin, ISUResponseMixin):
             self.wait_for_read,
             self.wait_for_data,
             self.wait_for_status,
-            self.new_data, ])
+            self.new_data,
+            self.outbox_pending, ])
 
     def _load_data(self, pkt_type, payload):
         ''' Load a packet as if it were received from the device '''
@@ -0,0 +1,239 @@
+"""
+Satellite Pass Scheduler
+------------------------
+
+Schedules SBD session attempts around Iridium satellite passes.
+
+An SBDIX attempt made while the serving satellite is low on the horizon
+usually fails after the ISU has spent seconds transmitting, which makes low
+elevation attempts the largest waste of modem energy.  The scheduler keeps
+a short history of CSQ readings and satellite positions, as reported by
++CIEV:3 and -MSGEO, and uses it to predict when signal will next be good
+enough for a session.
+
+Satellite and ISU positions are earth centered, earth fixed coordinates as
+reported by the ISU.  Elevation of the serving satellite above the ISU's
+horizon is computed from the two positions.  With no -MSGEO position the
+scheduler falls back on CSQ history alone.
+
+A delay before the next attempt is predicted, in order of preference, from:
+
+- signal which is good now
+- the serving satellite rising towards the minimum elevation
+- the mean interval between the starts of past good signal windows
+- a fixed back-off by retry count
+
+Failed attempts above the minimum elevation raise the minimum elevation,
+and successful attempts lower it again, so the threshold settles where the
+antenna's view of the sky allows sessions to complete.
+"""
+from array import array
+import math
+from core.compat import time
+
+
+#: Fallback delay in seconds by retry count, when there is no history
+BACKOFF = (0, 5, 10, 30, 60)
+
+
+class PassScheduler:
+    ''' Predicts good signal windows for SBD sessions.
+
+        :param clock: object with a time method
+        :param int size: number of CSQ and elevation samples kept
+        :param int csq_thresh: CSQ must be above this for a session
+        :param float min_elevation: degrees, sessions are held while the
+            serving satellite is below this
+        :param int min_delay: shortest delay in seconds before a retry
+        :param int max_delay: longest delay in seconds before an attempt
+    '''
+
+    ELEVATION_FLOOR = 8
+    ELEVATION_CEIL = 40
+    ELEVATION_STEP = 2
+
+    def __init__(self, clock=time, size=32, csq_thresh=2, min_elevation=15,
+                 min_delay=5, max_delay=120):
+        self.clock = clock
+        self.size = size
+        self.csq_thresh = csq_thresh
+        self.min_elevation = min_elevation
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.times = array('i', [0] * size)
+        self.csqs = array('b', [0] * size)
+        self.elevations = array('f', [0] * size)
+        self.head = 0
+        self.count = 0
+        self.onsets = array('i', [0] * 8)
+        self.onset_count = 0
+        self.isu = None
+        self.sv_id = None
+        self.elevation = None
+        self.elevation_time = 0
+        self.elevation_rate = 0
+        self.last_csq = 0
+
+    def _now(self):
+        return int(self.clock.time())
+
+    def _record(self, now):
+        self.times[self.head] = now
+        self.csqs[self.head] = self.last_csq
+        self.elevations[self.head] = (
+            -90 if self.elevation is None else self.elevation)
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def signal(self, csq, now=None):
+        ''' Record a CSQ reading, noting the start of a good signal window.
+
+            :param int csq: signal strength, 0-5
+        '''
+        now = self._now() if now is None else int(now)
+        csq = int(csq)
+        if csq > self.csq_thresh >= self.last_csq:
+            n = len(self.onsets)
+            self.onsets[self.onset_count % n] = now
+            self.onset_count += 1
+        self.last_csq = csq
+        self._record(now)
+
+    def isu_position(self, x, y, z):
+        ''' Set the ISU position from a -MSGEO response '''
+        self.isu = (x, y, z)
+
+    def satellite(self, sv_id, x, y, z, now=None):
+        ''' Record the serving satellite position from a +CIEV:3 response,
+            updating its elevation and rate of climb.
+
+            :param int sv_id: satellite id
+        '''
+        now = self._now() if now is None else int(now)
+        if self.isu is None:
+            self.sv_id = sv_id
+            return
+        elevation = self.elevation_of(self.isu, (x, y, z))
+        if sv_id == self.sv_id and self.elevation is not None and (
+                now > self.elevation_time):
+            self.elevation_rate = (
+                (elevation - self.elevation) / (now - self.elevation_time))
+        else:
+            self.elevation_rate = 0
+        self.sv_id = sv_id
+        self.elevation = elevation
+        self.elevation_time = now
+        self._record(now)
+
+    @staticmethod
+    def elevation_of(isu, sv):
+        ''' Elevation of a satellite above the ISU's horizon.
+
+            :param tuple isu: ISU ECEF x, y, z
+            :param tuple sv: satellite ECEF x, y, z
+            :rtype: float
+            :return: degrees
+        '''
+        dx, dy, dz = sv[0] - isu[0], sv[1] - isu[1], sv[2] - isu[2]
+        rng = math.sqrt(dx * dx + dy * dy + dz * dz)
+        radius = math.sqrt(isu[0] ** 2 + isu[1] ** 2 + isu[2] ** 2)
+        if rng == 0 or radius == 0:
+            return 90.
+        dot = (dx * isu[0] + dy * isu[1] + dz * isu[2]) / (rng * radius)
+        return math.degrees(math.asin(max(-1., min(1., dot))))
+
+    def elevation_ok(self):
+        ''' Check the serving satellite is high enough, or its elevation
+            is unknown.
+
+            :rtype: bool
+        '''
+        return self.elevation is None or self.elevation >= self.min_elevation
+
+    def ready(self):
+        ''' Check if a session attempt is likely to succeed now.
+
+            :rtype: bool
+        '''
+        return self.last_csq > self.csq_thresh and self.elevation_ok()
+
+    def onset_period(self):
+        ''' Mean interval between the starts of recent good signal windows.
+
+            :rtype: int
+            :return: seconds, or None with fewer than two windows seen
+        '''
+        n = min(self.onset_count, len(self.onsets))
+        if n < 2:
+            return None
+        ordered = sorted(self.onsets[i] for i in range(n))
+        return (ordered[-1] - ordered[0]) // (n - 1)
+
+    def next_window(self, now=None):
+        ''' Predict the seconds until signal is next good enough for a
+            session.
+
+            :rtype: int
+            :return: seconds, or None if there's nothing to predict from
+        '''
+        now = self._now() if now is None else int(now)
+        if self.ready():
+            return 0
+
+        if (self.elevation is not None and self.elevation_rate > 0 and
+                self.elevation < self.min_elevation):
+            return int((self.min_elevation - self.elevation) /
+                       self.elevation_rate) + 1
+
+        period = self.onset_period()
+        if period:
+            last = max(self.onsets[i] for i in range(
+                min(self.onset_count, len(self.onsets))))
+            wait = last + period - now
+            while wait < 0:
+                wait += period
+            return wait
+        return None
+
+    def delay(self, retry, now=None):
+        ''' Delay before attempting session number retry.
+
+            :param int retry: number of failed attempts so far
+            :rtype: int
+            :return: seconds
+        '''
+        wait = self.next_window(now)
+        if wait is None:
+            return BACKOFF[min(retry, len(BACKOFF) - 1)]
+        if retry > 0:
+            wait = max(wait, self.min_delay)
+        return min(wait, self.max_delay)
+
+    def attempted(self, success):
+        ''' Learn the minimum elevation from the result of an attempt.
+
+            :param bool success: True if the session delivered
+        '''
+        if self.elevation is None:
+            return
+        if success:
+            self.min_elevation = max(
+                self.ELEVATION_FLOOR,
+                self.min_elevation - self.ELEVATION_STEP / 2)
+        elif self.elevation >= self.min_elevation:
+            self.min_elevation = min(
+                self.ELEVATION_CEIL,
+                self.elevation + self.ELEVATION_STEP)
+
+    def history(self):
+        ''' CSQ and elevation samples, oldest first.
+
+            :rtype: list
+            :return: list of (time, csq, elevation)
+        '''
+        start = (self.head - self.count) % self.size
+        out = []
+        for i in range(self.count):
+            j = (start + i) % self.size
+            out.append((self.times[j], self.csqs[j], self.elevations[j]))
+        return out
@@ -0,0 +1,370 @@
+"""
+SBD Codec
+---------
+
+Compact binary encoding of Paikea messages for SBD binary transfers
+(AT+SBDWB/AT+SBDRB).
+
+Iridium bills per byte and per session, so position reports are packed into
+a fixed 16 byte layout instead of the ~90 byte ascii PK001 message.  All
+fields are big endian.
+
+=====  =====  ===============================================
+byte   bits   field
+=====  =====  ===============================================
+0      8      message type, `POSITION_REPORT`
+1-4    32     latitude, signed, 1e-7 degrees
+5-8    32     longitude, signed, 1e-7 degrees
+9-11   17     UTC seconds of the day
+9-11   7      status bits (bit 0: beacon)
+12-14  12     course over ground, 0.1 degrees
+12-14  12     speed over ground, 0.1 km/h, clamped to 409.5
+15     8      main battery voltage, 0.1 V, clamped to 25.5
+=====  =====  ===============================================
+
+The message type byte is below the printable range so binary messages can't
+be mistaken for ascii "PK..." messages.
+
+Several queued messages can be packed into a single SBD message so they are
+delivered in one session.  When every message is text they are framed as
+text, each one prefixed with `TEXT_FRAME` and its length as two hex digits,
+so the packed message can still be written with AT+SBDWT:
+
+    #08PK006;15#0BPK001;lat:...
+
+If any message is binary the packed message is binary, a `MULTI` type byte
+followed by each message prefixed with its length as one byte.
+
+Shore to buoy commands can be sent as a binary MT message, a `COMMAND` type
+byte followed by records of an id byte, a length byte and the value.  The
+records decode to the same packets as the ascii commands:
+
+==========  ========  =============================================
+id          packet    value
+==========  ========  =============================================
+0x05        PK005     beacon, 1 byte, 0 or 1
+0x06        PK006     report interval in minutes, 2 bytes
+0x07        PK007     sleep time in seconds, 4 bytes
+0x10        WPL       waypoint: command byte ('A'dd, 'D'el, 'M'od),
+                      lat and lon as in a position report, name
+0x20        CONFIG    config blob: key, '=', value, as ascii
+==========  ========  =============================================
+
+Waypoints decode to the dict `GPS.import_waypoint` takes, with NMEA
+coordinates, and are delivered under the 'wpl' key as +WPL responses are.
+Config blobs decode to {key: value}.
+"""
+
+#: Message type of a binary position report
+POSITION_REPORT = 0x01
+#: Length of a binary position report in bytes
+POSITION_REPORT_LEN = 16
+#: Message type of binary packed messages
+MULTI = 0x02
+#: Prefix of each message in text packed messages
+TEXT_FRAME = "#"
+#: Message type of binary shore to buoy commands
+COMMAND = 0x03
+#: Maximum size of a mobile originated SBD message
+MO_MAX = 340
+#: Maximum size of a mobile terminated SBD message
+MT_MAX = 270
+
+#: Command record ids
+CMD_BEACON = 0x05
+CMD_INTERVAL = 0x06
+CMD_SLEEP = 0x07
+CMD_WAYPOINT = 0x10
+CMD_CONFIG = 0x20
+
+_CMD_PACKETS = {
+    CMD_BEACON: "PK005",
+    CMD_INTERVAL: "PK006",
+    CMD_SLEEP: "PK007",
+}
+
+_WPL_CMDS = b"ADM"
+
+_DEG_SCALE = 10000000
+
+
+def nmea_degrees(value, hemisphere):
+    ''' Convert an NMEA [D]DDMM.mmmm coordinate and hemisphere indicator to
+        signed decimal degrees.
+
+        :param str value: NMEA coordinate
+        :param str hemisphere: 'N', 'S', 'E' or 'W'
+        :rtype: float
+        :return: decimal degrees, negative south and west
+    '''
+    # split before converting to keep precision with single precision floats
+    whole, frac = value.split('.')
+    deg = int(whole[:-2] or 0) + float(whole[-2:] + '.' + frac) / 60
+    if hemisphere in ('S', 'W'):
+        return -deg
+    return deg
+
+
+def utc_seconds(utc):
+    ''' Convert an NMEA hhmmss.sss time to seconds of the day.
+
+        :param str utc: NMEA utc time
+        :rtype: int
+        :return: seconds since midnight UTC
+    '''
+    utc = int(float(utc))
+    return (utc // 10000) * 3600 + (utc // 100 % 100) * 60 + utc % 100
+
+
+def nmea_coordinate(deg, hemispheres="NS"):
+    ''' Convert signed decimal degrees to an NMEA [D]DDMM.mmmm coordinate,
+        the inverse of `nmea_degrees`.
+
+        :param float deg: decimal degrees, negative south and west
+        :param str hemispheres: positive and negative indicators, "NS" for
+            latitude or "EW" for longitude
+        :rtype: tuple
+        :return: (NMEA coordinate, hemisphere indicator)
+    '''
+    hemisphere = hemispheres[deg < 0]
+    # whole ten thousandths of a minute, so rounding can't give 60 minutes
+    units = int(abs(deg) * 600000 + 0.5)
+    whole, frac = divmod(units, 10000)
+    value = "{:0{}d}{:02d}.{:04d}".format(
+        whole // 60, 2 if hemispheres == "NS" else 3, whole % 60, frac)
+    return value, hemisphere
+
+
+def nmea_utc(seconds):
+    ''' Convert seconds of the day to an NMEA hhmmss time, the inverse of
+        `utc_seconds`.
+
+        :param int seconds: seconds since midnight UTC
+        :rtype: str
+    '''
+    return "{:02d}{:02d}{:02d}".format(
+        seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _signed(raw):
+    value = int.from_bytes(raw, 'big')
+    if value & 0x80000000:
+        value -= 1 << 32
+    return value
+
+
+def _clamp(value, scale, bits):
+    return max(0, min(int(round(value * scale)), (1 << bits) - 1))
+
+
+def encode_position(lat, lon, utc, cog=0, sog=0, status=0, batt=0):
+    ''' Pack a position report.
+
+        :param float lat: latitude in decimal degrees
+        :param float lon: longitude in decimal degrees
+        :param int utc: UTC seconds of the day
+        :param float cog: course over ground in degrees
+        :param float sog: speed over ground in km/h
+        :param int status: status bits, 7 bits are kept
+        :param float batt: battery voltage
+        :rtype: bytes
+        :return: 16 byte report
+    '''
+    out = bytearray(POSITION_REPORT_LEN)
+    out[0] = POSITION_REPORT
+    out[1:5] = (int(round(lat * _DEG_SCALE)) & 0xFFFFFFFF).to_bytes(4, 'big')
+    out[5:9] = (int(round(lon * _DEG_SCALE)) & 0xFFFFFFFF).to_bytes(4, 'big')
+    word = (int(utc) % 86400) << 7 | (int(status) & 0x7F)
+    out[9:12] = word.to_bytes(3, 'big')
+    word = _clamp(cog, 10, 12) % 3600 << 12 | _clamp(sog, 10, 12)
+    out[12:15] = word.to_bytes(3, 'big')
+    out[15] = _clamp(batt, 10, 8)
+    return bytes(out)
+
+
+def decode_position(raw):
+    ''' Unpack a position report.
+
+        :param bytes raw: 16 byte report
+        :rtype: dict
+        :return: {'lat', 'lon', 'utc', 'sta', 'cog', 'sog', 'batt'}
+    '''
+    if len(raw) != POSITION_REPORT_LEN or raw[0] != POSITION_REPORT:
+        raise ValueError("not a position report")
+    word = int.from_bytes(raw[9:12], 'big')
+    course = int.from_bytes(raw[12:15], 'big')
+    return {
+        'lat': _signed(raw[1:5]) / _DEG_SCALE,
+        'lon': _signed(raw[5:9]) / _DEG_SCALE,
+        'utc': word >> 7,
+        'sta': word & 0x7F,
+        'cog': (course >> 12) / 10,
+        'sog': (course & 0xFFF) / 10,
+        'batt': raw[15] / 10,
+    }
+
+
+def pack_messages(messages, limit=MO_MAX):
+    ''' Pack as many messages from the front of messages as fit in a single
+        SBD message of at most limit bytes.  A single message is returned
+        unframed.
+
+        :param list messages: queued str or bytes messages
+        :param int limit: maximum size of the packed message
+        :rtype: tuple
+        :return: (packed message, number of messages packed)
+    '''
+    if not messages:
+        return None, 0
+
+    text_len = 0
+    bin_len = 1
+    binary = False
+    count = 0
+    for msg in messages:
+        n = len(msg)
+        if n > 255:
+            break
+        is_bin = binary or isinstance(msg, bytes)
+        if is_bin and bin_len + 1 + n > limit:
+            break
+        if not is_bin and text_len + 3 + n > limit:
+            break
+        binary = is_bin
+        text_len += 3 + n
+        bin_len += 1 + n
+        count += 1
+
+    if count <= 1:
+        return messages[0], 1
+
+    if binary:
+        out = bytearray(bin_len)
+        out[0] = MULTI
+        pos = 1
+        for msg in messages[:count]:
+            if isinstance(msg, str):
+                msg = msg.encode('ascii')
+            out[pos] = len(msg)
+            out[pos + 1:pos + 1 + len(msg)] = msg
+            pos += 1 + len(msg)
+        return bytes(out), count
+
+    return "".join(
+        "{}{:02X}{}".format(TEXT_FRAME, len(msg), msg)
+        for msg in messages[:count]), count
+
+
+def unpack_text(payload):
+    ''' Split text packed messages.
+
+        :param str payload: packed messages
+        :rtype: list
+        :return: list of messages
+    '''
+    frames = []
+    pos = 0
+    while pos < len(payload):
+        if payload[pos] != TEXT_FRAME:
+            raise ValueError("bad frame at {}".format(pos))
+        n = int(payload[pos + 1:pos + 3], 16)
+        frames.append(payload[pos + 3:pos + 3 + n])
+        pos += 3 + n
+    if pos != len(payload):
+        raise ValueError("truncated frame")
+    return frames
+
+
+def unpack_messages(raw):
+    ''' Split binary packed messages.
+
+        :param bytes raw: packed messages starting with the `MULTI` type
+        :rtype: list
+        :return: list of messages as bytes
+    '''
+    if not raw or raw[0] != MULTI:
+        raise ValueError("not packed messages")
+    frames = []
+    pos = 1
+    while pos < len(raw):
+        n = raw[pos]
+        frames.append(raw[pos + 1:pos + 1 + n])
+        pos += 1 + n
+    if pos != len(raw):
+        raise ValueError("truncated frame")
+    return frames
+
+
+def encode_commands(records):
+    ''' Pack command records into a binary MT message.
+
+        :param list records: (record id, bytes value) pairs
+        :rtype: bytes
+        :return: command message
+    '''
+    out = bytearray([COMMAND])
+    for cmd_id, value in records:
+        out.append(cmd_id)
+        out.append(len(value))
+        out.extend(value)
+    if len(out) > MT_MAX:
+        raise ValueError("command message too long")
+    return bytes(out)
+
+
+def encode_waypoint(cmd, lat, lon, name):
+    ''' Value of a waypoint command record.
+
+        :param str cmd: 'ADD', 'DEL' or 'MOD'
+        :param float lat: latitude in decimal degrees
+        :param float lon: longitude in decimal degrees
+        :param str name: waypoint name
+        :rtype: bytes
+    '''
+    return (cmd[0].encode('ascii') +
+            (int(round(lat * _DEG_SCALE)) & 0xFFFFFFFF).to_bytes(4, 'big') +
+            (int(round(lon * _DEG_SCALE)) & 0xFFFFFFFF).to_bytes(4, 'big') +
+            name.encode('ascii'))
+
+
+def decode_commands(raw):
+    ''' Unpack a binary command message into packets, in the form the
+        ascii commands are parsed into.
+
+        :param bytes raw: message starting with the `COMMAND` type
+        :rtype: list
+        :return: list of (packet type, value)
+    '''
+    if not raw or raw[0] != COMMAND:
+        raise ValueError("not a command message")
+    packets = []
+    pos = 1
+    while pos < len(raw):
+        if pos + 2 > len(raw):
+            raise ValueError("truncated record")
+        cmd_id = raw[pos]
+        n = raw[pos + 1]
+        value = raw[pos + 2:pos + 2 + n]
+        if len(value) != n:
+            raise ValueError("truncated record")
+        pos += 2 + n
+
+        if cmd_id in _CMD_PACKETS:
+            packets.append((_CMD_PACKETS[cmd_id],
+                            str(int.from_bytes(value, 'big'))))
+        elif cmd_id == CMD_WAYPOINT:
+            if n < 9:
+                raise ValueError("short waypoint")
+            if value[0] not in _WPL_CMDS:
+                raise ValueError("unknown waypoint command")
+            lat, ns = nmea_coordinate(_signed(value[1:5]) / _DEG_SCALE, "NS")
+            lon, ew = nmea_coordinate(_signed(value[5:9]) / _DEG_SCALE, "EW")
+            packets.append(("WPL", {
+                'cmd': chr(value[0]), 'name': value[9:].decode('ascii'),
+                'lat': lat, 'NS': ns, 'lon': lon, 'EW': ew}))
+        elif cmd_id == CMD_CONFIG:
+            key, _, val = value.decode('ascii').partition("=")
+            packets.append(("CONFIG", {key: val}))
+        else:
+            raise ValueError("unknown command {}".format(cmd_id))
+    return packets
@@ -3,8 +3,44 @@ Serial Protocols
 ----------------
 
 Basic string parsing used for NMEA devices
+
+Sentences read from a device are tokenized as bytes by `NMEATokenizer`,
+which finds the preamble, checksum delimiter and line end and checks the
+checksum in a single pass over each chunk read, copying the sentence into
+a fixed buffer.  Only sentences which pass the checksum are decoded to
+strings for the parsers.
+
+Checksums are computed over bytes or memoryview slices with
+`nmea_checksum`, which can be continued across chunks, and hex digits are
+encoded and decoded by table lookup.
 """
 
+CR = 0x0D
+LF = 0x0A
+
+#: Ascii hex digits by value
+HEX_DIGITS = b"0123456789ABCDEF"
+
+#: Value of each ascii hex digit by character code, 0xFF if not a digit
+HEX_VALUES = bytearray(b"\xff" * 256)
+for _i, _c in enumerate(HEX_DIGITS):
+    HEX_VALUES[_c] = _i
+    HEX_VALUES[_c | 0x20] = _i
+
+
+def nmea_checksum(data, crc=0):
+    ''' XOR checksum of an NMEA sentence body.
+
+        :param data: bytes, bytearray or memoryview slice between the
+            preamble and the data field terminator
+        :param int crc: checksum of the preceding data, to continue a
+            checksum over a stream of chunks
+        :rtype: int
+    '''
+    for c in data:
+        crc ^= c
+    return crc
+
 
 class ProtocolSpec:
     ''' Specifiy the protocol for parsing a string '''
@@ -26,6 +62,9 @@ class SimpleSerialProtocol:
     def __init__(self, spec, sentence="", parser_lut=None):
         self.sentence = sentence
         self.spec = spec
+        self.packet = bytearray(96)
+        self.packet_mv = memoryview(self.packet)
+        self.crc_sum = 0
         self.parser_lut = parser_lut
         self.scan()
         self.data = {}
@@ -51,19 +90,17 @@ class SimpleSerialProtocol:
     def compute_crc(chksum_data):
         ''' NMEA CRC calculation.
 
-            :param str chksum_data: String data on which to compute CRC
+            :param chksum_data: String or bytes on which to compute CRC
             :rtype: str
-            :returns: string of CRC bytes
+            :returns: string of CRC bytes, "00" if the data isn't ascii
 
         '''
-
-        crc = 0
-        for _char in chksum_data:
-            try:
-                crc = crc ^ ord(_char.encode("ascii"))
-            except Exception:
-                return "00"
-        return "{:02X}".format(crc)
+        if isinstance(chksum_data, str):
+            chksum_data = chksum_data.encode()
+        if any(c > 127 for c in chksum_data):
+            return "00"
+        crc = nmea_checksum(chksum_data)
+        return chr(HEX_DIGITS[crc >> 4]) + chr(HEX_DIGITS[crc & 0x0F])
 
     def clear(self):
         ''' Clear protocol state '''
@@ -106,6 +143,24 @@ class SimpleSerialProtocol:
         else:
             self.valid = False
 
+    def load(self, tokenizer):
+        ''' Load a sentence from a tokenizer, which has already checked
+            its syntax and checksum.
+
+            :param NMEATokenizer tokenizer: tokenizer holding a sentence
+        '''
+        try:
+            body = bytes(tokenizer.body).decode("ascii")
+        except UnicodeError:
+            self.valid = False
+            return
+        self.sentence = body
+        self.preamble = self.spec.preamble
+        self.pkt_type, _, self.datafields = body.partition(
+            self.spec.datafield_delimiter)
+        self.crc = "{:02X}".format(tokenizer.crc)
+        self.valid = tokenizer.valid
+
     def set_router(self, callable):
         ''' Set the sentence router for this protocol.
 
@@ -133,6 +188,70 @@ class SimpleSerialProtocol:
             # print(self.sentence)
             pass
 
+    def packet_into(self, talker_id, pkt_type, data_field=None):
+        ''' Construct a valid packet in the protocol's reusable packet
+            buffer.  The str parts are written into the buffer a character
+            at a time while the checksum is summed, so nothing is allocated
+            but the returned view.  The buffer only grows if a packet
+            doesn't fit, and packets with non-ascii data are built with
+            `create_packet` instead.
+
+            :param str talker_id:  ID of device creating packet
+            :param str pkt_type: packet type indicator
+            :param str data_field: packet data fields
+            :rtype: memoryview
+            :return: valid packet, only valid until the next packet is
+                constructed
+
+        '''
+        spec = self.spec
+        size = (len(spec.preamble) + len(talker_id) + len(pkt_type) + 3 +
+                len(spec.postfix))
+        if data_field is not None:
+            size += len(spec.datafield_delimiter) + len(data_field)
+        if size > len(self.packet):
+            self.packet = bytearray(size)
+            self.packet_mv = memoryview(self.packet)
+
+        buf = self.packet
+        pos = self._put(buf, 0, spec.preamble)
+        self.crc_sum = 0
+        pos = self._put(buf, pos, talker_id)
+        if pos >= 0:
+            pos = self._put(buf, pos, pkt_type)
+        if pos >= 0 and data_field is not None:
+            pos = self._put(buf, pos, spec.datafield_delimiter)
+            if pos >= 0:
+                pos = self._put(buf, pos, data_field)
+        if pos < 0:
+            # not ascii, the packet takes the "00" checksum
+            return memoryview(self.create_packet(
+                talker_id, pkt_type, data_field).encode())
+
+        crc = self.crc_sum
+        buf[pos] = ord(spec.datafield_terminator)
+        buf[pos + 1] = HEX_DIGITS[crc >> 4]
+        buf[pos + 2] = HEX_DIGITS[crc & 0x0F]
+        return self.packet_mv[:self._put(buf, pos + 3, spec.postfix)]
+
+    def _put(self, buf, pos, text):
+        ''' Write the characters of text into buf from pos, adding them
+            to `crc_sum`.
+
+            :rtype: int
+            :return: position after the text, -1 if it isn't ascii
+        '''
+        crc = 0
+        for c in text:
+            code = ord(c)
+            if code > 127:
+                return -1
+            buf[pos] = code
+            crc ^= code
+            pos += 1
+        self.crc_sum ^= crc
+        return pos
+
     def create_packet(self, talker_id, pkt_type, data_field=None):
         ''' construct a valid packet from given input data via this protocol
 
@@ -156,51 +275,257 @@ class SimpleSerialProtocol:
         return _cmd
 
 
+class NMEATokenizer:
+    ''' Incremental, byte oriented sentence tokenizer.
+
+        Bytes are fed in as they are read.  A sentence starts at the
+        preamble, the checksum is computed over the bytes up to the data
+        field terminator, compared with the two hex digits which follow it,
+        and the sentence completes at the first CR or LF.  A preamble inside
+        a sentence starts a new one, and sentences which don't fit the
+        buffer or are malformed are dropped and counted in `errors`.
+
+        The sentence is held in a fixed buffer and is only valid until the
+        next call to `feed`.
+
+        :param ProtocolSpec spec: protocol specification
+        :param int size: longest sentence accepted, NMEA allows 82 bytes
+        :ivar bool ready: a complete sentence is in the buffer
+        :ivar bool valid: the complete sentence passed its checksum
+        :ivar int crc: checksum computed over the sentence
+    '''
+
+    IDLE = 0
+    BODY = 1
+    CRC = 2
+    END = 3
+
+    def __init__(self, spec, size=96):
+        self.preamble = spec.preamble.encode("ascii")
+        self.terminator = spec.datafield_terminator.encode("ascii")
+        self.size = size
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.errors = 0
+        self.reset()
+
+    def reset(self):
+        ''' Drop any partial sentence '''
+        self.state = self.IDLE
+        self.length = 0
+        self.star = 0
+        self.crc = 0
+        self.expected = 0
+        self.digits = 0
+        self.ready = False
+        self.valid = False
+
+    @property
+    def sentence(self):
+        ''' The complete sentence, from the preamble to the checksum '''
+        return self.mv[:self.length]
+
+    @property
+    def body(self):
+        ''' The sentence between the preamble and the data terminator '''
+        return self.mv[1:self.star]
+
+    def pkt_type(self, delimiter=","):
+        ''' Decode the packet type of the sentence, without decoding the
+            data fields.
+
+            :param str delimiter: data field delimiter
+            :rtype: str
+        '''
+        buf = self.buf
+        delimiter = ord(delimiter)
+        end = 1
+        while end < self.star and buf[end] != delimiter:
+            end += 1
+        return bytes(self.mv[1:end]).decode("ascii")
+
+    def _drop(self):
+        self.errors += 1
+        self.state = self.IDLE
+
+    def feed(self, data, pos=0):
+        ''' Scan data from pos, stopping after the first complete sentence.
+
+            The sentence body is located with `find` and copied and summed
+            a slice at a time, only the checksum digits and line end are
+            handled byte by byte.
+
+            :param bytes data: bytes read from the device
+            :param int pos: index to start scanning from
+            :rtype: int
+            :return: index after the last byte consumed, `ready` is True if
+                a sentence was completed
+        '''
+        self.ready = False
+        buf = self.buf
+        view = memoryview(data)
+        end = len(data)
+        while pos < end:
+            state = self.state
+            if state == self.IDLE:
+                pos = data.find(self.preamble, pos)
+                if pos < 0:
+                    return end
+                buf[0] = data[pos]
+                self.length = 1
+                self.crc = 0
+                self.state = self.BODY
+                pos += 1
+
+            elif state == self.BODY:
+                stop = data.find(self.terminator, pos)
+                if stop < 0:
+                    stop = end
+                brk = self._break(data, pos, stop)
+                if brk > -1:
+                    # new sentence or line end before the terminator
+                    self._drop()
+                    pos = brk if data[brk] == buf[0] else brk + 1
+                    continue
+                n = stop - pos
+                if self.length + n + 3 > self.size:
+                    self._drop()
+                    pos = stop
+                    continue
+                chunk = view[pos:stop]
+                self.mv[self.length:self.length + n] = chunk
+                self.crc = nmea_checksum(chunk, self.crc)
+                self.length += n
+                pos = stop
+                if stop < end:
+                    self.star = self.length
+                    buf[self.length] = data[stop]
+                    self.length += 1
+                    self.expected = 0
+                    self.digits = 0
+                    self.state = self.CRC
+                    pos += 1
+
+            elif state == self.CRC:
+                c = HEX_VALUES[data[pos]]
+                if c > 15:
+                    self._drop()
+                    continue
+                buf[self.length] = data[pos]
+                self.length += 1
+                pos += 1
+                self.expected = self.expected << 4 | c
+                self.digits += 1
+                if self.digits == 2:
+                    self.valid = self.expected == self.crc
+                    self.state = self.END
+
+            else:
+                c = data[pos]
+                if c == CR or c == LF:
+                    self.state = self.IDLE
+                    self.ready = True
+                    return pos + 1
+                self._drop()
+        return pos
+
+    def _break(self, data, pos, stop):
+        ''' Index of the first preamble or line end in data[pos:stop] '''
+        first = -1
+        for sep in (self.preamble, b"\r", b"\n"):
+            idx = data.find(sep, pos, stop)
+            if idx > -1 and (first < 0 or idx < first):
+                first = idx
+        return first
+
+
 class SimpleStream():
     ''' Simple stream handler for packetize data from an underlying connection.
 
+        Each chunk read is tokenized in place, one sentence per call to
+        `consume`, and partial sentences are carried over by the tokenizer
+        to the next chunk.
+
+        By default sentences are parsed into `data` with the protocol's
+        parsers.  Consumers which only need some fields subscribe a field
+        selector, and `data` is then the selector's record: sentences are
+        routed on their packet type alone and skipped unless they carry a
+        subscribed field.
+
         :ivar connection conn: connection with a read method
         :ivar Protocol prot: Protocol for packets
-        :ivar str unterminated: Data read from device that is unterminated
-        :ivar str terminated: Data read from device which has protoocl
-            terminator
-        :ivar bool more: indicator for unterminated ata
+        :ivar NMEATokenizer tokenizer: sentence tokenizer
+        :ivar bytes chunk: Data read from device
+        :ivar int pos: position of unconsumed data in chunk
+        :ivar bool more: indicator for unconsumed data
         :ivar dict data: data parsed into dicts via protocol
+        :ivar selector: field selector, see `devices.nmea_parsers`
     '''
 
     def __init__(self, connection, protocol):
         self.conn = connection
         self.prot = protocol
-        self.unterminated = ''
-        self.terminated = ''
+        self.tokenizer = NMEATokenizer(protocol.spec)
+        self.chunk = b''
+        self.pos = 0
         self.more = False
         self.data = {}
+        self.selector = None
+
+    def subscribe(self, selector):
+        ''' Parse only the fields a selector subscribes to.
+
+            :param FieldSelector selector: field selector
+        '''
+        self.selector = selector
+        self.data = selector.record
+
+    def clear_data(self):
+        ''' Clear the data parsed from the last sentence '''
+        if self.selector is not None:
+            self.selector.reset()
+        else:
+            self.data.clear()
+
+    @property
+    def terminated(self):
+        ''' The last complete sentence, for passthrough '''
+        return bytes(self.tokenizer.sentence).decode("ascii", "ignore")
 
     def read(self):
-        ''' Read data from connection and set `more` attempt to decode data
-            as ascii.   Ignore data which cannot be decoded.
+        ''' Read data from connection and set `more` if there is data to
+            consume.
         '''
         data = self.conn.read()
-        if not data:
-            self.more = False
-            return
-        self.more = len(data) > 0
-        try:
-            self.unterminated += data.decode('ascii')
-        except UnicodeError:
-            pass
+        if self.pos < len(self.chunk):
+            data = self.chunk[self.pos:] + (data or b'')
+        self.chunk = data or b''
+        self.pos = 0
+        self.more = len(self.chunk) > 0
 
     def consume(self):
-        ''' Process data received from device and parse if via protocol '''
-        postfix = self.prot.spec.postfix
-
-        if self.unterminated.find(postfix) > -1:
-            self.terminated, self.unterminated = \
-                self.unterminated.split(postfix, 1)
+        ''' Tokenize data received from device up to the end of the next
+            sentence, and parse the sentence via protocol if it is valid.
+        '''
+        tokenizer = self.tokenizer
+        self.pos = tokenizer.feed(self.chunk, self.pos)
+        self.more = self.pos < len(self.chunk)
+        if not (tokenizer.ready and tokenizer.valid):
+            return
 
-        self.more = self.unterminated.count(postfix) > 0
+        prot = self.prot
+        if self.selector is not None:
+            delimiter = prot.spec.datafield_delimiter
+            prot.pkt_type = tokenizer.pkt_type(delimiter)
+            sentence = prot.route_path(prot)
+            if not self.selector.wants(sentence):
+                return
+            prot.load(tokenizer)
+            if prot.valid:
+                self.selector.parse(sentence, prot.datafields, delimiter)
+            return
 
-        self.prot(self.terminated + postfix)
+        self.prot.load(tokenizer)
         if self.prot.valid:
             self.prot.route()
             self.prot.parse()
@@ -208,8 +533,10 @@ class SimpleStream():
 
     def clear(self):
         ''' Reset stream state '''
-        self.unterminated = ''
-        self.terminated = ''
+        self.chunk = b''
+        self.pos = 0
         self.more = False
+        self.tokenizer.reset()
+        self.clear_data()
         if self.prot:
             self.prot.clear()
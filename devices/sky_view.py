@@ -0,0 +1,194 @@
+"""
+Sky View
+--------
+
+Satellite table assembled from GSV sentences.
+
+A receiver reports the satellites in view in a sequence of GSV sentences,
+up to four satellites per sentence, with each sentence carrying the number
+of sentences in the sequence and its own sequence number.  The table
+collects the PRN, elevation, azimuth and SNR of every satellite in a
+sequence and publishes the complete table when the last sentence arrives.
+A sequence with a missing sentence is dropped rather than published
+partly.
+
+Receivers tracking several constellations send a sequence per talker, e.g.
+GPGSV then GLGSV.  Each is merged into the epoch's table as it completes,
+and a new epoch starts with the first sequence of the talker which started
+the previous one.
+
+The table is held in fixed capacity arrays, one set being assembled while
+the other is published, and the assembled rows are copied over when a
+sequence completes, so nothing is allocated per epoch.  Fields a satellite
+doesn't report, e.g. the SNR of a satellite which isn't tracked, are 0.  A
+satellite with a field out of range, e.g. from a corrupted sentence, is
+skipped rather than stored.
+
+The summary statistics are meant to judge the sky early, before there is a
+fix: a few strong satellites predict a quick fix, while a sky without them
+after a minute or two is unlikely to produce one soon.
+"""
+from array import array
+
+
+class SkyView:
+    ''' Satellites in view, assembled from GSV sequences.
+
+        :param int capacity: most satellites kept per epoch
+        :ivar int count: satellites in the published table
+        :ivar int in_view: satellites in view reported by the receiver
+        :ivar int epochs: number of complete sequences published
+        :ivar int dropped: number of incomplete sequences dropped
+    '''
+
+    TOP = 4
+
+    def __init__(self, capacity=24):
+        self.capacity = capacity
+        self._tables = [self._table(capacity), self._table(capacity)]
+        self._top = array('B', [0] * self.TOP)
+        self.clear()
+
+    @staticmethod
+    def _table(capacity):
+        return (array('B', [0] * capacity), array('b', [0] * capacity),
+                array('H', [0] * capacity), array('B', [0] * capacity))
+
+    def clear(self):
+        ''' Forget the satellites, e.g. when the receiver is restarted '''
+        self.prn, self.elevation, self.azimuth, self.snr = self._tables[0]
+        self.count = 0
+        self.in_view = 0
+        self.epochs = 0
+        self.dropped = 0
+        self._count = 0
+        self._in_view = 0
+        self._next = 0
+        self._talker = None
+        self._epoch_talker = None
+
+    @staticmethod
+    def _field(data, start, delimiter):
+        ''' Integer value of the field starting at start, 0 if empty, and
+            the start of the next field, -1 after the last field.
+        '''
+        end = data.find(delimiter, start)
+        value = data[start:] if end < 0 else data[start:end]
+        try:
+            value = int(value)
+        except ValueError:
+            value = 0
+        return value, (-1 if end < 0 else end + 1)
+
+    def feed(self, datafields, talker="GP", delimiter=","):
+        ''' Add the satellites of a GSV sentence.
+
+            :param str datafields: data fields of the sentence
+            :param str talker: talker ID of the sentence, e.g. 'GP'
+            :param str delimiter: data field delimiter
+            :rtype: bool
+            :return: True if the sentence completed a sequence
+        '''
+        msgs, pos = self._field(datafields, 0, delimiter)
+        if pos < 0:
+            return False
+        seq, pos = self._field(datafields, pos, delimiter)
+        if pos < 0:
+            return False
+        in_view, pos = self._field(datafields, pos, delimiter)
+
+        if seq == 1:
+            if self._next:
+                self.dropped += 1
+            if talker == self._epoch_talker or self._epoch_talker is None:
+                # first sequence of a new epoch
+                self._epoch_talker = talker
+                self._count = 0
+                self._in_view = 0
+            self._talker = talker
+            self._next = 1
+            self._in_view += in_view
+        elif seq != self._next or talker != self._talker:
+            if self._next:
+                self.dropped += 1
+            self._next = 0
+            return False
+
+        prn, elevation, azimuth, snr = self._tables[1]
+        while pos >= 0 and self._count < self.capacity:
+            sat, pos = self._field(datafields, pos, delimiter)
+            elev, azim, level = 0, 0, 0
+            if pos >= 0:
+                elev, pos = self._field(datafields, pos, delimiter)
+            if pos >= 0:
+                azim, pos = self._field(datafields, pos, delimiter)
+            if pos >= 0:
+                level, pos = self._field(datafields, pos, delimiter)
+            if not (0 < sat <= 255 and -90 <= elev <= 90 and
+                    0 <= azim <= 360 and 0 <= level <= 99):
+                # empty slot, or a value the arrays can't hold
+                continue
+            idx = self._count
+            prn[idx], elevation[idx], azimuth[idx], snr[idx] = (
+                sat, elev, azim, level)
+            self._count += 1
+
+        if seq < msgs:
+            self._next = seq + 1
+            return False
+        self._next = 0
+        self._publish()
+        return True
+
+    def _publish(self):
+        for dst, src in zip(self._tables[0], self._tables[1]):
+            for idx in range(self._count):
+                dst[idx] = src[idx]
+        self.prn, self.elevation, self.azimuth, self.snr = self._tables[0]
+        self.count = self._count
+        self.in_view = self._in_view
+        self.epochs += 1
+
+    def tracked(self, min_snr=1):
+        ''' Number of satellites with an SNR of at least min_snr.
+
+            :param int min_snr: lowest SNR counted, dB-Hz
+            :rtype: int
+        '''
+        snr = self.snr
+        return sum(1 for idx in range(self.count) if snr[idx] >= min_snr)
+
+    def top_snr(self, n=TOP):
+        ''' Mean SNR of the n strongest satellites, untracked satellites
+            count as 0.
+
+            :param int n: number of satellites, at most `TOP`
+            :rtype: float
+        '''
+        top = self._top
+        n = min(n, len(top))
+        for idx in range(n):
+            top[idx] = 0
+        snr = self.snr
+        for idx in range(self.count):
+            value = snr[idx]
+            if value <= top[n - 1]:
+                continue
+            pos = n - 1
+            while pos > 0 and top[pos - 1] < value:
+                top[pos] = top[pos - 1]
+                pos -= 1
+            top[pos] = value
+        return sum(top[idx] for idx in range(n)) / n
+
+    def stats(self):
+        ''' Summary of the published table, for telemetry.
+
+            :rtype: dict
+            :return: {'in_view', 'tracked', 'top4', 'max'}
+        '''
+        return {
+            'in_view': self.in_view,
+            'tracked': self.tracked(),
+            'top4': round(self.top_snr(), 1),
+            'max': round(self.top_snr(1))}
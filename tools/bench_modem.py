@@ -0,0 +1,276 @@
+"""
+Modem Benchmark
+---------------
+
+CPython benchmark for the ISU line framing in `ModemController`.
+
+Recorded ISU traffic is replayed through the mock UART in UART sized chunks
+and framed by the ring buffer reader, which reads straight from the UART into
+the ring ("ring"), the same reader filled from the bytes object returned by
+`UART.read` ("copy"), and the previous implementation, which accumulated
+bytes and re-decoded and re-split the whole buffer on every read ("legacy").
+
+On CPython the legacy reader's decode/replace/split run as C string
+operations and win on wall time; the numbers of interest for the ESP32 are
+the per-read costs that scale with the buffered partial line (the SBDRT
+drip scenario) and the heap allocations, which fragment the MicroPython
+heap and trigger collections.
+
+Allocations are measured in a separate pass with `tools.bench_replay`'s
+`AllocMeter`, per call to read: `gc.mem_alloc` deltas on MicroPython, and
+the tracemalloc peak above the starting size on CPython, which is a lower
+bound as allocations freed within a read are not all counted.  A second
+pass meters only `fill`, the move from the UART into the ring, per UART
+read.  CPython's object sizes differ a lot from MicroPython's: a memoryview
+slice is 184 bytes against one 16 byte heap block, and integers above 256
+are allocated rather than tagged, so the fill figures only compare like
+with like on the target.
+
+Run from the repository root:
+
+    python -m tools.bench_modem [repeats]
+"""
+import contextlib
+import io
+import random
+import sys
+import time
+
+from core.mock_machine import UART
+from devices.modem import ModemController
+from devices.rockblock import RockBlock
+from tools.bench_replay import AllocMeter
+
+
+#: ISU traffic captured with echo on during a CIEV flood and an SBDIX session
+ISU_TRACE = (
+    b"AT+CIER=1,1,1,1\r\r\nOK\r\n"
+    b"+CIEV:1,1\r\n"
+    b"+CIEV:0,0\r\n"
+    b"+CIEV:3,1,34,0,-1460,4200,5020\r\n"
+    b"+CIEV:0,1\r\n"
+    b"+CIEV:0,2\r\n"
+    b"+CIEV:0,3\r\n"
+    b"+CIEV:0,2\r\n"
+    b"+CIEV:3,1,35,0,-1380,4270,5010\r\n"
+    b"+CIEV:0,4\r\n"
+    b"+CIEV:0,5\r\n"
+    b"AT+SBDSX\r\r\n+SBDSX: 1, 12, 0, 3, 0, 0\r\n\r\nOK\r\n"
+    b"AT+SBDIX\r\r\n"
+    b"+CIEV:0,4\r\n"
+    b"+CIEV:0,5\r\n"
+    b"+SBDIX: 0, 13, 0, 3, 0, 0\r\n\r\nOK\r\n"
+    b"+CIEV:0,3\r\n"
+    b"AT+SBDD0\r\r\n0\r\n\r\nOK\r\n"
+    b"-MSGEO: -2704,-4351,3788,9e0e5aad\r\n\r\nOK\r\n"
+    b"+AREG:0,0\r\n"
+    b"+SBDRING\r\n"
+    b"AT+SBDRT\r\r\n+SBDRT:\r\n+DATA:PK006,15;PK005,0\r\nOK\r\n"
+)
+
+
+class LegacyModem(ModemController):
+    ''' The previous accumulate, decode and split reader, kept for
+        comparison.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.unterminated = b''
+
+    def read(self):
+        val = self.raw_read()
+
+        if val is None:
+            return ""
+        for i, b in enumerate(val):
+            if b > 127:
+                break
+        else:
+            i = len(val)
+        val = val[0:i]
+
+        try:
+            val.decode('ascii')
+            self.unterminated += val
+        except UnicodeError:
+            pass
+
+        items = self.unterminated.decode("ascii").replace(
+            "\n", "\r").split("\r")
+
+        if len(items) > 1:
+            self.unterminated = items[-1].encode("ascii")
+            return [item for item in items[:-1] if item != '']
+        else:
+            return ""
+
+
+class CopyModem(ModemController):
+    ''' The ring buffer reader filled from a bytes object returned by the
+        UART, as it was before `fill` read straight into the ring.
+    '''
+
+    def fill(self):
+        val = self.raw_read()
+        if val:
+            self.rx.write(val)
+            return True
+        return False
+
+
+#: A full 270 byte MT message read back with SBDRT, which arrives over many
+#: UART reads while the partial line sits in the buffer
+SBDRT_TRACE = (
+    b"AT+SBDRT\r\r\n+SBDRT:\r\n+DATA:" + b"PK006,15;" * 29 + b"\r\nOK\r\n")
+
+
+def chunks(trace, repeats, seed=0, max_read=64):
+    ''' Split repeats of the trace into randomly sized UART reads '''
+    rnd = random.Random(seed)
+    data = trace * repeats
+    out = []
+    i = 0
+    while i < len(data):
+        n = rnd.randint(1, max_read)
+        out.append(data[i:i + n])
+        i += n
+    return out
+
+
+class BenchUART(UART):
+    ''' The mock UART with the allocation behaviour of the MicroPython
+        driver: `read` returns a new bytes object of everything pending and
+        `readinto` copies into the caller's buffer without allocating.
+        Pending bytes are held in a bytearray filled with `feed`, outside
+        the metered reads.
+    '''
+
+    EMPTY = bytearray()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._readbuf = self.EMPTY
+
+    def feed(self, chunk):
+        self._readbuf = self._readbuf + chunk
+
+    def read(self):
+        if not self._readbuf:
+            return None
+        out = bytes(self._readbuf)
+        self._readbuf = self.EMPTY
+        return out
+
+    def readinto(self, buf, nbytes=None):
+        pending = self._readbuf
+        n = len(buf) if nbytes is None else min(nbytes, len(buf))
+        n = min(n, len(pending))
+        if n == 0:
+            return None
+        if n == len(pending):
+            buf[0:n] = pending
+            self._readbuf = self.EMPTY
+        else:
+            # only when the ring is short of space, slicing costs the mock
+            buf[0:n] = pending[:n]
+            self._readbuf = pending[n:]
+        return n
+
+
+def attach(modem):
+    modem.conn = BenchUART(1, 19200)
+    modem.conn_type = 'u'
+    return modem
+
+
+def bench_read(modem, reads):
+    ''' Time framing every chunk with modem.read()
+
+        :rtype: tuple
+        :return: (seconds, lines framed)
+    '''
+    uart = modem.conn
+    lines = 0
+    start = time.perf_counter()
+    for chunk in reads:
+        uart.feed(chunk)
+        lines += len(modem.read())
+    return time.perf_counter() - start, lines
+
+
+def bench_alloc(modem, reads):
+    ''' Measure the bytes allocated framing every chunk with modem.read()
+
+        :rtype: tuple
+        :return: (bytes allocated, method)
+    '''
+    uart = modem.conn
+    meter = AllocMeter()
+    for chunk in reads:
+        uart.feed(chunk)
+        meter.begin()
+        modem.read()
+        meter.end()
+    meter.stop()
+    return meter.total, meter.method
+
+
+def bench_fill(modem, reads):
+    ''' Measure the bytes allocated moving each chunk from the UART into
+        the receive buffer with modem.fill(), without framing the lines.
+
+        :rtype: tuple
+        :return: (bytes allocated, method)
+    '''
+    uart = modem.conn
+    meter = AllocMeter()
+    for chunk in reads:
+        uart.feed(chunk)
+        meter.begin()
+        modem.fill()
+        meter.end()
+        modem.rx.clear()
+    meter.stop()
+    return meter.total, meter.method
+
+
+def bench_rockblock(reads):
+    ''' Time RockBlock.read_from_device routing the same traffic '''
+    rb = attach(RockBlock())
+    uart = rb.conn
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for chunk in reads:
+            uart.feed(chunk)
+            rb.read_from_device()
+    return time.perf_counter() - start
+
+
+def main(repeats=200):
+    scenarios = (
+        ("CIEV flood", chunks(ISU_TRACE, repeats)),
+        ("CIEV flood, 8 reads per loop", chunks(ISU_TRACE, repeats, 0, 512)),
+        ("SBDRT drip", chunks(SBDRT_TRACE, repeats // 4, 0, 4)),
+    )
+    for title, reads in scenarios:
+        total = sum(len(r) for r in reads)
+        print("{}: {} bytes in {} reads".format(title, total, len(reads)))
+        for name, cls in (("legacy", LegacyModem), ("copy", CopyModem),
+                          ("ring", ModemController)):
+            elapsed, lines = bench_read(attach(cls()), reads)
+            alloc, method = bench_alloc(attach(cls()), reads)
+            print("  {:7} {:8.1f} us/line {:9.0f} kB/s {:8.0f} B/line "
+                  "({} lines, {})".format(
+                      name, 1e6 * elapsed / lines, total / elapsed / 1000,
+                      alloc / lines, lines, method))
+        for name, cls in (("copy", CopyModem), ("ring", ModemController)):
+            alloc, method = bench_fill(attach(cls()), reads)
+            print("  {:7} fill {:6.0f} B/read".format(name, alloc / len(reads)))
+
+    elapsed = bench_rockblock(chunks(ISU_TRACE, repeats))
+    print("RockBlock.read_from_device: {:.1f} ms".format(elapsed * 1000))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,236 @@
+"""
+NMEA Benchmark
+--------------
+
+CPython micro-benchmarks for NMEA checksums, packet construction and
+sentence tokenizing in `devices.serialprotocols`, each against the
+previous implementation:
+
+- checksum: per character encode/ord XOR over a str, against a XOR over
+  bytes
+- packets: string concatenation with a str checksum, against filling the
+  protocol's reusable packet buffer
+- stream: the decode, find/split/count and partition stream, against the
+  single pass byte tokenizer, and against the tokenizer with the GPS
+  driver's field selector
+
+As with `tools.bench_modem`, CPython runs the legacy string operations in C,
+so wall times understate the difference on the ESP32, where the numbers of
+interest are the temporary strings created per byte and per sentence.  The
+bytes allocated per packet are also measured, with `tools.bench_replay`'s
+`AllocMeter`.
+
+Run from the repository root:
+
+    python -m tools.bench_nmea [repeats]
+"""
+import random
+import sys
+import time
+
+from devices.mtk_nmea import NMEAProtocol
+from devices.gps import GPS
+from devices.nmea_parsers import FieldSelector, MTK_PARSERS
+from devices.serialprotocols import (
+    SimpleSerialProtocol,
+    SimpleStream,
+    nmea_checksum,
+)
+from tools.bench_replay import AllocMeter
+
+
+#: One second of MTK output with the default sentences enabled
+GPS_TRACE = (
+    b"$GPGGA,064951.000,2307.1256,N,12016.4438,E,1,8,0.95,39.9,M,17.8,M,,"
+    b"*63\r\n"
+    b"$GPGSA,A,3,29,21,26,15,18,09,06,10,,,,,2.32,0.95,2.11*00\r\n"
+    b"$GPGSV,3,1,09,29,36,029,42,21,46,314,43,26,44,020,43,15,21,321,39"
+    b"*7D\r\n"
+    b"$GPGSV,3,2,09,18,26,314,40,09,57,170,44,06,20,229,37,10,26,084,37"
+    b"*77\r\n"
+    b"$GPGSV,3,3,09,07,,,26*73\r\n"
+    b"$GPRMC,064951.000,A,2307.1256,N,12016.4438,E,0.03,165.48,260406,3.05,"
+    b"W,A*2C\r\n"
+    b"$GPVTG,165.48,T,,M,0.03,N,0.06,K,A*36\r\n"
+)
+
+
+def legacy_crc(chksum_data):
+    crc = 0
+    for _char in chksum_data:
+        try:
+            crc = crc ^ ord(_char.encode("ascii"))
+        except Exception:
+            return "00"
+    return "{:02X}".format(crc)
+
+
+def legacy_packet(talker_id, pkt_type, data_field=None):
+    if data_field is None:
+        value = pkt_type
+    else:
+        value = pkt_type + "," + data_field
+    return "$" + talker_id + value + "*" + legacy_crc(
+        talker_id + value) + "\r\n"
+
+
+class LegacyStream(SimpleStream):
+    ''' The previous decode, find and split stream, kept for comparison '''
+
+    def __init__(self, connection, protocol):
+        super().__init__(connection, protocol)
+        self.unterminated = ''
+        self.last = ''
+
+    def read(self):
+        data = self.conn.read()
+        if not data:
+            self.more = False
+            return
+        self.more = len(data) > 0
+        try:
+            self.unterminated += data.decode('ascii')
+        except UnicodeError:
+            pass
+
+    def consume(self):
+        postfix = self.prot.spec.postfix
+        if self.unterminated.find(postfix) > -1:
+            self.last, self.unterminated = \
+                self.unterminated.split(postfix, 1)
+        self.more = self.unterminated.count(postfix) > 0
+        self.prot(self.last + postfix)
+        if self.prot.valid:
+            self.prot.route()
+            self.prot.parse()
+            self.data.update(self.prot.data)
+
+
+class Reads:
+    ''' Connection returning prepared chunks '''
+
+    def __init__(self, reads):
+        self.reads = list(reads)
+        self.reads.reverse()
+
+    def read(self):
+        return self.reads.pop() if self.reads else None
+
+
+def chunks(trace, repeats, seed=0, max_read=64):
+    rnd = random.Random(seed)
+    data = trace * repeats
+    out = []
+    i = 0
+    while i < len(data):
+        n = rnd.randint(1, max_read)
+        out.append(data[i:i + n])
+        i += n
+    return out
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def bench_checksum(repeats):
+    bodies = [line[1:line.index(b"*")] for line in GPS_TRACE.split(b"\r\n")
+              if line]
+    strs = [body.decode("ascii") for body in bodies]
+    mvs = [memoryview(body) for body in bodies]
+    n = repeats * len(bodies)
+
+    def legacy():
+        for _ in range(repeats):
+            for body in strs:
+                legacy_crc(body)
+
+    def current():
+        for _ in range(repeats):
+            for body in mvs:
+                nmea_checksum(body)
+
+    return n, timed(legacy), timed(current)
+
+
+#: Packets sent to the GPS and built for reports
+PACKETS = (
+    ("PMTK", "220", "1000"),
+    ("PMTK", "314", "0,1,0,1,1,0,0,0,0,0,0,0,0,0,0,0,0,0,0"),
+    ("PK", "004", "4124.8963,N,08151.6838,W,0.03,165.48,064951.000,01"),
+)
+
+
+def alloc_packets(repeats):
+    ''' Bytes allocated per packet built, legacy and current '''
+    prot = SimpleSerialProtocol(NMEAProtocol)
+    results = []
+    for build in (legacy_packet, prot.packet_into):
+        meter = AllocMeter()
+        for _ in range(repeats):
+            for args in PACKETS:
+                meter.begin()
+                build(*args)
+                meter.end()
+        meter.stop()
+        results.append(meter.total / (repeats * len(PACKETS)))
+    return results, meter.method
+
+
+def bench_packets(repeats):
+    prot = SimpleSerialProtocol(NMEAProtocol)
+    packets = PACKETS
+
+    def legacy():
+        for _ in range(repeats):
+            for args in packets:
+                legacy_packet(*args)
+
+    def current():
+        for _ in range(repeats):
+            for args in packets:
+                prot.packet_into(*args)
+
+    return repeats * len(packets), timed(legacy), timed(current)
+
+
+def run_stream(cls, reads, fields=None):
+    prot = SimpleSerialProtocol(NMEAProtocol, parser_lut=MTK_PARSERS)
+    prot.set_router(lambda: (lambda p: p.pkt_type.lower()[2:]))
+    stream = cls(Reads(reads), prot)
+    if fields:
+        stream.subscribe(FieldSelector(fields))
+    for _ in reads:
+        stream.read()
+        while stream.more:
+            stream.consume()
+
+
+def bench_stream(repeats):
+    reads = chunks(GPS_TRACE, repeats)
+    sentences = GPS_TRACE.count(b"$") * repeats
+    fields = GPS.location_attrs + GPS.signal_attrs + GPS.course_atts
+    return (sentences, timed(run_stream, LegacyStream, reads),
+            timed(run_stream, SimpleStream, reads),
+            timed(run_stream, SimpleStream, reads, fields))
+
+
+def main(repeats=2000):
+    for title, bench, unit in (("checksum", bench_checksum, "sentence"),
+                               ("packets", bench_packets, "packet"),
+                               ("stream", bench_stream, "sentence")):
+        n, *times = bench(repeats)
+        print("{}: {} {}s".format(title, n, unit))
+        for name, elapsed in zip(("legacy", "current", "fields"), times):
+            print("  {:8} {:6.2f} us/{}".format(
+                name, 1e6 * elapsed / n, unit))
+
+    (legacy, current), method = alloc_packets(repeats // 10 or 1)
+    print("packet allocations ({}): legacy {:.0f} B/packet, current {:.0f} "
+          "B/packet".format(method, legacy, current))
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
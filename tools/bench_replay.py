@@ -0,0 +1,230 @@
+"""
+Replay Benchmark
+----------------
+
+Benchmarks the GPS and RockBlock drivers end to end by replaying UART
+traces through them with `tools.replay`, so a parser change can be judged
+before it is flashed.
+
+Reported per trace:
+
+- sentences (or lines) handled per second of CPU time spent in the
+  driver's `run`
+- bytes allocated per sentence, and per call to `run`, which includes
+  idle polls: `gc.mem_alloc` deltas on MicroPython; on CPython, where
+  allocations which are freed again can't be counted, the tracemalloc
+  peak above the starting size of each `run` call, summed
+- latency from the oldest bytes delivered to the UART to the fix update
+  they produce, in simulated time, as set by the poll period, and the CPU
+  time of the `run` call which made the update
+
+Without trace files, synthetic traces are generated: an hour of MTK output
+with the default sentences, or with the 'buoy-report' profile, and an hour
+of ISU indicator events, ring alerts and session results.
+
+Run from the repository root:
+
+    python -m tools.bench_replay [gps_trace] [isu_trace]
+"""
+import contextlib
+import gc
+import io
+import sys
+import time
+
+from devices.serialprotocols import nmea_checksum
+from tools.replay import (
+    load_trace,
+    replay_gps,
+    replay_isu,
+)
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def sentence(body):
+    return b"$" + body + b"*%02X\r\n" % nmea_checksum(body)
+
+
+def gps_epoch(second, profile=None):
+    ''' One second of MTK output, the position drifting north east. '''
+    utc = "{:02d}{:02d}{:02d}.000".format(
+        12 + second // 3600, second // 60 % 60, second % 60)
+    lat = "2307.{:04d}".format(1256 + second % 1000)
+    lon = "12016.{:04d}".format(4438 + second % 1000)
+    out = [sentence("GPGGA,{},{},N,{},E,1,8,0.95,39.9,M,17.8,M,,".format(
+        utc, lat, lon).encode())]
+    out.append(sentence(
+        b"GPGSA,A,3,29,21,26,15,18,09,06,10,,,,,2.32,0.95,2.11"))
+    if profile is None or second % 5 == 0:
+        out.append(sentence(b"GPGSV,3,1,09,29,36,029,42,21,46,314,43,26,44,"
+                            b"020,43,15,21,321,39"))
+        out.append(sentence(b"GPGSV,3,2,09,18,26,314,40,09,57,170,44,06,20,"
+                            b"229,37,10,26,084,37"))
+        out.append(sentence(b"GPGSV,3,3,09,07,,,26"))
+    out.append(sentence("GPRMC,{},A,{},N,{},E,0.03,165.48,260406,3.05,W,A"
+                        .format(utc, lat, lon).encode()))
+    if profile is None:
+        out.append(sentence(b"GPVTG,165.48,T,,M,0.03,N,0.06,K,A"))
+    return b"".join(out)
+
+
+def synth_gps(seconds=3600, profile=None, baudrate=9600, chunk=64):
+    ''' MTK output as it arrives at the UART, each epoch starting on the
+        second.
+
+        :param str profile: None for the default sentences, otherwise the
+            'buoy-report' sentences
+        :rtype: list
+        :return: [(seconds, bytes), ...]
+    '''
+    byte_time = 10 / baudrate
+    trace = []
+    for second in range(seconds):
+        raw = gps_epoch(second, profile)
+        for pos in range(0, len(raw), chunk):
+            end = min(pos + chunk, len(raw))
+            trace.append((second + end * byte_time, raw[pos:end]))
+    return trace
+
+
+def synth_isu(seconds=3600):
+    ''' ISU unsolicited results and session responses, once a minute.
+
+        :rtype: list
+        :return: [(seconds, bytes), ...]
+    '''
+    trace = []
+    for minute in range(seconds // 60):
+        t = minute * 60
+        trace.append((t, "+CIEV:0,{}\r\n".format(minute % 6).encode()))
+        trace.append((t + 1, "+CIEV:3,{},{},0,{},0,{}\r\n".format(
+            minute % 66, minute % 48, 1000 + minute, 6000 - minute).encode()))
+        if minute % 10 == 0:
+            trace.append((t + 5, b"SBDRING\r\n"))
+            trace.append((t + 9, b"+SBDIX: 0, 12, 1, 3, 42, 0\r\n\r\nOK\r\n"))
+        if minute % 30 == 0:
+            trace.append((t + 20, b"+AREG:5,0\r\n"))
+    return trace
+
+
+class AllocMeter:
+    ''' Bytes allocated by the driver's `run` calls. '''
+
+    def __init__(self):
+        self.total = 0
+        self.mem_alloc = getattr(gc, 'mem_alloc', None)
+        self.base = 0
+        if self.mem_alloc is None and tracemalloc is not None:
+            tracemalloc.start()
+
+    @property
+    def method(self):
+        return "mem_alloc" if self.mem_alloc else "tracemalloc peak"
+
+    def begin(self):
+        if self.mem_alloc:
+            self.base = self.mem_alloc()
+        elif tracemalloc is not None:
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+
+    def end(self):
+        if self.mem_alloc:
+            used = self.mem_alloc() - self.base
+        elif tracemalloc is not None:
+            used = tracemalloc.get_traced_memory()[1] - self.base
+        else:
+            used = 0
+        # a negative delta means a collection ran
+        self.total += max(used, 0)
+
+    def stop(self):
+        if self.mem_alloc is None and tracemalloc is not None:
+            tracemalloc.stop()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def bench(replay, trace, period=0.1, track=None):
+    ''' Replay a trace, timing and metering each call to the driver's run.
+
+        :param replay: `replay_gps` or `replay_isu`
+        :param track: function of the driver returning the value whose
+            changes are timed for latency, e.g. the fix time
+        :rtype: dict
+    '''
+    meter = AllocMeter()
+    state = {'cpu': 0., 'start': 0., 'last': None, 'latency': [],
+             'cpu_latency': [], 'runs': 0}
+
+    def before(driver, uart_replay):
+        state['runs'] += 1
+        if track is not None and state['runs'] == 1:
+            state['last'] = track(driver)
+        meter.begin()
+        state['start'] = time.perf_counter()
+
+    def after(driver, uart_replay):
+        cpu = time.perf_counter() - state['start']
+        state['cpu'] += cpu
+        meter.end()
+        if track is None:
+            return
+        value = track(driver)
+        if value != state['last']:
+            state['last'] = value
+            elapsed = uart_replay.clock.time() - uart_replay.start
+            state['latency'].append(elapsed - uart_replay.arrived)
+            state['cpu_latency'].append(cpu)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        r = replay(trace, period=period, before=before, after=after)
+    meter.stop()
+    count = r.get('sentences', r.get('lines'))
+    return {
+        'count': count,
+        'per_sec': count / state['cpu'] if state['cpu'] else 0,
+        'alloc': meter.total / count if count else 0,
+        'run_alloc': meter.total / state['runs'] if state['runs'] else 0,
+        'method': meter.method,
+        'updates': len(state['latency']),
+        'p50': percentile(state['latency'], 50) * 1000,
+        'p95': percentile(state['latency'], 95) * 1000,
+        'cpu_p50': percentile(state['cpu_latency'], 50) * 1e6,
+    }
+
+
+def report(title, r, unit="sentences"):
+    print("{}: {count} {}".format(title, unit, **r))
+    print("  {per_sec:.0f} {}/s, {alloc:.0f} bytes/{}, {run_alloc:.0f} "
+          "bytes/run ({method})".format(unit, unit[:-1], **r))
+    if r['updates']:
+        print("  fix latency p50 {p50:.0f} ms p95 {p95:.0f} ms, "
+              "run {cpu_p50:.0f} us".format(**r))
+
+
+def main(gps_path=None, isu_path=None):
+    fix_time = lambda gps: gps.fix.utc  # noqa: E731
+    if gps_path:
+        traces = ((gps_path, load_trace(gps_path, 9600)),)
+    else:
+        traces = (("gps default sentences", synth_gps()),
+                  ("gps buoy-report", synth_gps(profile='buoy-report')))
+    for title, trace in traces:
+        report(title, bench(replay_gps, trace, track=fix_time))
+
+    trace = load_trace(isu_path, 19200) if isu_path else synth_isu()
+    report(isu_path or "isu events", bench(replay_isu, trace), "lines")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,150 @@
+"""
+RockBlock Benchmark
+-------------------
+
+Runs the RockBlock driver against the simulated ISU in `core.mock_isu` under
+an accelerated clock, to measure how driver changes affect delivery.
+
+Position reports are queued at a fixed interval.  The driver is powered up
+when it has work and powered down when it is idle, as the buoy app does,
+and `RockBlock.run` (which checks the SBD session) is called every loop
+tick.  Hours of simulated time run in a few seconds.  Once the reports stop,
+the driver runs on for up to `DRAIN` seconds to finish the messages it is
+still sending, so a message in flight at the end isn't counted as lost.
+
+Reported per scenario:
+
+- messages delivered per hour, still pending at the end, and lost, i.e.
+  neither delivered nor held by the driver
+- queue to delivery latency, median and 95th percentile
+- modem on seconds, and on seconds per delivered message
+- SBDIX sessions attempted and failed
+
+Run from the repository root:
+
+    python -m tools.bench_rockblock [hours]
+"""
+import contextlib
+import io
+import sys
+
+from core.mock_isu import (
+    EnablePin,
+    MockISU,
+    SimClock,
+)
+from devices import sbd_codec
+from devices.rockblock import RockBlock
+
+
+#: Loop period of the driver, seconds of simulated time
+TICK = 0.1
+
+#: Most seconds the driver runs after the last report to finish sending
+DRAIN = 3600
+
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def unpack(payload):
+    ''' Messages in a delivered MO payload '''
+    try:
+        text = payload.decode("ascii")
+    except UnicodeError:
+        return [bytes(m) for m in sbd_codec.unpack_messages(payload)]
+    if text.startswith(sbd_codec.TEXT_FRAME):
+        return sbd_codec.unpack_text(text)
+    return [text]
+
+
+def run(hours=6, report_period=300, seed=0, sv_reports=False, **isu_args):
+    ''' Simulate the driver for hours of constellation time.
+
+        :param int report_period: seconds between queued reports
+        :param bool sv_reports: request satellite beam position reports
+        :rtype: dict
+        :return: benchmark results
+    '''
+    clock = SimClock(1000)
+    isu = MockISU(clock, seed=seed, **isu_args)
+    rb = RockBlock(clock=clock)
+    rb.sv_reports = sv_reports
+    rb.en = EnablePin(clock, isu)
+    rb.conn = isu
+    rb.conn_type = 'u'
+
+    queued = {}
+    seq = 0
+    end = clock.time() + hours * 3600
+    next_report = clock.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while clock.time() < end or (
+                clock.time() < end + DRAIN and
+                (rb.en() or rb.messages or rb.wait)):
+            now = clock.time()
+            if now < end and now >= next_report:
+                msg = "PK001;seq:{:05d}".format(seq)
+                queued[msg] = now
+                rb.queue_message(msg)
+                seq += 1
+                next_report += report_period
+
+            if not rb.en():
+                if rb.messages or rb.wait:
+                    rb.start()
+            else:
+                rb.run()
+                if not rb.wait and not rb.session and not rb.commands.busy:
+                    rb.stop()
+            clock.advance(TICK)
+        rb.stop()
+
+    latencies = []
+    for when, payload in isu.delivered:
+        for msg in unpack(payload):
+            if msg in queued:
+                latencies.append(when - queued.pop(msg))
+
+    delivered = len(latencies)
+    pending = len(rb.messages) + len(rb.outbox or ())
+    return {
+        'queued': seq,
+        'delivered': delivered,
+        'pending': pending,
+        'lost': seq - delivered - pending,
+        'per_hour': delivered / hours,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'on_time': rb.en.on_time,
+        'on_per_msg': rb.en.on_time / delivered if delivered else 0,
+        'power_ups': rb.en.power_ups,
+        'sessions': isu.sessions,
+        'failed': isu.failed,
+    }
+
+
+def main(hours=6):
+    scenarios = (
+        ("satellite passes", {}),
+        ("satellite passes, beam positions", {'sv_reports': True}),
+        ("good sky", {'csq_trace': [(3600, 5)]}),
+        ("obstructed", {'csq_trace': [(240, 1), (60, 4), (300, 0)]}),
+        ("report every 60s", {'report_period': 60}),
+    )
+    for title, args in scenarios:
+        r = run(hours, **args)
+        print("{}: {delivered}/{queued} delivered, {pending} pending, "
+              "{lost} lost, {per_hour:.1f}/h".format(title, **r))
+        print("  latency p50 {p50:.0f}s p95 {p95:.0f}s".format(**r))
+        print("  modem on {on_time:.0f}s, {on_per_msg:.1f}s/msg, "
+              "{power_ups} power ups".format(**r))
+        print("  sessions {sessions}, failed {failed}".format(**r))
+
+
+if __name__ == "__main__":
+    main(*[float(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,286 @@
+"""
+UART Replay
+-----------
+
+Replays recorded UART captures through the GPS and RockBlock drivers off
+device, using the `core.mock_machine.UART` buffers as the connection.
+
+A trace is a list of (seconds, bytes) chunks, the time each chunk arrived
+at the UART.  Two capture formats are read:
+
+- raw: the bytes as received, e.g. ``cat /dev/ttyUSB0 > gps.raw``.  Chunk
+  times, when the chunk's last byte arrives, are derived from the baud
+  rate, 10 bits per byte, in chunks of `CHUNK` bytes.
+- timestamped: a ``#trace`` header line, then one chunk per line, as
+  ``<seconds> <hex bytes>``, as written by `save_trace`.
+
+The drivers run on a `SimClock` which is advanced by the poll period
+between calls to their `run` methods, so timers and timeouts behave as on
+the device.  Chunks are written into the UART's receive buffer when the
+simulated clock reaches them.  With a speed-up, the replay also waits in
+real time, e.g. a speed-up of 10 replays a minute of capture in 6 seconds;
+without one it runs as fast as the drivers allow.  Once the last chunk is
+delivered the drivers run for at most `drain` more simulated seconds to
+read what is still buffered, so a driver which stops reading, e.g. one
+powered down by its own timeout, can't stall the replay.
+
+.. code-block:: python
+
+    trace = load_trace("gps.raw", baudrate=9600)
+    result = replay_gps(trace)
+    print(result['fixes'])
+
+Run from the repository root:
+
+    python -m tools.replay gps|isu trace [speedup]
+"""
+import binascii
+import sys
+import time
+
+from core.mock_isu import EnablePin, SimClock
+from core.mock_machine import UART
+from devices.gps import GPS
+from devices.rockblock import RockBlock
+
+
+#: Bytes per chunk of a raw capture
+CHUNK = 64
+
+#: Header line of a timestamped capture
+HEADER = b"#trace"
+
+#: Simulated seconds the drivers run after the last chunk is delivered
+DRAIN = 10
+
+#: Printed when the command line is wrong
+USAGE = "usage: python -m tools.replay gps|isu trace [speedup]"
+
+
+def load_trace(path, baudrate=9600, chunk=CHUNK):
+    ''' Read a capture file.
+
+        :param str path: raw or timestamped capture
+        :param int baudrate: baud rate of a raw capture
+        :param int chunk: bytes per chunk of a raw capture
+        :rtype: list
+        :return: [(seconds, bytes), ...]
+    '''
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if not raw.startswith(HEADER):
+        return raw_trace(raw, baudrate, chunk)
+    trace = []
+    for line in raw.splitlines()[1:]:
+        if not line.strip():
+            continue
+        when, data = line.split(None, 1)
+        trace.append((float(when), binascii.unhexlify(data.strip())))
+    return trace
+
+
+def raw_trace(raw, baudrate=9600, chunk=CHUNK):
+    ''' Split raw bytes into chunks timed by the baud rate.
+
+        :param bytes raw: bytes as received
+        :rtype: list
+        :return: [(seconds, bytes), ...]
+    '''
+    byte_time = 10 / baudrate
+    return [(min(pos + chunk, len(raw)) * byte_time, raw[pos:pos + chunk])
+            for pos in range(0, len(raw), chunk)]
+
+
+def save_trace(path, trace):
+    ''' Write a trace as a timestamped capture.
+
+        :param str path: file to write
+        :param list trace: [(seconds, bytes), ...]
+    '''
+    with open(path, 'wb') as f:
+        f.write(HEADER + b"\n")
+        for when, data in trace:
+            f.write("{:.6f} ".format(when).encode("ascii"))
+            f.write(binascii.hexlify(data) + b"\n")
+
+
+class UARTReplay:
+    ''' Writes the chunks of a trace into a UART's receive buffer as the
+        clock reaches them.
+
+        :param UART uart: mock UART the driver reads from
+        :param list trace: [(seconds, bytes), ...]
+        :param clock: object with a time method
+        :param float speedup: replay speed against real time, None to run
+            as fast as possible
+        :ivar int size: bytes delivered by the last `feed`
+        :ivar float arrived: trace time of the first chunk delivered by the
+            last `feed`, the oldest bytes the driver has to handle
+        :ivar float finished: clock time the last chunk was delivered
+    '''
+
+    def __init__(self, uart, trace, clock, speedup=None):
+        self.uart = uart
+        self.trace = trace
+        self.clock = clock
+        self.speedup = speedup
+        self.start = clock.time()
+        self.wall = time.monotonic()
+        self.idx = 0
+        self.size = 0
+        self.arrived = 0
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.idx >= len(self.trace)
+
+    def running(self, drain=DRAIN):
+        ''' Check if the replay should go on: chunks are still to be
+            delivered, or delivered bytes are unread and the last chunk
+            was delivered less than drain seconds ago.
+
+            :param float drain: simulated seconds to wait for the driver to
+                read the bytes left in the UART
+            :rtype: bool
+        '''
+        if not self.done:
+            return True
+        if self.finished is None:
+            self.finished = self.clock.time()
+        return (bool(self.uart.any()) and
+                self.clock.time() - self.finished < drain)
+
+    def feed(self):
+        ''' Deliver the chunks which have arrived by now.
+
+            :rtype: int
+            :return: number of bytes delivered
+        '''
+        elapsed = self.clock.time() - self.start
+        if self.speedup:
+            ahead = elapsed / self.speedup - (time.monotonic() - self.wall)
+            if ahead > 0:
+                time.sleep(ahead)
+        size = 0
+        trace = self.trace
+        while self.idx < len(trace) and trace[self.idx][0] <= elapsed:
+            when, data = trace[self.idx]
+            if not size:
+                self.arrived = when
+            self.uart._readbuf += data
+            size += len(data)
+            self.idx += 1
+        # the drivers' writes aren't replayed, don't let them pile up
+        self.uart._writebuf = b""
+        self.size = size
+        return size
+
+
+def replay_gps(trace, speedup=None, period=0.1, before=None, after=None,
+               drain=DRAIN):
+    ''' Replay a GPS capture through `GPS`.
+
+        :param list trace: [(seconds, bytes), ...]
+        :param float speedup: replay speed, None to run as fast as possible
+        :param float period: seconds between calls to `GPS.run`
+        :param before: called with the driver and the `UARTReplay` before
+            each call to `GPS.run`
+        :param after: called the same way after each call
+        :param float drain: simulated seconds to run after the last chunk
+        :rtype: dict
+        :return: {'sentences', 'fixes', 'unread', 'gps'}
+    '''
+    clock = SimClock(1000)
+    uart = UART(1, 9600)
+    gps = GPS(clock=clock)
+    gps.connect({'en': EnablePin(clock), 'conn': uart})
+    gps.start()
+    replay = UARTReplay(uart, trace, clock, speedup)
+
+    fixes = 0
+    utc = gps.fix.utc
+    while replay.running(drain):
+        replay.feed()
+        if before:
+            before(gps, replay)
+        gps.run()
+        if after:
+            after(gps, replay)
+        if gps.fix.utc != utc:
+            utc = gps.fix.utc
+            fixes += 1
+        clock.advance(period)
+    return {
+        'sentences': sum(data.count(b"\n") for _, data in trace),
+        'fixes': fixes,
+        'unread': uart.any(),
+        'gps': gps,
+    }
+
+
+def replay_isu(trace, speedup=None, period=0.1, before=None, after=None,
+               drain=DRAIN):
+    ''' Replay an ISU capture through `RockBlock`.  The driver's commands
+        aren't answered by the trace, so commands it issues time out, but
+        every response and unsolicited result is handled as on the device.
+
+        :param list trace: [(seconds, bytes), ...]
+        :param float speedup: replay speed, None to run as fast as possible
+        :param float period: seconds between calls to `RockBlock.run`
+        :param before: called with the driver and the `UARTReplay` before
+            each call to `RockBlock.run`
+        :param after: called the same way after each call
+        :param float drain: simulated seconds to run after the last chunk
+        :rtype: dict
+        :return: {'lines', 'unread', 'rb'}
+    '''
+    clock = SimClock(1000)
+    uart = UART(1, 19200)
+    rb = RockBlock(clock=clock)
+    rb.en = EnablePin(clock)
+    rb.conn = uart
+    rb.conn_type = 'u'
+    rb.start()
+    replay = UARTReplay(uart, trace, clock, speedup)
+
+    while replay.running(drain):
+        replay.feed()
+        if before:
+            before(rb, replay)
+        rb.run()
+        if after:
+            after(rb, replay)
+        clock.advance(period)
+    return {
+        'lines': sum(data.count(b"\n") for _, data in trace),
+        'unread': uart.any(),
+        'rb': rb,
+    }
+
+
+def main(kind, path, speedup=None):
+    if kind == 'gps':
+        r = replay_gps(load_trace(path, 9600), speedup)
+        print("{sentences} sentences, {fixes} fixes".format(**r))
+        fix = r['gps'].fix
+        print("last fix: {:.5f} {:.5f} utc {} hdop {} sats {}".format(
+            fix.lat, fix.lon, fix.utc, fix.hdop, fix.sats))
+        print("sky: {}".format(r['gps'].sky.stats()))
+    elif kind == 'isu':
+        r = replay_isu(load_trace(path, 19200), speedup)
+        rb = r['rb']
+        print("{} lines, csq {}, registration {}, ring alert {}".format(
+            r['lines'], rb.link.csq, rb.registration.status, rb.ra_flag))
+    else:
+        raise ValueError("replay gps or isu traces")
+    if r['unread']:
+        print("{} bytes left unread".format(r['unread']))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4) or sys.argv[1] not in ('gps', 'isu'):
+        print(USAGE)
+        sys.exit(2)
+    main(sys.argv[1], sys.argv[2],
+         *[float(arg) for arg in sys.argv[3:]])